@@ -0,0 +1 @@
+"""Benchmarks for the KU Polls application. Run them with ``python -m benchmarks.<name>``."""
@@ -0,0 +1,169 @@
+"""
+Compare the latency and throughput of the poll pages under WSGI and ASGI.
+
+The requests go straight to Django's WSGI and ASGI handlers in this process,
+so the numbers measure Django and the database rather than a web server.
+WSGI requests are made from a pool of threads and ASGI requests from asyncio
+tasks. Each mode serves the index, detail and results pages in turn.
+
+Usage::
+
+    python -m benchmarks.asgi_vs_wsgi --requests 3000 --concurrency 64
+"""
+import argparse
+import asyncio
+import importlib
+import io
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.common import benchmark_database, create_poll, setup_django
+
+
+def use_async_views(enabled):
+    """Route the poll pages to the asynchronous views if `enabled`, else to the synchronous ones."""
+    from django.conf import settings
+    from django.urls import clear_url_caches
+    import mysite.urls
+    import polls.urls
+
+    settings.POLLS_ASYNC_VIEWS = enabled
+    importlib.reload(polls.urls)
+    importlib.reload(mysite.urls)
+    clear_url_caches()
+
+
+def run_wsgi(paths, concurrency):
+    """Request every path through the WSGI handler and return the latencies and elapsed seconds."""
+    from django.core.handlers.wsgi import WSGIHandler
+
+    handler = WSGIHandler()
+
+    def request(path):
+        environ = {
+            'REQUEST_METHOD': 'GET',
+            'PATH_INFO': path,
+            'QUERY_STRING': '',
+            'SERVER_NAME': 'testserver',
+            'SERVER_PORT': '80',
+            'SERVER_PROTOCOL': 'HTTP/1.1',
+            'HTTP_HOST': 'testserver',
+            'REMOTE_ADDR': '127.0.0.1',
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': 'http',
+            'wsgi.input': io.BytesIO(),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        statuses = []
+        start = time.perf_counter()
+        response = handler(environ, lambda status, headers: statuses.append(status))
+        try:
+            b''.join(response)
+        finally:
+            response.close()
+        latency = time.perf_counter() - start
+        assert statuses[0].startswith('200'), f"GET {path} returned {statuses[0]}"
+        return latency
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = list(executor.map(request, paths))
+    return latencies, time.perf_counter() - start
+
+
+def run_asgi(paths, concurrency):
+    """Request every path through the ASGI handler and return the latencies and elapsed seconds."""
+    from django.core.handlers.asgi import ASGIHandler
+
+    handler = ASGIHandler()
+
+    async def request(path):
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': 'GET',
+            'scheme': 'http',
+            'path': path,
+            'raw_path': path.encode(),
+            'root_path': '',
+            'query_string': b'',
+            'headers': [(b'host', b'testserver')],
+            'client': ('127.0.0.1', 0),
+            'server': ('testserver', 80),
+        }
+        body_sent = False
+        disconnected = asyncio.Event()
+        statuses = []
+
+        async def receive():
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+            await disconnected.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                statuses.append(message['status'])
+
+        start = time.perf_counter()
+        await handler(scope, receive, send)
+        latency = time.perf_counter() - start
+        disconnected.set()
+        assert statuses[0] == 200, f"GET {path} returned {statuses[0]}"
+        return latency
+
+    async def main():
+        queue = iter(paths)
+        latencies = []
+
+        async def worker():
+            for path in queue:
+                latencies.append(await request(path))
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return latencies, time.perf_counter() - start
+
+    return asyncio.run(main())
+
+
+def report(name, latencies, elapsed):
+    """Print the p50 and p99 latency and the requests per second of one run."""
+    quantiles = statistics.quantiles(latencies, n=100)
+    print(f"  {name:<22} p50 {quantiles[49] * 1000:8.2f} ms   p99 {quantiles[98] * 1000:8.2f} ms"
+          f"   {len(latencies) / elapsed:8.0f} requests/sec")
+
+
+def main():
+    """Parse the arguments, run each mode and print the results."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--choices', type=int, default=4)
+    args = parser.parse_args()
+
+    setup_django()
+    with benchmark_database():
+        question = create_poll(args.choices)
+        pages = ['/polls/', f'/polls/{question.pk}/', f'/polls/{question.pk}/results/']
+        paths = [pages[n % len(pages)] for n in range(args.requests)]
+
+        print(f"{args.requests} requests, concurrency {args.concurrency}")
+        use_async_views(False)
+        report('WSGI, sync views', *run_wsgi(paths, args.concurrency))
+        report('ASGI, sync views', *run_asgi(paths, args.concurrency))
+        use_async_views(True)
+        report('ASGI, async views', *run_asgi(paths, args.concurrency))
+        use_async_views(False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""Shared set-up code for the KU Polls benchmarks."""
+import contextlib
+import os
+import sys
+from pathlib import Path
+
+import django
+
+# Benchmarks are run from the project directory as ``python -m benchmarks.<name>``.
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+def setup_django():
+    """Configure Django with the project settings."""
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mysite.settings')
+    django.setup()
+
+
+@contextlib.contextmanager
+def benchmark_database(keepdb=False):
+    """
+    Create a throw-away test database for the duration of the block.
+
+    The database is created the same way ``manage.py test`` creates one, so a
+    benchmark never touches the data of the configured database.
+    """
+    from django.db import connection
+
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=keepdb)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=keepdb)
+
+
+def create_users(count, prefix='bench'):
+    """Create `count` users without usable passwords and return them."""
+    from django.contrib.auth.models import User
+
+    User.objects.bulk_create(User(username=f'{prefix}{n}', password='!') for n in range(count))
+    return list(User.objects.filter(username__startswith=prefix).order_by('pk'))
+
+
+def create_poll(num_choices, question_text='Benchmark question'):
+    """Create a published question with `num_choices` choices and return it."""
+    from polls.models import Choice, Question
+
+    question = Question.objects.create(question_text=question_text)
+    Choice.objects.bulk_create(Choice(question=question, choice_text=f'Choice {n}')
+                               for n in range(num_choices))
+    return question
+
+
+def seed_polls(questions, choices, users, votes, prefix='load'):
+    """
+    Create published questions with choices, users, and votes spread over them.
+
+    Each user votes at most once per question, so `votes` is capped at
+    `users` times `questions`. Return the questions and the users.
+    """
+    from polls.models import Choice, Question, Vote
+    from polls.tallies import rebuild_vote_counts
+
+    question_objs = Question.objects.bulk_create(
+        Question(question_text=f'Question {n}') for n in range(questions))
+    Choice.objects.bulk_create(Choice(question=question, choice_text=f'Choice {n}')
+                               for question in question_objs for n in range(choices))
+    choice_ids = {}
+    for choice_id, question_id in Choice.objects.order_by('pk').values_list('pk', 'question_id'):
+        choice_ids.setdefault(question_id, []).append(choice_id)
+    user_objs = create_users(users, prefix)
+
+    votes = min(votes, users * questions)
+    Vote.objects.bulk_create(
+        (Vote(user=user_objs[n // questions], question=question_objs[n % questions],
+              choice_id=choice_ids[question_objs[n % questions].pk][n % choices])
+         for n in range(votes)),
+        batch_size=2000,
+    )
+    rebuild_vote_counts()
+    return question_objs, user_objs
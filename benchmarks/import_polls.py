@@ -0,0 +1,106 @@
+"""
+Compare loading generated poll data with import_polls and with loaddata.
+
+Both commands run in their own process against the same throw-away database,
+so their peak memory can be measured separately.
+
+Usage::
+
+    python -m benchmarks.import_polls --votes 200000 --users 5000 --questions 100
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from io import StringIO
+from pathlib import Path
+
+from benchmarks.common import benchmark_database, setup_django
+
+
+def write_fixture(path, users, questions, choices, votes):
+    """Write a JSON array fixture with the given number of each kind of record."""
+    with open(path, 'w', encoding='utf-8') as file:
+        file.write('[\n')
+        first = True
+
+        def write(model, pk, **fields):
+            nonlocal first
+            if not first:
+                file.write(',\n')
+            first = False
+            file.write(json.dumps({'model': model, 'pk': pk, 'fields': fields}))
+
+        for n in range(1, users + 1):
+            write('auth.user', n, username=f'import{n}', password='!')
+        for n in range(1, questions + 1):
+            write('polls.question', n, question_text=f'Question {n}',
+                  pub_date='2024-08-23T14:57:40Z', end_date=None)
+            for c in range(choices):
+                write('polls.choice', (n - 1) * choices + c + 1, question=n,
+                      choice_text=f'Choice {c}')
+        for n in range(votes):
+            question = n % questions + 1
+            choice = (question - 1) * choices + n % choices + 1
+            write('polls.vote', n + 1, user=n // questions + 1, question=question, choice=choice)
+        file.write('\n]\n')
+
+
+def run_command(args, database_name):
+    """Run a manage.py command; return its elapsed seconds and peak memory in MiB."""
+    env = dict(os.environ, DATABASE_NAME=database_name)
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, 'manage.py', *args], env=env,
+                               stdout=subprocess.DEVNULL)
+    _, status, usage = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - start
+    if os.waitstatus_to_exitcode(status) != 0:
+        raise SystemExit(f"manage.py {' '.join(args)} failed")
+    # ru_maxrss is in KiB on Linux.
+    return elapsed, usage.ru_maxrss / 1024
+
+
+def main():
+    """Parse the arguments, generate the data, run both loaders and print the results."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--questions', type=int, default=50)
+    parser.add_argument('--choices', type=int, default=4)
+    parser.add_argument('--votes', type=int, default=50000)
+    parser.add_argument('--skip-loaddata', action='store_true',
+                        help="Only run import_polls, for sizes loaddata cannot handle.")
+    args = parser.parse_args()
+    if args.votes > args.users * args.questions:
+        parser.error("--votes can be at most --users times --questions")
+
+    setup_django()
+    from django.core.management import call_command
+    from django.db import connection
+    from polls.tallies import find_vote_count_mismatches
+
+    with tempfile.TemporaryDirectory() as directory, benchmark_database():
+        path = Path(directory) / 'polls.json'
+        write_fixture(path, args.users, args.questions, args.choices, args.votes)
+        records = args.users + args.questions * (args.choices + 1) + args.votes
+        database_name = connection.settings_dict['NAME']
+        print(f"{records} records ({args.votes} votes), {path.stat().st_size / 2**20:.1f} MiB")
+
+        runs = [('import_polls', ['import_polls', str(path)])]
+        if not args.skip_loaddata:
+            runs.append(('loaddata', ['loaddata', str(path)]))
+        for name, command in runs:
+            call_command('flush', interactive=False, verbosity=0)
+            elapsed, memory = run_command(command, database_name)
+            print(f"  {name:<13} {elapsed:8.1f} s  {records / elapsed:9.0f} records/sec  "
+                  f"peak memory {memory:7.1f} MiB")
+        if not args.skip_loaddata:
+            # loaddata leaves the stored counters at zero.
+            call_command('rebuild_vote_counts', stdout=StringIO())
+        assert find_vote_count_mismatches() == ([], [])
+
+
+if __name__ == '__main__':
+    main()
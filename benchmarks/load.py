@@ -0,0 +1,245 @@
+"""
+Load test the index, detail, results and vote pages with a mix of clients.
+
+The database is seeded with generated questions, choices, users and votes,
+then concurrent clients request pages, each picked at random according to
+the weights of --mix. Requests/sec, latency percentiles and queries per
+request are printed per page and written to a JSON file, and can be
+compared with the file of an earlier run.
+
+Usage::
+
+    python -m benchmarks.load --requests 5000 --concurrency 16 \\
+        --mix index=4,detail=2,results=3,vote=1 --output load.json --baseline previous.json
+"""
+import argparse
+import datetime
+import json
+import logging
+import platform
+import random
+import statistics
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.common import benchmark_database, seed_polls, setup_django
+
+PAGES = ('index', 'detail', 'results', 'vote')
+DEFAULT_MIX = 'index=4,detail=2,results=3,vote=1'
+
+
+def parse_mix(value):
+    """Parse a mix like ``index=4,vote=1`` into a dict of page weights."""
+    mix = {}
+    for part in value.split(','):
+        page, _, weight = part.partition('=')
+        if page not in PAGES or not weight.isdigit():
+            raise argparse.ArgumentTypeError(f"invalid mix entry {part!r}; use page=weight "
+                                             f"with a page of {', '.join(PAGES)}")
+        mix[page] = int(weight)
+    if not any(mix.values()):
+        raise argparse.ArgumentTypeError("the mix needs at least one positive weight")
+    return mix
+
+
+class Worker:
+    """One simulated client, logged in as its own user, that makes requests in turn."""
+
+    def __init__(self, user, questions, mix, seed):
+        """Log the client in as `user` and prepare its random page choices."""
+        from django.test import Client
+
+        self.client = Client()
+        self.client.force_login(user)
+        self.questions = questions
+        self.pages = list(mix)
+        self.weights = list(mix.values())
+        self.random = random.Random(seed)
+
+    def request(self):
+        """Make one request; return its page, latency, query count and whether it succeeded."""
+        from django.db import connection
+        from django.urls import reverse
+
+        page = self.random.choices(self.pages, self.weights)[0]
+        question = self.random.choice(self.questions)
+        queries = 0
+
+        def count_queries(execute, sql, params, many, context):
+            nonlocal queries
+            queries += 1
+            return execute(sql, params, many, context)
+
+        start = time.perf_counter()
+        with connection.execute_wrapper(count_queries):
+            if page == 'index':
+                response = self.client.get(reverse('polls:index'))
+            elif page == 'vote':
+                choice_id = self.random.choice(question.choice_ids)
+                response = self.client.post(reverse('polls:vote', args=(question.pk,)),
+                                            {'choice': choice_id})
+            else:
+                response = self.client.get(reverse(f'polls:{page}', args=(question.pk,)))
+        latency = time.perf_counter() - start
+        return page, latency, queries, response.status_code < 400
+
+
+def summarize(latencies, queries, errors, elapsed):
+    """Return the statistics of a set of requests as a dict."""
+    quantiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'requests_per_sec': round(len(latencies) / elapsed, 1),
+        'latency_ms': {
+            'mean': round(statistics.fmean(latencies) * 1000, 2),
+            'p50': round(quantiles[49] * 1000, 2),
+            'p90': round(quantiles[89] * 1000, 2),
+            'p99': round(quantiles[98] * 1000, 2),
+        },
+        'queries_per_request': round(statistics.fmean(queries), 2),
+    }
+
+
+def run(workers, requests):
+    """Spread `requests` requests over the workers' threads; return the results per page."""
+    lock = threading.Lock()
+    remaining = requests
+    samples = []
+
+    def work(worker):
+        """Make requests with `worker` until none are left."""
+        from django.db import connection
+
+        nonlocal remaining
+        try:
+            while True:
+                with lock:
+                    if remaining == 0:
+                        return
+                    remaining -= 1
+                samples.append(worker.request())
+        finally:
+            connection.close()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(workers)) as executor:
+        list(executor.map(work, workers))
+    elapsed = time.perf_counter() - start
+
+    results = {}
+    for page in PAGES:
+        page_samples = [sample for sample in samples if sample[0] == page]
+        if page_samples:
+            results[page] = summarize([s[1] for s in page_samples], [s[2] for s in page_samples],
+                                      sum(not s[3] for s in page_samples), elapsed)
+    results['all'] = summarize([s[1] for s in samples], [s[2] for s in samples],
+                               sum(not s[3] for s in samples), elapsed)
+    return results
+
+
+def environment():
+    """Return a description of the software the benchmark ran on."""
+    import django
+    from django.db import connection
+
+    try:
+        revision = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                                  text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        revision = None
+    return {
+        'git_revision': revision,
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'database': connection.vendor,
+        'started': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+    }
+
+
+def print_results(results, baseline=None):
+    """Print the results per page, with the change from `baseline` when given."""
+    print(f"  {'page':<8} {'req/s':>8} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} "
+          f"{'queries':>8} {'errors':>7}")
+    for page, stats in results.items():
+        latency = stats['latency_ms']
+        print(f"  {page:<8} {stats['requests_per_sec']:8.1f} {latency['p50']:8.2f} "
+              f"{latency['p90']:8.2f} {latency['p99']:8.2f} "
+              f"{stats['queries_per_request']:8.2f} {stats['errors']:7}")
+        previous = (baseline or {}).get(page)
+        if previous:
+            pairs = [(stats['requests_per_sec'], previous['requests_per_sec'])]
+            pairs += [(latency[key], previous['latency_ms'][key]) for key in ('p50', 'p90', 'p99')]
+            pairs += [(stats['queries_per_request'], previous['queries_per_request'])]
+            changes = [f"{(new - old) / old * 100:+7.1f}%" if old else f"{'n/a':>8}"
+                       for new, old in pairs]
+            print(f"  {'  vs base':<8} {' '.join(changes)}")
+
+
+def main():
+    """Parse the arguments, seed the database, run the load and report the results."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--questions', type=int, default=50)
+    parser.add_argument('--choices', type=int, default=4)
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--votes', type=int, default=10000)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--warmup', type=int, default=100,
+                        help="Requests made before measuring, to fill caches and pools.")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX,
+                        help=f"Relative weights of the pages (default {DEFAULT_MIX}).")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the random page choices.")
+    parser.add_argument('--output', help="JSON file to write the results to.")
+    parser.add_argument('--baseline', help="JSON file of an earlier run to compare with.")
+    args = parser.parse_args()
+    if args.concurrency > args.users:
+        parser.error("--concurrency can be at most --users, as each client is a different user")
+
+    setup_django()
+    # The vote view logs every vote; keep the report readable.
+    logging.disable(logging.INFO)
+    from django.test.utils import override_settings
+
+    # All clients share one IP address; measure the pages, not the rate limits.
+    override_settings(POLLS_RATE_LIMITS={}).enable()
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)['results']
+
+    with benchmark_database():
+        questions, users = seed_polls(args.questions, args.choices, args.users, args.votes)
+        from polls.models import Choice
+
+        choice_ids = {}
+        for choice_id, question_id in Choice.objects.values_list('pk', 'question_id'):
+            choice_ids.setdefault(question_id, []).append(choice_id)
+        for question in questions:
+            question.choice_ids = choice_ids[question.pk]
+
+        workers = [Worker(users[n], questions, args.mix, args.seed + n)
+                   for n in range(args.concurrency)]
+        run(workers, args.warmup)
+        results = run(workers, args.requests)
+        report = {
+            'config': {key: value for key, value in vars(args).items()
+                       if key not in ('output', 'baseline')},
+            'environment': environment(),
+            'results': results,
+        }
+
+    print(f"{args.requests} requests, concurrency {args.concurrency}, "
+          f"{args.questions} questions, {args.users} users, {args.votes} votes")
+    print_results(results, baseline)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+            file.write('\n')
+        print(f"Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""
+Measure what logging a vote costs the request thread in each logging mode.
+
+A vote request logs one record. This times that call with the console
+handler, which formats and writes on the calling thread, and with the
+queued JSON handler, which leaves both to a listener thread. --write-delay
+simulates a slow log destination such as a full pipe or a network disk.
+
+Usage::
+
+    python -m benchmarks.logging_cost --records 20000 --write-delay 0.0002
+"""
+import argparse
+import io
+import logging
+import time
+
+from polls.logs import JsonFormatter, QueuedStreamHandler
+
+
+class SlowStream(io.StringIO):
+    """A text stream whose writes take at least `delay` seconds."""
+
+    def __init__(self, delay):
+        """Create an empty stream with the given write delay."""
+        super().__init__()
+        self.delay = delay
+
+    def write(self, text):
+        """Wait, then store only the length of `text`, to keep memory flat."""
+        if self.delay:
+            time.sleep(self.delay)
+        return len(text)
+
+
+def log_votes(logger, records, lazy=True):
+    """Log `records` vote records like the vote view does; return microseconds per record."""
+    user, choice_id, question_id, ip_address = 'demo1', 7, 2, '203.0.113.9'
+    extra = {'event': 'vote', 'user_id': 3, 'question_id': question_id,
+             'choice_id': choice_id, 'ip': ip_address}
+    start = time.perf_counter()
+    for _ in range(records):
+        if lazy:
+            logger.info("%s voted for Choice %s in Question %s from %s",
+                        user, choice_id, question_id, ip_address, extra=extra)
+        else:
+            logger.info(f'{user} voted for Choice {choice_id} '
+                        f'in Question {question_id} from {ip_address}')
+    return (time.perf_counter() - start) / records * 1e6
+
+
+def make_logger(handler, level=logging.INFO):
+    """Return a fresh logger that only writes to `handler`."""
+    logger = logging.getLogger(f'benchmark.{id(handler)}')
+    logger.handlers = [handler]
+    logger.setLevel(level)
+    logger.propagate = False
+    return logger
+
+
+def main():
+    """Parse the arguments, time each logging mode and print the results."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--records', type=int, default=20000)
+    parser.add_argument('--write-delay', type=float, default=0.0,
+                        help="Seconds each write to the log destination takes.")
+    args = parser.parse_args()
+
+    print(f"{args.records} vote records, write delay {args.write_delay * 1e6:.0f} us")
+
+    console = logging.StreamHandler(SlowStream(args.write_delay))
+    console.setFormatter(logging.Formatter('{levelname} {message}', style='{'))
+    cost = log_votes(make_logger(console), args.records, lazy=False)
+    print(f"  console, f-string message       {cost:8.2f} us per record")
+
+    queued = QueuedStreamHandler(SlowStream(args.write_delay), maxsize=args.records)
+    queued.setFormatter(JsonFormatter())
+    cost = log_votes(make_logger(queued), args.records)
+    start = time.perf_counter()
+    queued.close()
+    drain = time.perf_counter() - start
+    print(f"  queued JSON, lazy message       {cost:8.2f} us per record "
+          f"(listener needed {drain:.2f} s more to write them)")
+
+    disabled = make_logger(logging.NullHandler(), level=logging.WARNING)
+    cost = log_votes(disabled, args.records, lazy=False)
+    print(f"  level disabled, f-string        {cost:8.2f} us per record")
+    cost = log_votes(disabled, args.records)
+    print(f"  level disabled, lazy            {cost:8.2f} us per record")
+
+
+if __name__ == '__main__':
+    main()
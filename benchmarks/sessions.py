@@ -0,0 +1,108 @@
+"""
+Count the queries per request spent on sessions and users.
+
+Anonymous and logged-in clients request the index, detail and results pages
+and vote, first with sessions and users read from the database on every
+request, then with cached_db sessions and cached users (or the storage given
+with --session-engine). The queries per request, and how many of them read
+sessions or users, are printed per page.
+
+Usage::
+
+    python -m benchmarks.sessions --requests 200
+    python -m benchmarks.sessions --session-engine django.contrib.sessions.backends.signed_cookies
+"""
+import argparse
+import logging
+
+from benchmarks.common import benchmark_database, create_users, seed_polls, setup_django
+
+DATABASE_SESSIONS = 'django.contrib.sessions.backends.db'
+CACHED_SESSIONS = 'django.contrib.sessions.backends.cached_db'
+
+
+def count_queries(client, method, url, data=None):
+    """Make one request; return its total queries and those on the session and user tables."""
+    from django.db import connection
+
+    counts = {'total': 0, 'auth': 0}
+
+    def count(execute, sql, params, many, context):
+        counts['total'] += 1
+        if '"django_session"' in sql or '"auth_user"' in sql:
+            counts['auth'] += 1
+        return execute(sql, params, many, context)
+
+    with connection.execute_wrapper(count):
+        getattr(client, method)(url, data)
+    return counts['total'], counts['auth']
+
+
+def measure(users, questions, requests):
+    """Return {(client kind, page): (queries, session and user queries)} per request."""
+    from django.core.cache import cache
+    from django.test import Client
+    from django.urls import reverse
+
+    cache.clear()
+    results = {}
+    for kind in ('anonymous', 'logged-in'):
+        client = Client()
+        if kind == 'logged-in':
+            client.force_login(users[0])
+        question = questions[0]
+        pages = {
+            'index': ('get', reverse('polls:index'), None),
+            'detail': ('get', reverse('polls:detail', args=(question.pk,)), None),
+            'results': ('get', reverse('polls:results', args=(question.pk,)), None),
+        }
+        if kind == 'logged-in':
+            pages['vote'] = ('post', reverse('polls:vote', args=(question.pk,)),
+                             {'choice': question.choice_set.first().pk})
+        for page, (method, url, data) in pages.items():
+            # The first request fills the caches.
+            count_queries(client, method, url, data)
+            totals = [count_queries(client, method, url, data) for _ in range(requests)]
+            results[kind, page] = (sum(t for t, _ in totals) / requests,
+                                   sum(a for _, a in totals) / requests)
+    return results
+
+
+def main():
+    """Parse the arguments, measure both configurations and print the results."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--requests', type=int, default=100,
+                        help="Requests per page and configuration.")
+    parser.add_argument('--session-engine', default=CACHED_SESSIONS,
+                        help=f"Session storage to compare with the database (default "
+                             f"{CACHED_SESSIONS}).")
+    parser.add_argument('--user-cache-timeout', type=int, default=300)
+    args = parser.parse_args()
+
+    setup_django()
+    # The vote view logs every vote; keep the report readable.
+    logging.disable(logging.INFO)
+    from django.test.utils import override_settings
+
+    with benchmark_database():
+        questions, _ = seed_polls(5, 4, 10, 20)
+        users = create_users(1, prefix='session')
+        with override_settings(SESSION_ENGINE=DATABASE_SESSIONS, POLLS_USER_CACHE_TIMEOUT=0,
+                               POLLS_RATE_LIMITS={}):
+            before = measure(users, questions, args.requests)
+        with override_settings(SESSION_ENGINE=args.session_engine,
+                               POLLS_USER_CACHE_TIMEOUT=args.user_cache_timeout,
+                               POLLS_RATE_LIMITS={}):
+            after = measure(users, questions, args.requests)
+
+    print(f"Queries per request (of which sessions and users), database sessions and "
+          f"users vs {args.session_engine.rsplit('.', 1)[-1]} sessions and users cached "
+          f"for {args.user_cache_timeout} s")
+    print(f"  {'client':<10} {'page':<8} {'before':>12} {'after':>12}")
+    for (kind, page), (total, auth) in before.items():
+        new_total, new_auth = after[kind, page]
+        print(f"  {kind:<10} {page:<8} {total:6.2f} ({auth:.2f}) {new_total:6.2f} ({new_auth:.2f})")
+
+
+if __name__ == '__main__':
+    main()
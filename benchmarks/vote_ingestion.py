@@ -0,0 +1,92 @@
+"""
+Compare vote throughput with the write-behind vote buffer turned off and on.
+
+Usage::
+
+    python -m benchmarks.vote_ingestion --votes 20000 --users 2000 --threads 16
+"""
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.common import benchmark_database, create_poll, create_users, setup_django
+
+
+def run_direct(votes, threads):
+    """Record every vote with Vote.objects.record() and return the elapsed seconds."""
+    from django.db import connection
+    from polls.models import Vote
+
+    def work(chunk):
+        try:
+            for user, choice in chunk:
+                Vote.objects.record(user, choice)
+        finally:
+            connection.close()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(work, [votes[n::threads] for n in range(threads)]))
+    return time.perf_counter() - start
+
+
+def run_buffered(votes, threads, batch_size, max_latency):
+    """Submit every vote to a VoteBuffer, wait until all are written, return the elapsed seconds."""
+    from polls.ingest import VoteBuffer
+
+    buffer = VoteBuffer(batch_size=batch_size, max_latency=max_latency)
+    buffer.start()
+
+    def work(chunk):
+        for user, choice in chunk:
+            buffer.submit(user.id, choice.question_id, choice.id)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(work, [votes[n::threads] for n in range(threads)]))
+    buffer.stop()
+    return time.perf_counter() - start
+
+
+def reset_votes():
+    """Delete every vote and reset the counters."""
+    from polls.models import Vote
+    from polls.tallies import rebuild_vote_counts
+
+    Vote.objects.all().delete()
+    rebuild_vote_counts()
+
+
+def main():
+    """Parse the arguments, run both modes and print the results."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--votes', type=int, default=5000)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--choices', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--max-latency', type=float, default=0.05)
+    args = parser.parse_args()
+
+    setup_django()
+    from polls.tallies import find_vote_count_mismatches
+
+    with benchmark_database():
+        users = create_users(args.users)
+        choices = list(create_poll(args.choices).choice_set.all())
+        votes = [(users[n % len(users)], choices[n % len(choices)]) for n in range(args.votes)]
+
+        direct = run_direct(votes, args.threads)
+        assert find_vote_count_mismatches() == ([], [])
+        reset_votes()
+        buffered = run_buffered(votes, args.threads, args.batch_size, args.max_latency)
+        assert find_vote_count_mismatches() == ([], [])
+
+    print(f"{args.votes} votes from {args.users} users, {args.threads} threads")
+    print(f"  buffer off: {args.votes / direct:10.0f} votes/sec")
+    print(f"  buffer on:  {args.votes / buffered:10.0f} votes/sec "
+          f"(batch size {args.batch_size}, max latency {args.max_latency}s)")
+
+
+if __name__ == '__main__':
+    main()
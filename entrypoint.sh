@@ -1,3 +1,14 @@
 #!/bin/sh
+# SERVER_MODE selects the server: dev (runserver), wsgi or asgi (gunicorn).
+set -e
 python ./manage.py migrate
-python ./manage.py runserver 0.0.0.0:8000
\ No newline at end of file
+case "${SERVER_MODE:-dev}" in
+  dev)
+    exec python ./manage.py runserver 0.0.0.0:8000 ;;
+  wsgi|asgi)
+    python ./manage.py collectstatic --noinput --verbosity 0
+    exec gunicorn --config gunicorn.conf.py ;;
+  *)
+    echo "Unknown SERVER_MODE '${SERVER_MODE}', use dev, wsgi or asgi" >&2
+    exit 1 ;;
+esac
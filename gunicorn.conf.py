@@ -0,0 +1,44 @@
+"""
+Gunicorn settings for serving KU Polls in production.
+
+Values are read from the environment or a .env file, like mysite/settings.py.
+SERVER_MODE=wsgi serves mysite.wsgi with threaded workers and SERVER_MODE=asgi
+serves mysite.asgi with uvicorn workers. Send SIGHUP to the master process to
+replace the workers gracefully, for example after a deploy.
+"""
+import multiprocessing
+
+import decouple
+
+SERVER_MODE = decouple.config("SERVER_MODE", default="wsgi")
+
+bind = decouple.config("BIND", default="0.0.0.0:8000")
+
+# Two workers per CPU plus one, so a worker is ready while others wait on I/O.
+workers = decouple.config("WEB_CONCURRENCY", cast=int,
+                          default=multiprocessing.cpu_count() * 2 + 1)
+
+# mysite/settings.py reads SERVER_MODE too: asgi workers take their database
+# connections from a pool rather than keeping them open per thread.
+if SERVER_MODE == "asgi":
+    wsgi_app = "mysite.asgi:application"
+    worker_class = "uvicorn.workers.UvicornWorker"
+else:
+    wsgi_app = "mysite.wsgi:application"
+    worker_class = "gthread"
+    threads = decouple.config("GUNICORN_THREADS", cast=int, default=4)
+
+# Seconds a silent worker may run before it is killed and replaced.
+timeout = decouple.config("GUNICORN_TIMEOUT", cast=int, default=30)
+# Seconds workers get to finish their requests on a restart or shutdown.
+graceful_timeout = decouple.config("GUNICORN_GRACEFUL_TIMEOUT", cast=int, default=30)
+keepalive = decouple.config("GUNICORN_KEEPALIVE", cast=int, default=5)
+
+# Replace each worker after this many requests, staggered by the jitter, to
+# bound the growth of per-process memory. 0 never replaces workers.
+max_requests = decouple.config("GUNICORN_MAX_REQUESTS", cast=int, default=1000)
+max_requests_jitter = decouple.config("GUNICORN_MAX_REQUESTS_JITTER", cast=int, default=100)
+
+accesslog = "-"
+errorlog = "-"
+loglevel = decouple.config("GUNICORN_LOG_LEVEL", default="info")
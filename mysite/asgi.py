@@ -2,6 +2,8 @@
 ASGI config for mysite project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Serve the project through it to hold many live results streams
+(``polls:results_stream``) open at once.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 
 from pathlib import Path
 from decouple import config, Csv
+from django.core.exceptions import ImproperlyConfigured
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -40,8 +41,16 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Static files are answered first, without the work of the rest.
+    'polls.staticfiles.StaticFilesMiddleware',
+    'polls.metrics.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'django.middleware.gzip.GZipMiddleware',
+    'polls.routers.ReadReplicaMiddleware',
+    'polls.ratelimit.RateLimitMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
+    # Inside GZipMiddleware, so ETags are computed from the uncompressed page.
+    'django.middleware.http.ConditionalGetMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -72,6 +81,10 @@ WSGI_APPLICATION = 'mysite.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
+# The server entrypoint.sh starts: dev, wsgi or asgi. It picks the defaults of
+# DATABASE_CONN_MAX_AGE and DATABASE_POOL below.
+SERVER_MODE = config("SERVER_MODE", default="dev")
+
 DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.postgresql",
@@ -79,10 +92,138 @@ DATABASES = {
         "USER": config("DATABASE_USER", default="pollsapp"),
         "PASSWORD": config("DATABASE_PASSWORD", default="pollspassword"),
         "HOST": config("DATABASE_HOST", default="localhost"),
-        "PORT": config("DATABASE_PORT", default="5432")
+        "PORT": config("DATABASE_PORT", default="5432"),
+        # Seconds to keep a connection open for reuse; 0 closes it after each request.
+        # Under ASGI, requests run their queries in changing threads, each of which
+        # would keep a connection of its own, so asgi uses the pool below instead.
+        "CONN_MAX_AGE": config("DATABASE_CONN_MAX_AGE", cast=int,
+                               default=60 if SERVER_MODE == "wsgi" else 0),
+        "CONN_HEALTH_CHECKS": config("DATABASE_CONN_HEALTH_CHECKS", cast=bool, default=False),
     }
 }
 
+# Share a psycopg connection pool between the threads of each server process.
+# Pooling replaces persistent connections, so CONN_MAX_AGE must stay 0. On by
+# default under asgi.
+if config("DATABASE_POOL", cast=bool, default=SERVER_MODE == "asgi"):
+    DATABASES["default"]["OPTIONS"] = {
+        "pool": {
+            "min_size": config("DATABASE_POOL_MIN_SIZE", cast=int, default=2),
+            "max_size": config("DATABASE_POOL_MAX_SIZE", cast=int, default=10),
+            "timeout": config("DATABASE_POOL_TIMEOUT", cast=float, default=10),
+        }
+    }
+
+# Read replicas, as comma-separated host or host:port entries. They use the
+# credentials of the primary and DATABASE_REPLICA_NAME, by default the
+# primary's database name. Poll pages read from them, see polls.routers.
+POLLS_READ_REPLICAS = []
+for number, replica in enumerate(config("DATABASE_REPLICAS", cast=Csv(), default=""), start=1):
+    host, _, port = replica.partition(":")
+    DATABASES[f"replica_{number}"] = {
+        **DATABASES["default"],
+        "NAME": config("DATABASE_REPLICA_NAME", default=DATABASES["default"]["NAME"]),
+        "HOST": host,
+        "PORT": port or DATABASES["default"]["PORT"],
+        # Tests read the replica through the test database of the primary.
+        "TEST": {"MIRROR": "default"},
+    }
+    POLLS_READ_REPLICAS.append(f"replica_{number}")
+
+DATABASE_ROUTERS = ["polls.routers.ReplicaRouter"]
+
+# Seconds after a write during which the same browser reads only from the
+# primary, so it sees its own writes despite replication lag.
+POLLS_READ_YOUR_WRITES_SECONDS = config("POLLS_READ_YOUR_WRITES_SECONDS", cast=float, default=5)
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+
+CACHES = {
+    "default": {
+        "BACKEND": config("CACHE_BACKEND",
+                          default="django.core.cache.backends.locmem.LocMemCache"),
+        "LOCATION": config("CACHE_LOCATION", default="ku-polls"),
+    }
+}
+
+# The local-memory cache is private to each server process, so sessions and
+# users are only cached by default when CACHE_BACKEND is shared, e.g. Redis.
+SHARED_CACHE = "locmem" not in CACHES["default"]["BACKEND"]
+
+# The cached results, index page and status change time, and the results
+# versions the ETags are made of, are invalidated in the process that handles
+# the change; other processes would keep serving stale pages and ETags. So the
+# production servers, which run WEB_CONCURRENCY workers, need a shared cache,
+# unless they run a single worker.
+if (SERVER_MODE in ("wsgi", "asgi") and not SHARED_CACHE
+        and config("WEB_CONCURRENCY", cast=int, default=0) != 1):
+    raise ImproperlyConfigured(
+        f"SERVER_MODE={SERVER_MODE} runs several worker processes, which cannot share the "
+        f"local-memory cache. Set CACHE_BACKEND and CACHE_LOCATION to a shared cache such "
+        f"as Redis, or set WEB_CONCURRENCY=1."
+    )
+
+# Session storage: "cached_db" reads sessions from the cache and falls back
+# to the database, "signed_cookies" keeps them in the browser, and "db" reads
+# the database on every request.
+SESSION_ENGINE = config(
+    "SESSION_ENGINE",
+    default="django.contrib.sessions.backends.cached_db" if SHARED_CACHE
+    else "django.contrib.sessions.backends.db",
+)
+
+# Seconds a logged-in user is cached, see polls.backends. 0 loads the user
+# from the database on every request.
+POLLS_USER_CACHE_TIMEOUT = config("POLLS_USER_CACHE_TIMEOUT", cast=int,
+                                  default=300 if SHARED_CACHE else 0)
+
+# Longest time, in seconds, the index page's question list is cached.
+POLLS_INDEX_CACHE_TIMEOUT = config("POLLS_INDEX_CACHE_TIMEOUT", cast=int, default=300)
+
+# Number of questions on each page of the index and of the JSON question list.
+POLLS_INDEX_PAGE_SIZE = config("POLLS_INDEX_PAGE_SIZE", cast=int, default=20)
+
+# Most open questions shown on the dashboard when no ?ids= are given.
+POLLS_DASHBOARD_SIZE = config("POLLS_DASHBOARD_SIZE", cast=int, default=100)
+
+# Longest time, in seconds, a question's computed results are cached.
+POLLS_RESULTS_CACHE_TIMEOUT = config("POLLS_RESULTS_CACHE_TIMEOUT", cast=int, default=300)
+
+# Age, in seconds, up to which cached results may be shown after new votes
+# arrive. 0 always shows the latest counts.
+POLLS_RESULTS_STALENESS = config("POLLS_RESULTS_STALENESS", cast=float, default=0)
+
+# Seconds between keep-alive comments on idle live results streams.
+POLLS_STREAM_HEARTBEAT = config("POLLS_STREAM_HEARTBEAT", cast=float, default=15)
+
+# Queries taking at least this many milliseconds are logged by the
+# polls.metrics logger, a fraction SAMPLE_RATE of them. 0 turns the log off.
+POLLS_SLOW_QUERY_MS = config("POLLS_SLOW_QUERY_MS", cast=float, default=200)
+POLLS_SLOW_QUERY_SAMPLE_RATE = config("POLLS_SLOW_QUERY_SAMPLE_RATE", cast=float, default=1.0)
+
+# Bearer token that lets a Prometheus server read /metrics/. Without one,
+# only staff members can read the metrics.
+POLLS_METRICS_TOKEN = config("POLLS_METRICS_TOKEN", default="")
+
+# Token-bucket limits of votes and logins, checked before the view runs, as
+# comma-separated scope:count/period:burst entries per URL name. The scope is
+# user or ip, and the period s, m or h. GET and HEAD requests are not limited.
+POLLS_RATE_LIMITS = {
+    "polls:vote": config("POLLS_RATE_LIMIT_VOTE", default="user:2/s:20,ip:50/s:200"),
+    "login": config("POLLS_RATE_LIMIT_LOGIN", default="ip:30/m:30"),
+}
+
+# Where the token buckets are kept: polls.ratelimit.LocalBuckets counts per
+# server process, polls.ratelimit.CacheBuckets across all of them through
+# the shared cache.
+POLLS_RATE_LIMIT_BACKEND = config("POLLS_RATE_LIMIT_BACKEND",
+                                  default="polls.ratelimit.LocalBuckets")
+
+# Addresses or networks of the reverse proxies in front of the server. Only
+# their X-Forwarded-For headers are believed when finding a client's IP.
+POLLS_TRUSTED_PROXIES = config("POLLS_TRUSTED_PROXIES", cast=Csv(), default="")
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -102,10 +243,22 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 AUTHENTICATION_BACKENDS = [
-    # username & password authentication
+    # username & password authentication, with the logged-in user cached
+    'polls.backends.CachedModelBackend',
+    # Django's default, kept so sessions logged in before the cache stay valid
     'django.contrib.auth.backends.ModelBackend',
 ]
 
+# Serve the index, detail, results and vote pages with asynchronous views.
+# Only worthwhile when running under an ASGI server (mysite.asgi).
+POLLS_ASYNC_VIEWS = config("POLLS_ASYNC_VIEWS", cast=bool, default=False)
+
+# Write-behind vote ingestion: when enabled, votes are queued in-process and
+# written in batches of up to BATCH_SIZE, at most MAX_LATENCY seconds later.
+POLLS_VOTE_BUFFER_ENABLED = config("POLLS_VOTE_BUFFER_ENABLED", cast=bool, default=False)
+POLLS_VOTE_BUFFER_BATCH_SIZE = config("POLLS_VOTE_BUFFER_BATCH_SIZE", cast=int, default=500)
+POLLS_VOTE_BUFFER_MAX_LATENCY = config("POLLS_VOTE_BUFFER_MAX_LATENCY", cast=float, default=0.05)
+
 LOGIN_REDIRECT_URL = 'polls:index'  # after login, show list of polls
 LOGOUT_REDIRECT_URL = 'login'       # after logout, return to login page
 
@@ -125,11 +278,51 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+# collectstatic copies the static files here under names with a hash of
+# their contents, with gzip (and brotli) copies, see polls.staticfiles.
+STATIC_ROOT = config("STATIC_ROOT", default=str(BASE_DIR / 'staticfiles'))
+
+STORAGES = {
+    "default": {
+        "BACKEND": "django.core.files.storage.FileSystemStorage",
+    },
+    "staticfiles": {
+        "BACKEND": "polls.staticfiles.CompressedManifestStaticFilesStorage",
+    },
+}
+
+# Serve the collected static files from the Django process. Turn off when a
+# web server or CDN serves STATIC_ROOT instead.
+POLLS_SERVE_STATIC = config("POLLS_SERVE_STATIC", cast=bool, default=True)
+
+# Seconds browsers may cache static files whose names have no content hash.
+# Hashed names are cached for a year.
+POLLS_STATIC_MAX_AGE = config("POLLS_STATIC_MAX_AGE", cast=int, default=60)
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Logging mode: "console" writes text lines from the request thread, and
+# "queued-json" hands records to a background thread that writes JSON lines.
+POLLS_LOG_MODE = config("POLLS_LOG_MODE", default="console")
+
+LOG_HANDLERS = {
+    'console': {
+        'level': 'DEBUG',
+        'class': 'logging.StreamHandler',
+        'formatter': 'simple',
+        'filters': ['rate_limit'],
+    },
+    'queued-json': {
+        'level': 'DEBUG',
+        'class': 'polls.logs.QueuedStreamHandler',
+        'formatter': 'json',
+        'filters': ['rate_limit'],
+    },
+}
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -142,19 +335,32 @@ LOGGING = {
             'format': '{levelname} {message}',
             'style': '{',
         },
+        'json': {
+            '()': 'polls.logs.JsonFormatter',
+        },
     },
-    'handlers': {
-        'console': {
-            'level': 'DEBUG',
-            'class': 'logging.StreamHandler',
-            'formatter': 'simple',
+    'filters': {
+        # Failed logins and rate-limited requests can arrive in floods; log at
+        # most RATE a second after a burst.
+        'rate_limit': {
+            '()': 'polls.logs.RateLimitFilter',
+            'events': ['login_failed', 'rate_limited'],
+            'rate': config("POLLS_LOG_LOGIN_FAILED_RATE", cast=float, default=1),
+            'burst': config("POLLS_LOG_LOGIN_FAILED_BURST", cast=int, default=20),
         },
     },
+    'handlers': {
+        'console': LOG_HANDLERS[POLLS_LOG_MODE],
+    },
     'loggers': {
         'polls': {
             'handlers': ['console'],
             'level': 'DEBUG',
             'propagate': True,
         },
+        # DEBUG logs the metrics of every request.
+        'polls.metrics': {
+            'level': config("POLLS_METRICS_LOG_LEVEL", default="INFO"),
+        },
     },
 }
@@ -1,10 +1,13 @@
 from django.contrib import admin
 from django.views.generic.base import RedirectView
 from django.urls import include, path
+from polls.views import health_check, metrics
 
 urlpatterns = [
     path('', RedirectView.as_view(url='polls/')),
     path('polls/', include('polls.urls')),
     path('admin/', admin.site.urls),
+    path('health/', health_check, name='health'),
+    path('metrics/', metrics, name='metrics'),
     path('accounts/', include('django.contrib.auth.urls')),
 ]
@@ -3,6 +3,10 @@ This file configures the Django admin interface
 for the Choice and Question models.
 """
 from django.contrib import admin
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from .exports import EXPORT_FORMATS, aiter_export, export
 from .models import Choice, Question
 
 
@@ -15,6 +19,44 @@ class ChoiceInline(admin.TabularInline):
     extra = 3
 
 
+class VotingStatusFilter(admin.SimpleListFilter):
+    """
+    Filters questions in the admin by whether they are open for voting.
+    """
+    title = 'voting status'
+    parameter_name = 'status'
+
+    def lookups(self, request, model_admin):
+        """Return the open and closed choices of the filter."""
+        return [('open', 'Open'), ('closed', 'Closed')]
+
+    def queryset(self, request, queryset):
+        """Return the open or closed questions of `queryset`, or all of them."""
+        if self.value() == 'open':
+            return queryset.open_for_voting()
+        if self.value() == 'closed':
+            return queryset.closed()
+        return queryset
+
+
+def make_export_action(kind, export_format):
+    """Return an admin action that streams an export of the selected questions."""
+    @admin.action(description=f"Export {kind} of selected questions as {export_format.upper()}")
+    def export_action(modeladmin, request, queryset):
+        """Stream the export of the selected questions as a file download."""
+        lines = export(kind, export_format, queryset)
+        if isinstance(request, ASGIRequest):
+            # An ASGI server would otherwise read the whole export into memory first.
+            lines = aiter_export(lines)
+        response = StreamingHttpResponse(lines, content_type=EXPORT_FORMATS[export_format])
+        filename = f"polls-{kind}-{timezone.now():%Y%m%d-%H%M%S}.{export_format}"
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+    export_action.__name__ = f'export_{kind}_{export_format}'
+    return export_action
+
+
 class QuestionAdmin(admin.ModelAdmin):
     """
     Configures the admin interface for the Question model.
@@ -25,9 +67,11 @@ class QuestionAdmin(admin.ModelAdmin):
                               'classes': ['collapse']}),
     ]
     inlines = [ChoiceInline]
-    list_display = ('question_text', 'pub_date', 'was_published_recently')
-    list_filter = ['pub_date']
+    list_display = ('question_text', 'pub_date', 'status', 'was_published_recently')
+    list_filter = ['pub_date', VotingStatusFilter]
     search_fields = ['question_text']
+    actions = [make_export_action(kind, export_format)
+               for kind in ('results', 'votes') for export_format in EXPORT_FORMATS]
 
 
 admin.site.register(Question, QuestionAdmin)
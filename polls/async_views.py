@@ -0,0 +1,164 @@
+"""
+Asynchronous versions of the KU Polls page views.
+
+They are used instead of the views in polls.views when POLLS_ASYNC_VIEWS is
+set, and read the database through Django's async ORM so that an ASGI server
+can serve many requests per worker. Writes that need a transaction, such as
+Vote.objects.record(), still run in a worker thread.
+"""
+import logging
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib import messages
+from django.contrib.auth.decorators import login_required
+from django.http import Http404, HttpResponseRedirect
+from django.shortcuts import render
+from django.urls import reverse
+from django.views import View
+from .cache import (aget_index_page, arefresh_statuses_if_due, bump_results_version,
+                    get_results, results_fragment_key, results_fragment_timeout)
+from .ingest import get_vote_buffer
+from .live import broadcaster
+from .models import Choice, Question, Vote
+from .listing import InvalidCursor
+from .ratelimit import get_client_ip
+from .views import index_arguments, log_fields
+
+logger = logging.getLogger('polls')
+
+
+async def load_user(request):
+    """Load the request's user asynchronously, so templates can use it without a query."""
+    request.user = await request.auser()
+    return request.user
+
+
+class IndexView(View):
+    """Displays a page of the latest published questions, optionally searched."""
+
+    template_name = 'polls/index.html'
+
+    async def get(self, request):
+        """Render one page of the published questions, each with its status."""
+        arguments = index_arguments(request)
+        try:
+            page = await aget_index_page(**arguments)
+        except InvalidCursor:
+            raise Http404("Invalid page.")
+        await load_user(request)
+        return render(request, self.template_name, {
+            'latest_question_list': page.questions,
+            'page': page,
+            'query': arguments['query'],
+        })
+
+
+class DetailView(View):
+    """Displays details of a specific question."""
+
+    template_name = 'polls/detail.html'
+
+    async def get(self, request, pk):
+        """
+        Handle GET requests for question details.
+
+        Redirect to index if voting is not allowed.
+        Show last vote if authenticated.
+        """
+        await arefresh_statuses_if_due()
+        try:
+            question = await Question.objects.visible().with_choices().aget(pk=pk)
+        except Question.DoesNotExist:
+            messages.error(request, "This question is not available.")
+            return HttpResponseRedirect(reverse('polls:index'))
+
+        if question.status != Question.Status.OPEN:
+            messages.error(request, "Voting is not allowed for this question.")
+            return HttpResponseRedirect(reverse('polls:index'))
+
+        this_user = await load_user(request)
+        last_vote = None
+        if this_user.is_authenticated:
+            last_vote = await (Vote.objects.filter(user=this_user, question=question)
+                               .values_list('choice_id', flat=True).afirst())
+        return render(request, self.template_name,
+                      {'question': question, 'last_vote': last_vote})
+
+
+class ResultsView(View):
+    """Displays the results for a specific question."""
+
+    template_name = 'polls/results.html'
+
+    async def get(self, request, pk):
+        """Render the cached vote tallies of a published question."""
+        await arefresh_statuses_if_due()
+        try:
+            question = await Question.objects.visible().aget(pk=pk)
+        except Question.DoesNotExist:
+            raise Http404("No question found.")
+        await load_user(request)
+        return render(request, self.template_name, {
+            'question': question,
+            'results': await sync_to_async(get_results)(question.id),
+            'results_fragment_key': await sync_to_async(results_fragment_key)(question.id),
+            'results_fragment_timeout': results_fragment_timeout(),
+        })
+
+
+@login_required
+async def vote(request, question_id):
+    """Handle voting for a specific question."""
+    this_user = await load_user(request)
+    ip_address = get_client_ip(request)
+
+    try:
+        # The choice and its question are read with one query.
+        selected_choice = await Choice.objects.select_related('question').aget(
+            pk=request.POST['choice'], question_id=question_id)
+        question = selected_choice.question
+    except (KeyError, ValueError, Choice.DoesNotExist):
+        try:
+            question = await Question.objects.with_choices().aget(pk=question_id)
+        except Question.DoesNotExist:
+            raise Http404("No question found.")
+        logger.warning("%s failed to vote in %s from %s",
+                       this_user.username, question.question_text, ip_address,
+                       extra=log_fields('vote_failed', this_user, ip_address,
+                                        question_id=question.id))
+        return render(request, 'polls/detail.html', {
+            'question': question,
+            'error_message': "You didn't select a choice.",
+        })
+
+    if settings.POLLS_VOTE_BUFFER_ENABLED:
+        get_vote_buffer().submit(this_user.id, question.id, selected_choice.id)
+        logger.info("%s voted for Choice %s in Question %s from %s (buffered)",
+                    this_user.username, selected_choice.id, question.id, ip_address,
+                    extra=log_fields('vote', this_user, ip_address, question_id=question.id,
+                                     choice_id=selected_choice.id, buffered=True))
+        messages.success(request, f"Your vote for "
+                                  f"'{selected_choice.choice_text}' was received")
+        return HttpResponseRedirect(reverse('polls:results', args=(question_id,)))
+
+    previous_choice_id = await sync_to_async(Vote.objects.record)(this_user, selected_choice)
+    version = await sync_to_async(bump_results_version)(question.id)
+    if previous_choice_id != selected_choice.id:
+        deltas = {selected_choice.id: 1}
+        if previous_choice_id is not None:
+            deltas[previous_choice_id] = -1
+        broadcaster.publish(question.id, version, deltas)
+
+    logger.info("%s voted for Choice %s in Question %s from %s",
+                this_user.username, selected_choice.id, question.id, ip_address,
+                extra=log_fields('vote', this_user, ip_address, question_id=question.id,
+                                 choice_id=selected_choice.id,
+                                 previous_choice_id=previous_choice_id))
+    if previous_choice_id is None:
+        messages.success(request, f"You voted for "
+                                  f"'{selected_choice.choice_text}'")
+    else:
+        messages.success(request, f"Your vote was updated to "
+                                  f"'{selected_choice.choice_text}'")
+
+    return HttpResponseRedirect(reverse('polls:results', args=(question_id,)))
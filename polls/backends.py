@@ -0,0 +1,43 @@
+"""
+Authentication backend that loads the logged-in user from the cache.
+
+Django loads the user of every request that uses request.user, which is one
+query per page view for a logged-in user. CachedModelBackend keeps each user
+in the cache for POLLS_USER_CACHE_TIMEOUT seconds instead. Saving or deleting
+a user drops the cached copy, see polls.signals, so a password change still
+logs out the user's other sessions at once.
+"""
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+from .cache import stats
+
+USER_CACHE_KEY = 'polls:user:{pk}'
+
+
+def invalidate_user(user_id):
+    """Drop the cached copy of the user with `user_id`."""
+    cache.delete(USER_CACHE_KEY.format(pk=user_id))
+
+
+class CachedModelBackend(ModelBackend):
+    """ModelBackend that serves get_user() from the cache."""
+
+    def get_user(self, user_id):
+        """Return the active user with `user_id`, from the cache if possible, or None."""
+        timeout = settings.POLLS_USER_CACHE_TIMEOUT
+        if not timeout:
+            return super().get_user(user_id)
+        key = USER_CACHE_KEY.format(pk=user_id)
+        user = cache.get(key)
+        if user is None:
+            stats.miss('user')
+            try:
+                user = get_user_model()._default_manager.get(pk=user_id)
+            except get_user_model().DoesNotExist:
+                return None
+            cache.set(key, user, timeout=timeout)
+        else:
+            stats.hit('user')
+        return user if self.user_can_authenticate(user) else None
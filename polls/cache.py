@@ -0,0 +1,306 @@
+"""Caching of computed poll data for the polls application."""
+import contextlib
+import math
+import threading
+import time
+from collections import Counter
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from .listing import aget_page, get_page, search_questions
+from .metrics import count_cache_lookup
+from .models import Choice, Question
+from .routers import primary_reads
+
+INDEX_CACHE_KEY = 'polls:index'
+STATUS_CHANGE_CACHE_KEY = 'polls:status-change'
+RESULTS_VERSION_KEY = 'polls:results-version:{question_id}'
+RESULTS_CACHE_KEY = 'polls:results:{question_id}:{version}'
+RECENT_RESULTS_CACHE_KEY = 'polls:results-recent:{question_id}'
+
+
+class CacheStats:
+    """Thread-safe hit and miss counters for the polls caches of this process."""
+
+    def __init__(self):
+        """Start with all counters at zero."""
+        self._lock = threading.Lock()
+        self._hits = Counter()
+        self._misses = Counter()
+
+    def hit(self, name):
+        """Count a cache hit for the cache called `name`."""
+        count_cache_lookup(True)
+        with self._lock:
+            self._hits[name] += 1
+
+    def miss(self, name):
+        """Count a cache miss for the cache called `name`."""
+        count_cache_lookup(False)
+        with self._lock:
+            self._misses[name] += 1
+
+    def snapshot(self):
+        """Return a dict mapping each cache name to its hits, misses and hit ratio."""
+        with self._lock:
+            names = sorted(set(self._hits) | set(self._misses))
+            result = {}
+            for name in names:
+                hits, misses = self._hits[name], self._misses[name]
+                result[name] = {'hits': hits, 'misses': misses,
+                                'hit_ratio': hits / (hits + misses)}
+            return result
+
+    def reset(self):
+        """Set all counters back to zero."""
+        with self._lock:
+            self._hits.clear()
+            self._misses.clear()
+
+
+stats = CacheStats()
+
+
+def get_index_page(after=None, before=None, query=''):
+    """
+    Return a QuestionPage of the published questions for the index page, newest first.
+
+    `after` and `before` are page cursors and `query` is search text, see
+    polls.listing. Each question's stored `status` is brought up to date
+    first. The first page without a search is cached until a question or
+    choice changes, or until the next status change, whichever comes first.
+    """
+    first_page = not (after or before or query)
+    if first_page:
+        page = cache.get(INDEX_CACHE_KEY)
+        if page is not None:
+            stats.hit('index')
+            return page
+        stats.miss('index')
+    now = timezone.now()
+    next_change = refresh_statuses_if_due(now)
+    questions = search_questions(Question.objects.visible(), query)
+    # The cached first page is read from the primary, see primary_reads().
+    with primary_reads() if first_page else contextlib.nullcontext():
+        page = get_page(questions, after, before)
+    if first_page:
+        cache.set(INDEX_CACHE_KEY, page, timeout=_timeout_before(next_change, now))
+    return page
+
+
+async def aget_index_page(after=None, before=None, query=''):
+    """Asynchronous version of get_index_page(), using the async cache and ORM APIs."""
+    first_page = not (after or before or query)
+    if first_page:
+        page = await cache.aget(INDEX_CACHE_KEY)
+        if page is not None:
+            stats.hit('index')
+            return page
+        stats.miss('index')
+    now = timezone.now()
+    next_change = await arefresh_statuses_if_due(now)
+    questions = search_questions(Question.objects.visible(), query)
+    with primary_reads() if first_page else contextlib.nullcontext():
+        page = await aget_page(questions, after, before)
+    if first_page:
+        await cache.aset(INDEX_CACHE_KEY, page, timeout=_timeout_before(next_change, now))
+    return page
+
+
+def _timeout_before(next_change, now):
+    """Return the index cache timeout, capped at the `next_change` timestamp."""
+    timeout = settings.POLLS_INDEX_CACHE_TIMEOUT
+    if next_change != math.inf:
+        seconds = math.floor(next_change - now.timestamp()) + 1
+        timeout = min(timeout, seconds)
+    return timeout
+
+
+def refresh_statuses(now=None):
+    """
+    Bring the stored status of every question up to date.
+
+    The time of the next status change is remembered in the cache, so that
+    refresh_statuses_if_due() knows when to refresh again. Return the
+    number of questions changed and that time as a timestamp, which is
+    math.inf if no change is coming.
+    """
+    if now is None:
+        now = timezone.now()
+    changed = Question.objects.refresh_status(now)
+    with primary_reads():
+        next_change = Question.objects.next_status_change(now)
+    next_change = next_change.timestamp() if next_change is not None else math.inf
+    cache.set(STATUS_CHANGE_CACHE_KEY, next_change, timeout=None)
+    if changed:
+        invalidate_index()
+    return changed, next_change
+
+
+def refresh_statuses_if_due(now=None):
+    """
+    Refresh the stored statuses if a status change has come due.
+
+    That costs one cache read, and the refresh queries only when a pub_date
+    or end_date has passed since the last refresh, so views can rely on the
+    stored status even without the status scheduler running. Return the
+    timestamp of the next status change, see refresh_statuses().
+    """
+    if now is None:
+        now = timezone.now()
+    next_change = cache.get(STATUS_CHANGE_CACHE_KEY)
+    if next_change is None or next_change <= now.timestamp():
+        next_change = refresh_statuses(now)[1]
+    return next_change
+
+
+async def arefresh_statuses_if_due(now=None):
+    """Asynchronous version of refresh_statuses_if_due()."""
+    if now is None:
+        now = timezone.now()
+    next_change = await cache.aget(STATUS_CHANGE_CACHE_KEY)
+    if next_change is None or next_change <= now.timestamp():
+        next_change = (await sync_to_async(refresh_statuses)(now))[1]
+    return next_change
+
+
+def invalidate_status_change():
+    """Forget the time of the next status change, so the next check refreshes the statuses."""
+    cache.delete(STATUS_CHANGE_CACHE_KEY)
+    transaction.on_commit(lambda: cache.delete(STATUS_CHANGE_CACHE_KEY))
+
+
+def invalidate_index():
+    """Drop the cached index page, now and again once the current transaction commits."""
+    cache.delete(INDEX_CACHE_KEY)
+    transaction.on_commit(lambda: cache.delete(INDEX_CACHE_KEY))
+
+
+def get_results_version(question_id):
+    """
+    Return the current results version of a question.
+
+    A missing version starts at the current time in nanoseconds rather than at
+    zero, so versions never repeat after the cache evicts the counter.
+    """
+    return get_results_versions([question_id])[question_id]
+
+
+def get_results_versions(question_ids):
+    """Return a dict mapping each of `question_ids` to its current results version."""
+    keys = {RESULTS_VERSION_KEY.format(question_id=question_id): question_id
+            for question_id in question_ids}
+    found = cache.get_many(keys)
+    missing = [key for key in keys if key not in found]
+    if missing:
+        for key in missing:
+            cache.add(key, time.time_ns(), timeout=None)
+        found.update(cache.get_many(missing))
+    return {keys[key]: version for key, version in found.items()}
+
+
+def bump_results_version(question_id):
+    """
+    Start a new results version for a question, so its cached results are recomputed.
+
+    Return the new version.
+    """
+    key = RESULTS_VERSION_KEY.format(question_id=question_id)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.add(key, time.time_ns(), timeout=None)
+        return cache.get(key)
+
+
+def get_results(question_id):
+    """
+    Return the vote tallies of a question as a dict.
+
+    The dict has a `choices` list, with the `id`, `choice_text` and `votes` of
+    every choice, the `total` number of votes and the results `version` the
+    tallies were computed for. Tallies are cached per results version. When
+    POLLS_RESULTS_STALENESS is set, tallies computed within that many seconds
+    are returned even if votes have been cast since.
+    """
+    return get_many_results([question_id])[question_id]
+
+
+def get_many_results(question_ids):
+    """
+    Return a dict mapping each of `question_ids` to its tallies, see get_results().
+
+    Cached tallies are read with one cache round trip per step, and all missing
+    tallies are computed together with a single query.
+    """
+    question_ids = list(dict.fromkeys(question_ids))
+    staleness = settings.POLLS_RESULTS_STALENESS
+    results = {}
+    if staleness:
+        recent = cache.get_many([RECENT_RESULTS_CACHE_KEY.format(question_id=question_id)
+                                 for question_id in question_ids])
+        for question_id in question_ids:
+            found = recent.get(RECENT_RESULTS_CACHE_KEY.format(question_id=question_id))
+            if found is not None:
+                results[question_id] = found
+
+    wanted = [question_id for question_id in question_ids if question_id not in results]
+    versions = get_results_versions(wanted)
+    keys = {question_id: RESULTS_CACHE_KEY.format(question_id=question_id,
+                                                  version=versions[question_id])
+            for question_id in wanted}
+    cached = cache.get_many(keys.values())
+    missing = []
+    for question_id in wanted:
+        found = cached.get(keys[question_id])
+        if found is None:
+            missing.append(question_id)
+        else:
+            results[question_id] = found
+
+    for question_id in question_ids:
+        if question_id in results:
+            stats.hit('results')
+        else:
+            stats.miss('results')
+    if missing:
+        computed = {question_id: {'choices': [], 'total': 0, 'version': versions[question_id]}
+                    for question_id in missing}
+        # Cached under the current version, so read from the primary, see primary_reads().
+        with primary_reads():
+            choices = list(Choice.objects.filter(question_id__in=missing).order_by('pk')
+                           .values('question_id', 'id', 'choice_text', votes=F('vote_count')))
+        for choice in choices:
+            tally = computed[choice.pop('question_id')]
+            tally['choices'].append(choice)
+            tally['total'] += choice['votes']
+        cache.set_many({keys[question_id]: tally for question_id, tally in computed.items()},
+                       timeout=settings.POLLS_RESULTS_CACHE_TIMEOUT)
+        results.update(computed)
+        if staleness:
+            cache.set_many({RECENT_RESULTS_CACHE_KEY.format(question_id=question_id): tally
+                            for question_id, tally in computed.items()},
+                           timeout=staleness)
+    return results
+
+
+def results_fragment_key(question_id):
+    """
+    Return the value the cached results fragment of a question is keyed on.
+
+    That is the results version, or 'recent' when stale results are allowed,
+    in which case the fragment expires after POLLS_RESULTS_STALENESS seconds.
+    """
+    if settings.POLLS_RESULTS_STALENESS:
+        return 'recent'
+    return get_results_version(question_id)
+
+
+def results_fragment_timeout():
+    """Return the timeout, in seconds, of a cached results fragment."""
+    if settings.POLLS_RESULTS_STALENESS:
+        return math.ceil(settings.POLLS_RESULTS_STALENESS)
+    return settings.POLLS_RESULTS_CACHE_TIMEOUT
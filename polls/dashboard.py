@@ -0,0 +1,95 @@
+"""
+The results dashboard: the tallies of many questions, cached as one unit.
+
+A dashboard is keyed on the results versions of its questions, so it is
+reused until any of them gets a vote, and it is stored as gzipped JSON that
+can be sent to the client as it is. Building it takes one query for the
+questions and, when it is not cached, one more for all their choices, however
+many questions it shows.
+"""
+import gzip
+import hashlib
+import json
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from .cache import get_results_versions, refresh_statuses_if_due, stats
+from .models import Choice, Question
+from .routers import primary_reads
+
+DASHBOARD_CACHE_KEY = 'polls:dashboard:{digest}'
+
+
+class Dashboard:
+    """The gzipped JSON of a dashboard and the ETag that identifies its contents."""
+
+    def __init__(self, etag, body):
+        """Create a dashboard from its ETag and gzipped JSON `body`."""
+        self.etag = etag
+        self.body = body
+
+    def json(self):
+        """Return the dashboard's JSON text, uncompressed."""
+        return gzip.decompress(self.body).decode()
+
+    def data(self):
+        """Return the dashboard as a dict with a `questions` list."""
+        return json.loads(self.json())
+
+
+def dashboard_questions(question_ids=None):
+    """
+    Return the (id, question_text) pairs of the questions on a dashboard.
+
+    Those are the published questions among `question_ids`, in the given
+    order, or if `question_ids` is None, the newest POLLS_DASHBOARD_SIZE
+    open questions.
+    """
+    refresh_statuses_if_due()
+    if question_ids is None:
+        return list(Question.objects.filter(status=Question.Status.OPEN)
+                    .order_by('-pub_date', '-pk')
+                    .values_list('pk', 'question_text')[:settings.POLLS_DASHBOARD_SIZE])
+    texts = dict(Question.objects.visible().filter(pk__in=question_ids)
+                 .values_list('pk', 'question_text'))
+    return [(pk, texts[pk]) for pk in question_ids if pk in texts]
+
+
+def build_dashboard(questions, versions):
+    """Return the dashboard dict of `questions`, read with a single query for all choices."""
+    entries = {pk: {'id': pk, 'question_text': text, 'version': versions[pk],
+                    'choices': [], 'total': 0}
+               for pk, text in questions}
+    # Cached under the results versions, so read from the primary, see primary_reads().
+    with primary_reads():
+        choices = list(Choice.objects.filter(question_id__in=entries).order_by('pk')
+                       .values_list('question_id', 'id', 'choice_text', 'vote_count'))
+    for question_id, pk, choice_text, votes in choices:
+        entry = entries[question_id]
+        entry['choices'].append({'id': pk, 'choice_text': choice_text, 'votes': votes})
+        entry['total'] += votes
+    return {'questions': list(entries.values())}
+
+
+def get_dashboard(question_ids=None):
+    """
+    Return the Dashboard of the given questions, or of all open questions.
+
+    See dashboard_questions() for which questions are shown. The dashboard
+    is cached for POLLS_RESULTS_CACHE_TIMEOUT seconds, or until one of its
+    questions gets a vote or changes.
+    """
+    questions = dashboard_questions(question_ids)
+    versions = get_results_versions([pk for pk, _ in questions])
+    signature = ','.join(f'{pk}:{versions[pk]}' for pk, _ in questions)
+    etag = 'dashboard-' + hashlib.sha1(signature.encode()).hexdigest()
+    key = DASHBOARD_CACHE_KEY.format(digest=etag)
+    body = cache.get(key)
+    if body is not None:
+        stats.hit('dashboard')
+        return Dashboard(etag, body)
+    stats.miss('dashboard')
+    data = build_dashboard(questions, versions)
+    body = gzip.compress(json.dumps(data, cls=DjangoJSONEncoder).encode())
+    cache.set(key, body, timeout=settings.POLLS_RESULTS_CACHE_TIMEOUT)
+    return Dashboard(etag, body)
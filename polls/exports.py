@@ -0,0 +1,123 @@
+"""
+Streaming exports of votes and results as CSV or JSON Lines.
+
+Rows are read with QuerySet.iterator(), so exports use the same small amount
+of memory however many votes there are. The functions return iterators of
+text that can be written to a file or passed to a StreamingHttpResponse;
+under ASGI, wrap them with aiter_export() first.
+"""
+import csv
+import itertools
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from .models import Choice, Question, Vote
+
+EXPORT_CHUNK_SIZE = 2000
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+}
+EXPORT_STATUSES = ('open', 'closed')
+
+VOTE_FIELDS = ['id', 'user_id', 'user__username', 'question_id', 'choice_id',
+               'choice__choice_text']
+VOTE_COLUMNS = ['vote_id', 'user_id', 'username', 'question_id', 'choice_id', 'choice_text']
+RESULT_FIELDS = ['question_id', 'question__question_text', 'question__pub_date',
+                 'question__end_date', 'id', 'choice_text', 'vote_count']
+RESULT_COLUMNS = ['question_id', 'question_text', 'pub_date', 'end_date', 'choice_id',
+                  'choice_text', 'votes']
+
+
+def filter_questions(questions=None, question_ids=None, since=None, until=None, status=None):
+    """
+    Return the questions to export.
+
+    `questions` defaults to all questions. It is narrowed to `question_ids`,
+    to questions published between `since` and `until`, and to questions
+    whose `status` is 'open' or 'closed' for voting.
+    """
+    if questions is None:
+        questions = Question.objects.all()
+    if question_ids:
+        questions = questions.filter(pk__in=question_ids)
+    if since is not None:
+        questions = questions.filter(pub_date__gte=since)
+    if until is not None:
+        questions = questions.filter(pub_date__lte=until)
+    if status == 'open':
+        questions = questions.open_for_voting()
+    elif status == 'closed':
+        questions = questions.closed()
+    return questions
+
+
+def vote_rows(questions):
+    """Return an iterator over the rows of the vote log of `questions`, in vote order."""
+    return (Vote.objects.filter(question__in=questions.values('pk'))
+            .order_by('pk').values_list(*VOTE_FIELDS)
+            .iterator(chunk_size=EXPORT_CHUNK_SIZE))
+
+
+def result_rows(questions):
+    """Return an iterator over one row per choice of `questions`, with its tally."""
+    return (Choice.objects.filter(question__in=questions.values('pk'))
+            .order_by('question_id', 'pk').values_list(*RESULT_FIELDS)
+            .iterator(chunk_size=EXPORT_CHUNK_SIZE))
+
+
+class _LineBuffer:
+    """A file-like object whose write() returns the text instead of storing it."""
+
+    def write(self, value):
+        """Return `value`, so csv.writer.writerow() returns the formatted line."""
+        return value
+
+
+def iter_csv(columns, rows):
+    """Yield a CSV header line for `columns`, then one line per row."""
+    writer = csv.writer(_LineBuffer())
+    yield writer.writerow(columns)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def iter_jsonl(columns, rows):
+    """Yield one JSON object per row, keyed by `columns`, on its own line."""
+    encoder = DjangoJSONEncoder()
+    for row in rows:
+        yield encoder.encode(dict(zip(columns, row))) + '\n'
+
+
+def export(kind, export_format, questions):
+    """
+    Return an iterator over the lines of an export of `questions`.
+
+    `kind` is 'votes' for the vote log or 'results' for the tallies, and
+    `export_format` is 'csv' or 'jsonl'.
+    """
+    if kind == 'votes':
+        columns, rows = VOTE_COLUMNS, vote_rows(questions)
+    elif kind == 'results':
+        columns, rows = RESULT_COLUMNS, result_rows(questions)
+    else:
+        raise ValueError(f"Unknown export {kind!r}.")
+    if export_format == 'csv':
+        return iter_csv(columns, rows)
+    if export_format == 'jsonl':
+        return iter_jsonl(columns, rows)
+    raise ValueError(f"Unknown export format {export_format!r}.")
+
+
+async def aiter_export(lines):
+    """
+    Yield the lines of the export iterator `lines` from an event loop.
+
+    The lines are read EXPORT_CHUNK_SIZE at a time in the thread that runs
+    the request's synchronous code, which holds its database connection.
+    """
+    read = sync_to_async(lambda: list(itertools.islice(lines, EXPORT_CHUNK_SIZE)))
+    try:
+        while chunk := await read():
+            yield ''.join(chunk)
+    finally:
+        await sync_to_async(lines.close)()
@@ -0,0 +1,261 @@
+"""
+Streaming bulk import of users, questions, choices and votes.
+
+Records use the same format as Django fixtures, for example::
+
+    {"model": "polls.choice", "pk": 7, "fields": {"question": 2, "choice_text": "Jazz"}}
+
+and are read either from a JSON array, like the files in data/, or from JSON
+Lines with one record per line. Files are parsed incrementally, so memory use
+does not grow with the number of votes.
+"""
+import json
+from collections import Counter
+from django.contrib.auth.models import User
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.management.color import no_style
+from django.db import DEFAULT_DB_ALIAS, connection, connections, transaction
+from .cache import bump_results_version, invalidate_index, refresh_statuses
+from .models import Choice, Question, Vote
+from .tallies import rebuild_tallies, rebuild_vote_counts
+
+# Models that can be imported, in the order their rows must be written.
+IMPORT_MODELS = {
+    'auth.user': User,
+    'polls.question': Question,
+    'polls.choice': Choice,
+    'polls.vote': Vote,
+}
+
+READ_SIZE = 64 * 1024
+WHITESPACE = ' \t\r\n'
+# Number of questions whose vote counters are rebuilt per query after an import.
+REBUILD_CHUNK_SIZE = 500
+
+
+class InvalidImportData(ValueError):
+    """Raised when an import file or one of its records is invalid."""
+
+
+def iter_json_array(file):
+    """Yield the elements of the JSON array in the text `file`, reading it in small pieces."""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+
+    def next_char():
+        """Skip whitespace, reading more text as needed; return the next character or ''."""
+        nonlocal buffer, position
+        while True:
+            while position < len(buffer) and buffer[position] in WHITESPACE:
+                position += 1
+            if position < len(buffer):
+                return buffer[position]
+            buffer, position = file.read(READ_SIZE), 0
+            if not buffer:
+                return ''
+
+    if next_char() != '[':
+        raise InvalidImportData("Expected a JSON array.")
+    position += 1
+    if next_char() == ']':
+        return
+    while True:
+        if not next_char():
+            raise InvalidImportData("The JSON array is not closed.")
+        while True:
+            try:
+                element, end = decoder.raw_decode(buffer, position)
+                error = None
+            except json.JSONDecodeError as decode_error:
+                error = decode_error
+            # A number at the very end of the buffer may continue in the next piece.
+            if error is None and end < len(buffer):
+                break
+            chunk = file.read(READ_SIZE)
+            if not chunk:
+                if error is None:
+                    break
+                raise InvalidImportData(f"Invalid JSON: {error}") from error
+            buffer, position = buffer[position:] + chunk, 0
+        position = end
+        yield element
+        char = next_char()
+        if char == ']':
+            return
+        if char != ',':
+            raise InvalidImportData(f"Expected ',' or ']' after an array element, not {char!r}.")
+        position += 1
+
+
+def iter_json_lines(file):
+    """Yield the JSON value on each non-blank line of the text `file`."""
+    for number, line in enumerate(file, start=1):
+        if line.strip():
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as error:
+                raise InvalidImportData(f"Invalid JSON on line {number}: {error}") from error
+
+
+def copy_rows(model, objs):
+    """
+    Insert `objs` into the table of `model` with PostgreSQL's COPY.
+
+    COPY cannot skip existing rows, so the rows are copied into a temporary
+    table first and inserted from there with ON CONFLICT DO NOTHING. This is
+    several times faster than bulk_create for large batches.
+    """
+    db = connections[DEFAULT_DB_ALIAS]
+    quote = db.ops.quote_name
+    table = quote(model._meta.db_table)
+    staging = quote(f'import_{model._meta.db_table}')
+    fields = model._meta.concrete_fields
+    columns = ', '.join(quote(field.column) for field in fields)
+    with db.cursor() as cursor:
+        cursor.execute(f'CREATE TEMPORARY TABLE {staging} (LIKE {table})')
+        with cursor.copy(f'COPY {staging} ({columns}) FROM STDIN') as copy:
+            for obj in objs:
+                copy.write_row([field.get_db_prep_save(getattr(obj, field.attname), db)
+                                for field in fields])
+        cursor.execute(f'INSERT INTO {table} ({columns}) SELECT {columns} FROM {staging} '
+                       f'ON CONFLICT DO NOTHING')
+        cursor.execute(f'DROP TABLE {staging}')
+
+
+class PollImporter:
+    """
+    Validate records and write them in batches, one transaction per batch.
+
+    On PostgreSQL the rows are written with COPY, elsewhere with bulk_create.
+
+    Rows whose primary key, or for votes whose user and question, already
+    exist are skipped, so a batch can safely be imported again after a
+    failure. References to users, questions and choices are checked against
+    the database and against the records queued before them.
+    """
+
+    def __init__(self):
+        """Load the ids that records may refer to."""
+        self.user_ids = set(User.objects.values_list('pk', flat=True))
+        self.question_ids = set(Question.objects.values_list('pk', flat=True))
+        self.choice_questions = dict(Choice.objects.values_list('pk', 'question_id'))
+        self.pending = {model: [] for model in IMPORT_MODELS.values()}
+        self.pending_count = 0
+        self.counts = Counter()
+        self.touched_question_ids = set()
+
+    def add(self, record):
+        """Validate `record` and queue it for the next flush()."""
+        obj = self.build(record)
+        if isinstance(obj, User):
+            self.user_ids.add(obj.pk)
+        elif isinstance(obj, Question):
+            self.question_ids.add(obj.pk)
+            self.touched_question_ids.add(obj.pk)
+        elif isinstance(obj, Choice):
+            if obj.question_id not in self.question_ids:
+                raise InvalidImportData(f"Choice {obj.pk} refers to unknown question "
+                                        f"{obj.question_id}.")
+            self.choice_questions[obj.pk] = obj.question_id
+            self.touched_question_ids.add(obj.question_id)
+        else:
+            self.check_vote(obj)
+            self.touched_question_ids.add(obj.question_id)
+        self.pending[type(obj)].append(obj)
+        self.pending_count += 1
+
+    def build(self, record):
+        """Return an unsaved model instance for the fixture-style `record`."""
+        if not isinstance(record, dict):
+            raise InvalidImportData(f"Expected a record object, not {record!r}.")
+        label = record.get('model')
+        model = IMPORT_MODELS.get(label)
+        if model is None:
+            raise InvalidImportData(f"Cannot import records of model {label!r}.")
+        if record.get('pk') is None:
+            raise InvalidImportData(f"A {label} record has no pk.")
+
+        values = {}
+        try:
+            values['pk'] = model._meta.pk.to_python(record['pk'])
+            for name, value in record.get('fields', {}).items():
+                try:
+                    field = model._meta.get_field(name)
+                except FieldDoesNotExist:
+                    raise InvalidImportData(f"{label} has no field {name!r}.") from None
+                if field.many_to_many:
+                    if value:
+                        raise InvalidImportData(f"Cannot import the {name!r} of {label} "
+                                                f"{record['pk']}.")
+                elif field.is_relation:
+                    values[field.attname] = field.target_field.to_python(value)
+                else:
+                    values[field.attname] = field.to_python(value)
+        except ValidationError as error:
+            raise InvalidImportData(f"{label} {record['pk']}: {'; '.join(error.messages)}")
+        if model is Question:
+            # Derived from the dates like the counters from the votes; finish() sets it.
+            values.pop('status', None)
+        return model(**values)
+
+    def check_vote(self, vote):
+        """Check the references of `vote`, filling in its question from its choice."""
+        if vote.user_id not in self.user_ids:
+            raise InvalidImportData(f"Vote {vote.pk} refers to unknown user {vote.user_id}.")
+        question_id = self.choice_questions.get(vote.choice_id)
+        if question_id is None:
+            raise InvalidImportData(f"Vote {vote.pk} refers to unknown choice {vote.choice_id}.")
+        if vote.question_id is None:
+            vote.question_id = question_id
+        elif vote.question_id != question_id:
+            raise InvalidImportData(f"Vote {vote.pk} is for question {vote.question_id}, but "
+                                    f"choice {vote.choice_id} belongs to question {question_id}.")
+
+    def flush(self):
+        """Write the queued records in one transaction, parents before children."""
+        with transaction.atomic():
+            for model, objs in self.pending.items():
+                if not objs:
+                    continue
+                if connection.vendor == 'postgresql':
+                    copy_rows(model, objs)
+                else:
+                    model.objects.bulk_create(objs, ignore_conflicts=True)
+        for model, objs in self.pending.items():
+            self.counts[model._meta.label_lower] += len(objs)
+            objs.clear()
+        self.pending_count = 0
+
+    def finish(self, rebuild_all=False):
+        """
+        Flush the remaining records and bring the derived data up to date.
+
+        That resets the primary key sequences, rebuilds the vote counters of
+        the imported questions, or of all questions if `rebuild_all`, and the
+        vote tallies, as imported votes have no vote events. It also sets the
+        status of the imported questions, which start out scheduled, and
+        invalidates the cached index and results.
+        """
+        self.flush()
+        models = [model for model in IMPORT_MODELS.values()
+                  if self.counts[model._meta.label_lower]]
+        statements = connection.ops.sequence_reset_sql(no_style(), models)
+        if statements:
+            with connection.cursor() as cursor:
+                for sql in statements:
+                    cursor.execute(sql)
+
+        if rebuild_all:
+            rebuild_vote_counts()
+            question_ids = Question.objects.values_list('pk', flat=True)
+        else:
+            question_ids = sorted(self.touched_question_ids)
+            for start in range(0, len(question_ids), REBUILD_CHUNK_SIZE):
+                rebuild_vote_counts(question_ids[start:start + REBUILD_CHUNK_SIZE])
+        if rebuild_all or self.counts['polls.vote']:
+            rebuild_tallies()
+        for question_id in question_ids:
+            bump_results_version(question_id)
+        refresh_statuses()
+        invalidate_index()
@@ -0,0 +1,198 @@
+"""
+Buffered, write-behind ingestion of votes for peak election traffic.
+
+When POLLS_VOTE_BUFFER_ENABLED is set, the vote view hands validated votes to
+a VoteBuffer instead of writing them itself. A background thread drains the
+buffer in batches: each batch keeps only the latest choice of every
+(user, question) pair, drops the votes of users or choices deleted meanwhile,
+writes the rest with one bulk upsert and moves the counters by the difference.
+"""
+import atexit
+import logging
+import queue
+import threading
+import time
+from collections import Counter
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import Case, F, Value, When
+from .cache import bump_results_version
+from .live import broadcaster
+from .models import Choice, Question, Vote, VoteEvent
+
+logger = logging.getLogger('polls')
+
+
+def _add_to_vote_counts(queryset, deltas):
+    """Add `deltas`, a mapping of primary key to change, to the vote_count of the rows."""
+    deltas = {pk: delta for pk, delta in deltas.items() if delta}
+    if deltas:
+        queryset.filter(pk__in=deltas).update(vote_count=F('vote_count') + Case(
+            *(When(pk=pk, then=Value(delta)) for pk, delta in deltas.items()),
+            default=Value(0)))
+
+
+class VoteBuffer:
+    """An in-process queue of votes that is written to the database in batches."""
+
+    def __init__(self, batch_size=500, max_latency=0.05):
+        """
+        Create an empty buffer.
+
+        `batch_size` is the largest number of votes written in one batch and
+        `max_latency` the longest time, in seconds, a vote waits in the buffer.
+        """
+        self.batch_size = batch_size
+        self.max_latency = max_latency
+        self._queue = queue.Queue()
+        self._thread = None
+        self._stopping = threading.Event()
+
+    def submit(self, user_id, question_id, choice_id):
+        """Add a vote to the buffer."""
+        self._queue.put((user_id, question_id, choice_id))
+
+    def pending(self):
+        """Return the approximate number of votes waiting to be written."""
+        return self._queue.qsize()
+
+    def start(self):
+        """Start the background flusher thread, if it is not running yet."""
+        if self._thread is not None:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name='polls-vote-buffer', daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        """Stop the flusher thread after it has written every pending vote."""
+        if self._thread is not None:
+            self._stopping.set()
+            self._thread.join()
+            self._thread = None
+            atexit.unregister(self.stop)
+        self.flush()
+
+    def flush(self):
+        """Write every pending vote from the calling thread and return how many were taken."""
+        taken = 0
+        while True:
+            batch = self._take(self.batch_size, block=False)
+            if not batch:
+                return taken
+            self.write(batch)
+            taken += len(batch)
+
+    def write(self, batch):
+        """
+        Write a batch of (user_id, question_id, choice_id) votes.
+
+        Later votes in the batch win over earlier ones from the same user for the
+        same question. Votes of users or choices that no longer exist are dropped,
+        so they cannot fail the rest of the batch. The counters are moved by the
+        change each vote makes, like Vote.objects.record() does, and a VoteEvent
+        is logged for every vote that is new or changed its choice.
+        """
+        latest = {}
+        for user_id, question_id, choice_id in batch:
+            latest[(user_id, question_id)] = choice_id
+
+        with transaction.atomic():
+            # The users are locked first, like Vote.objects.record() does, so
+            # the previous votes read below cannot change, nor a first vote
+            # appear, before this transaction commits.
+            user_ids = Vote.objects.lock_voters({user_id for user_id, _ in latest})
+            previous = {
+                (user_id, question_id): choice_id
+                for user_id, question_id, choice_id in Vote.objects.select_for_update()
+                .filter(user_id__in=user_ids, question_id__in={pair[1] for pair in latest})
+                .order_by('pk').values_list('user_id', 'question_id', 'choice_id')
+            }
+            # Lock the choices, so they cannot be deleted before the votes that
+            # point at them are committed.
+            choice_questions = dict(
+                Choice.objects.select_for_update()
+                .filter(pk__in=set(latest.values())).order_by('pk')
+                .values_list('pk', 'question_id'))
+            votes = [Vote(user_id=user_id, question_id=question_id, choice_id=choice_id)
+                     for (user_id, question_id), choice_id in sorted(latest.items())
+                     if user_id in user_ids and choice_questions.get(choice_id) == question_id]
+            if len(votes) < len(latest):
+                logger.warning("Dropped %d buffered votes of deleted users or choices",
+                               len(latest) - len(votes),
+                               extra={'event': 'vote_dropped', 'count': len(latest) - len(votes)})
+            if not votes:
+                return
+            question_ids = {vote.question_id for vote in votes}
+
+            Vote.objects.bulk_create(
+                votes, update_conflicts=True,
+                unique_fields=['user', 'question'], update_fields=['choice'],
+            )
+            changed = [(vote, previous.get((vote.user_id, vote.question_id))) for vote in votes
+                       if previous.get((vote.user_id, vote.question_id)) != vote.choice_id]
+            VoteEvent.objects.bulk_create(
+                VoteEvent(user_id=vote.user_id, question_id=vote.question_id,
+                          choice_id=vote.choice_id, previous_choice_id=previous_choice_id)
+                for vote, previous_choice_id in changed
+            )
+            choice_deltas = Counter()
+            question_deltas = Counter()
+            for vote, previous_choice_id in changed:
+                choice_deltas[vote.choice_id] += 1
+                if previous_choice_id is None:
+                    question_deltas[vote.question_id] += 1
+                else:
+                    choice_deltas[previous_choice_id] -= 1
+            _add_to_vote_counts(Choice.objects, choice_deltas)
+            _add_to_vote_counts(Question.objects, question_deltas)
+        for question_id in question_ids:
+            broadcaster.publish(question_id, bump_results_version(question_id), None)
+
+    def _take(self, limit, block=True):
+        """Remove and return up to `limit` votes, waiting at most max_latency for the first."""
+        batch = []
+        deadline = time.monotonic() + self.max_latency
+        while len(batch) < limit:
+            timeout = deadline - time.monotonic()
+            try:
+                if block and timeout > 0:
+                    batch.append(self._queue.get(timeout=timeout))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        """Write batches until stop() is called, then close the thread's connection."""
+        try:
+            while not self._stopping.is_set():
+                batch = self._take(self.batch_size)
+                if not batch:
+                    continue
+                close_old_connections()
+                try:
+                    self.write(batch)
+                except Exception:
+                    logger.exception("Failed to write %d buffered votes", len(batch))
+        finally:
+            connection.close()
+
+
+_vote_buffer = None
+_vote_buffer_lock = threading.Lock()
+
+
+def get_vote_buffer():
+    """Return the process-wide VoteBuffer, creating and starting it on first use."""
+    global _vote_buffer
+    with _vote_buffer_lock:
+        if _vote_buffer is None:
+            _vote_buffer = VoteBuffer(
+                batch_size=settings.POLLS_VOTE_BUFFER_BATCH_SIZE,
+                max_latency=settings.POLLS_VOTE_BUFFER_MAX_LATENCY,
+            )
+            _vote_buffer.start()
+    return _vote_buffer
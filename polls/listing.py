@@ -0,0 +1,115 @@
+"""
+Keyset pagination and search of the question list.
+
+Pages are ordered newest first by (pub_date, id). Instead of an offset, a
+page is asked for with an opaque cursor naming the last question of the page
+before it, or the first question of the page after it. The database then
+seeks straight to that spot in the (pub_date, id) index, so a deep page
+costs as much as the first one.
+"""
+import base64
+import binascii
+import datetime
+from django.conf import settings
+from django.db.models import Q
+
+
+class InvalidCursor(ValueError):
+    """Raised for a page cursor that was not made by encode_cursor()."""
+
+
+class QuestionPage:
+    """One page of questions, with the cursors of the pages before and after it."""
+
+    def __init__(self, questions, next_cursor=None, previous_cursor=None):
+        """Create a page of `questions`."""
+        self.questions = questions
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+
+def encode_cursor(question):
+    """Return the cursor that points at `question` in the question list."""
+    value = f"{question.pub_date.isoformat()}|{question.pk}"
+    return base64.urlsafe_b64encode(value.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return the (pub_date, id) pair a cursor points at; raise InvalidCursor if malformed."""
+    try:
+        value = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        pub_date, _, pk = value.partition('|')
+        pub_date = datetime.datetime.fromisoformat(pub_date)
+        pk = int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise InvalidCursor(f"Invalid page cursor {cursor!r}.") from None
+    if pub_date.tzinfo is None:
+        raise InvalidCursor(f"Invalid page cursor {cursor!r}.")
+    return pub_date, pk
+
+
+def search_questions(questions, query):
+    """
+    Return the `questions` whose text contains `query`, ignoring case.
+
+    On PostgreSQL with pg_trgm the match is served by the trigram index on
+    the question text; elsewhere it is a scan, which is fine for small
+    databases.
+    """
+    if query:
+        questions = questions.filter(question_text__icontains=query)
+    return questions
+
+
+def page_queryset(questions, after=None, before=None, size=None):
+    """
+    Return the query for the page of `questions` after or before a cursor.
+
+    It asks for one more question than the page size, to tell whether there
+    is another page beyond it. The page before a cursor is read in ascending
+    order, and make_page() puts it back in order.
+    """
+    if size is None:
+        size = settings.POLLS_INDEX_PAGE_SIZE
+    # The plain pub_date bound is what lets the database seek in the index;
+    # the OR only settles ties on pub_date.
+    if before is not None:
+        pub_date, pk = decode_cursor(before)
+        return (questions.filter(Q(pub_date__gt=pub_date) | Q(pk__gt=pk),
+                                 pub_date__gte=pub_date)
+                .order_by('pub_date', 'pk')[:size + 1])
+    if after is not None:
+        pub_date, pk = decode_cursor(after)
+        questions = questions.filter(Q(pub_date__lt=pub_date) | Q(pk__lt=pk),
+                                     pub_date__lte=pub_date)
+    return questions.order_by('-pub_date', '-pk')[:size + 1]
+
+
+def make_page(rows, after=None, before=None, size=None):
+    """Return the QuestionPage of the `rows` read with page_queryset()."""
+    if size is None:
+        size = settings.POLLS_INDEX_PAGE_SIZE
+    more = len(rows) > size
+    rows = rows[:size]
+    if before is not None:
+        rows.reverse()
+        has_next, has_previous = True, more
+    else:
+        has_next, has_previous = more, after is not None
+    return QuestionPage(
+        rows,
+        next_cursor=encode_cursor(rows[-1]) if rows and has_next else None,
+        previous_cursor=encode_cursor(rows[0]) if rows and has_previous else None,
+    )
+
+
+def get_page(questions, after=None, before=None, size=None):
+    """Return the page of `questions` after or before a cursor, or the first page."""
+    rows = list(page_queryset(questions, after, before, size))
+    return make_page(rows, after, before, size)
+
+
+async def aget_page(questions, after=None, before=None, size=None):
+    """Asynchronous version of get_page(), using the async ORM."""
+    rows = [question async for question in page_queryset(questions, after, before, size)]
+    return make_page(rows, after, before, size)
@@ -0,0 +1,128 @@
+"""
+In-process broadcasting of live vote tallies to Server-Sent Events clients.
+
+The vote view publishes the change each vote makes to a question's tallies.
+Every connected results stream of that question holds a Subscription that
+merges the changes it has not sent yet, so a slow client receives one
+combined update instead of a growing backlog, and N watchers cost one
+fan-out per vote rather than N queries.
+
+Only votes cast in the same server process are published. Their results
+versions leave gaps where other processes voted, and changes are only sent
+as deltas when they follow the results sent last without a gap; otherwise
+the full results are sent again. A stream that has been idle for
+POLLS_STREAM_HEARTBEAT seconds also compares the question's results version,
+kept in the cache all server processes share, with the one it sent last.
+"""
+import asyncio
+import threading
+from collections import Counter, defaultdict
+
+
+class Subscription:
+    """The pending tally changes of one connected client."""
+
+    def __init__(self, loop):
+        """Create a subscription whose waiter runs on the event loop `loop`."""
+        self._loop = loop
+        self._lock = threading.Lock()
+        self._event = asyncio.Event()
+        self._deltas = Counter()
+        self._versions = set()
+        # A new subscription starts by sending the full results.
+        self._resync = True
+        self._event.set()
+
+    def push(self, version, deltas):
+        """
+        Merge the vote changes of results `version` into the pending update.
+
+        `deltas` maps choice ids to vote count changes; None means the tallies
+        changed in a way that needs a full resend.
+        """
+        with self._lock:
+            was_empty = not self._resync and not self._versions
+            if deltas is None:
+                self._resync = True
+            else:
+                self._deltas.update(deltas)
+                self._versions.add(version)
+        if was_empty:
+            try:
+                self._loop.call_soon_threadsafe(self._event.set)
+            except RuntimeError:
+                # The client's event loop has already closed.
+                pass
+
+    async def wait(self, timeout):
+        """
+        Wait up to `timeout` seconds for an update and take it.
+
+        Return a (resync, deltas, min_version, max_version) tuple, or None if
+        the timeout passed without any update. The deltas are only usable
+        when they span every version from min_version to max_version, so
+        resync is also true if a version in between is missing.
+        """
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        with self._lock:
+            self._event.clear()
+            versions = self._versions
+            min_version = min(versions, default=None)
+            max_version = max(versions, default=None)
+            gap = bool(versions) and len(versions) != max_version - min_version + 1
+            update = (self._resync or gap, +self._deltas, min_version, max_version)
+            self._resync = False
+            self._deltas = Counter()
+            self._versions = set()
+        return update
+
+    def request_resync(self):
+        """Ask for the full results to be sent again."""
+        self.push(None, None)
+
+
+class TallyBroadcaster:
+    """Fans out tally changes to the subscriptions of each question."""
+
+    def __init__(self):
+        """Start without any subscriptions."""
+        self._lock = threading.Lock()
+        self._subscriptions = defaultdict(set)
+
+    def subscribe(self, question_id):
+        """Return a new Subscription to a question, bound to the running event loop."""
+        subscription = Subscription(asyncio.get_running_loop())
+        with self._lock:
+            self._subscriptions[question_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, question_id, subscription):
+        """Remove a subscription to a question."""
+        with self._lock:
+            subscriptions = self._subscriptions.get(question_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[question_id]
+
+    def subscriber_count(self, question_id):
+        """Return the number of clients subscribed to a question."""
+        with self._lock:
+            return len(self._subscriptions.get(question_id, ()))
+
+    def publish(self, question_id, version, deltas):
+        """
+        Send a question's tally changes to all its subscribers; safe to call from any thread.
+
+        See Subscription.push() for the arguments.
+        """
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(question_id, ()))
+        for subscription in subscriptions:
+            subscription.push(version, deltas)
+
+
+broadcaster = TallyBroadcaster()
@@ -0,0 +1,135 @@
+"""
+Logging helpers for the polls site: JSON records, a queued handler and rate limiting.
+
+With POLLS_LOG_MODE=queued-json the request threads only put log records on
+a queue. A listener thread formats them as JSON lines and writes them, so a
+slow log destination never holds up a request. Messages use %-style
+arguments and are only formatted on the listener thread.
+"""
+import datetime
+import json
+import logging
+import queue
+import random
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+# Attributes every LogRecord has; anything else was passed with `extra`.
+STANDARD_ATTRIBUTES = frozenset(logging.makeLogRecord({}).__dict__) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    """Format records as one JSON object per line, with their `extra` fields."""
+
+    def format(self, record):
+        """Return the record as a JSON string."""
+        data = {
+            'time': datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc)
+                            .isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in STANDARD_ATTRIBUTES and not key.startswith('_'):
+                data[key] = value
+        if record.exc_info:
+            data['exception'] = self.formatException(record.exc_info)
+        return json.dumps(data, default=str)
+
+
+class QueuedStreamHandler(QueueHandler):
+    """
+    A stream handler whose writes happen on a background thread.
+
+    Records go onto a bounded queue without formatting. If the queue is
+    full the record is dropped and counted in `dropped`, rather than making
+    the request wait. The formatter set on this handler is used by the
+    listener thread.
+    """
+
+    def __init__(self, stream=None, maxsize=10000):
+        """Create the queue and start the listener that writes to `stream` (stderr by default)."""
+        super().__init__(queue.Queue(maxsize))
+        self.target = logging.StreamHandler(stream)
+        self.dropped = 0
+        self._dropped_lock = threading.Lock()
+        self.listener = QueueListener(self.queue, self.target)
+        self.listener.start()
+
+    def setFormatter(self, fmt):
+        """Format records with `fmt` when the listener writes them."""
+        self.target.setFormatter(fmt)
+
+    def prepare(self, record):
+        """
+        Return the record unchanged.
+
+        QueueHandler.prepare() formats the message on the calling thread, so
+        that the record can be pickled. This queue stays in-process, so the
+        formatting is left to the listener thread.
+        """
+        return record
+
+    def enqueue(self, record):
+        """Put the record on the queue, or drop it if the queue is full."""
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._dropped_lock:
+                self.dropped += 1
+
+    def flush(self):
+        """Wait until the listener has written every queued record."""
+        if self.listener._thread is not None:
+            self.queue.join()
+        self.target.flush()
+
+    def close(self):
+        """Write the queued records and stop the listener."""
+        if self.listener._thread is not None:
+            self.queue.join()
+            self.listener.stop()
+        self.target.close()
+        super().close()
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Limit how often records of noisy events are logged.
+
+    Only records whose `event` extra field is in `events` are limited. Each
+    of those events may be logged `burst` times at once and `rate` times a
+    second on average; only a random `sample_rate` share of them is logged.
+    The next record of an event that is let through carries the number of
+    records dropped before it in its `suppressed` field.
+    """
+
+    def __init__(self, events=(), rate=1.0, burst=10, sample_rate=1.0):
+        """Create the filter for the given events."""
+        super().__init__()
+        self.events = frozenset(events)
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.sample_rate = float(sample_rate)
+        self._lock = threading.Lock()
+        self._buckets = {}
+
+    def filter(self, record):
+        """Return False if the record should be dropped."""
+        event = getattr(record, 'event', None)
+        if event not in self.events:
+            return True
+        sampled_out = self.sample_rate < 1 and random.random() >= self.sample_rate
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated, suppressed = self._buckets.get(event, (self.burst, now, 0))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if sampled_out or tokens < 1:
+                self._buckets[event] = (tokens, now, suppressed + 1)
+                return False
+            self._buckets[event] = (tokens - 1, now, 0)
+        if suppressed:
+            record.suppressed = suppressed
+        return True
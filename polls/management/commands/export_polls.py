@@ -0,0 +1,63 @@
+"""Management command that exports votes or results as CSV or JSON Lines."""
+import datetime
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from polls.exports import EXPORT_FORMATS, EXPORT_STATUSES, export, filter_questions
+
+
+def parse_moment(value, end_of_day=False):
+    """Parse an ISO date or date and time; a date means its start, or end if `end_of_day`."""
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(f"'{value}' is not a date or date and time.")
+        moment = datetime.datetime.combine(
+            day, datetime.time.max if end_of_day else datetime.time.min)
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+class Command(BaseCommand):
+    """Stream the vote log or the per-choice tallies of the selected questions."""
+
+    help = "Export the vote log or the results of questions as CSV or JSON Lines."
+
+    def add_arguments(self, parser):
+        """Add the export kind and the format, output and filter options."""
+        parser.add_argument('kind', choices=['votes', 'results'],
+                            help="Export the vote log or the per-choice results.")
+        parser.add_argument('--format', choices=list(EXPORT_FORMATS), default='csv',
+                            help="Output format (default csv).")
+        parser.add_argument('--output', '-o',
+                            help="File to write to; by default the export goes to stdout.")
+        parser.add_argument(
+            '--question', type=int, action='append', dest='question_ids',
+            help="Only export this question id (may be given more than once).",
+        )
+        parser.add_argument('--since', help="Only export questions published on or after this "
+                                            "date (YYYY-MM-DD) or date and time.")
+        parser.add_argument('--until', help="Only export questions published on or before this "
+                                            "date (YYYY-MM-DD) or date and time.")
+        parser.add_argument('--status', choices=EXPORT_STATUSES,
+                            help="Only export questions that are open or closed for voting.")
+
+    def handle(self, *args, kind, format='csv', output=None, question_ids=None, since=None,
+               until=None, status=None, **options):
+        """Write the export line by line."""
+        try:
+            since = parse_moment(since) if since else None
+            until = parse_moment(until, end_of_day=True) if until else None
+        except ValueError as error:
+            raise CommandError(str(error))
+        questions = filter_questions(question_ids=question_ids, since=since, until=until,
+                                     status=status)
+        lines = export(kind, format, questions)
+        if output is None:
+            for line in lines:
+                self.stdout.write(line, ending='')
+            return
+        with open(output, 'w', encoding='utf-8', newline='') as file:
+            file.writelines(lines)
@@ -0,0 +1,86 @@
+"""Management command that bulk imports users, questions, choices and votes."""
+import json
+import os
+from pathlib import Path
+from django.core.management.base import BaseCommand, CommandError
+from polls.importer import InvalidImportData, PollImporter, iter_json_array, iter_json_lines
+
+
+class Command(BaseCommand):
+    """Import fixture-style JSON or JSON Lines files in batches."""
+
+    help = ("Import users, questions, choices and votes from JSON or JSON Lines files, "
+            "in batches, without loading the files into memory.")
+
+    def add_arguments(self, parser):
+        """Add the file arguments and the --format, --batch-size and --checkpoint options."""
+        parser.add_argument('files', nargs='+', metavar='file',
+                            help="JSON array or JSON Lines file of fixture-style records.")
+        parser.add_argument(
+            '--format', choices=['json', 'jsonl'],
+            help="Format of the files; by default .jsonl files are JSON Lines, others JSON.",
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=2000,
+            help="Number of records written per transaction (default 2000).",
+        )
+        parser.add_argument(
+            '--checkpoint', type=Path,
+            help="File that records the progress of the import. If it exists, the import "
+                 "resumes after the records it lists; it is removed once the import succeeds.",
+        )
+
+    def handle(self, *args, files, format=None, batch_size=2000, checkpoint=None, **options):
+        """Import each file in turn, then update the vote counters and caches."""
+        if batch_size < 1:
+            raise CommandError("--batch-size must be at least 1.")
+        progress = {}
+        resumed = checkpoint is not None and checkpoint.exists()
+        if resumed:
+            progress = json.loads(checkpoint.read_text())
+            self.stdout.write(f"Resuming the import recorded in {checkpoint}.")
+
+        importer = PollImporter()
+        for name in files:
+            path = str(Path(name).resolve())
+            file_format = format or ('jsonl' if name.endswith('.jsonl') else 'json')
+            skip = queued = progress.get(path, 0)
+            try:
+                with open(name, encoding='utf-8') as file:
+                    if file_format == 'jsonl':
+                        records = iter_json_lines(file)
+                    else:
+                        records = iter_json_array(file)
+                    for number, record in enumerate(records, start=1):
+                        if number <= skip:
+                            continue
+                        importer.add(record)
+                        queued = number
+                        if importer.pending_count >= batch_size:
+                            importer.flush()
+                            self.save_progress(checkpoint, progress, path, queued)
+            except InvalidImportData as error:
+                # Keep the valid records read so far, so a resumed import starts at the bad one.
+                importer.finish(rebuild_all=resumed)
+                self.save_progress(checkpoint, progress, path, queued)
+                raise CommandError(f"{name}, record {queued + 1}: {error}")
+            except OSError as error:
+                raise CommandError(f"Cannot read {name}: {error}")
+            importer.flush()
+            self.save_progress(checkpoint, progress, path, queued)
+            self.stdout.write(f"Read {queued - skip} records from {name}.")
+
+        importer.finish(rebuild_all=resumed)
+        if checkpoint is not None and checkpoint.exists():
+            checkpoint.unlink()
+        summary = ', '.join(f"{count} {label}" for label, count in importer.counts.items())
+        self.stdout.write(self.style.SUCCESS(f"Imported {summary or 'no records'}."))
+
+    def save_progress(self, checkpoint, progress, path, done):
+        """Record that the first `done` records of `path` are imported, if checkpointing."""
+        if checkpoint is None:
+            return
+        progress[path] = done
+        temporary = checkpoint.with_name(checkpoint.name + '.tmp')
+        temporary.write_text(json.dumps(progress))
+        os.replace(temporary, checkpoint)
@@ -0,0 +1,46 @@
+"""Management command that rebuilds or verifies the stored vote counters."""
+from django.core.management.base import BaseCommand, CommandError
+from polls.cache import bump_results_version
+from polls.models import Question
+from polls.tallies import find_vote_count_mismatches, rebuild_vote_counts
+
+
+class Command(BaseCommand):
+    """Rebuild Choice.vote_count and Question.vote_count from the Vote table."""
+
+    help = "Rebuild (or, with --check, verify) the stored vote counters from the Vote table."
+
+    def add_arguments(self, parser):
+        """Add the --check and --question options."""
+        parser.add_argument(
+            '--check', action='store_true',
+            help="Only report counters that disagree with the Vote table; exit 1 if any do.",
+        )
+        parser.add_argument(
+            '--question', type=int, action='append', dest='question_ids',
+            help="Limit the rebuild to this question id (may be given more than once).",
+        )
+
+    def handle(self, *args, check=False, question_ids=None, **options):
+        """Rebuild or verify the counters."""
+        if check:
+            choices, questions = find_vote_count_mismatches(question_ids)
+            for pk, stored, actual in choices:
+                self.stdout.write(f"Choice {pk}: stored {stored}, actual {actual}")
+            for pk, stored, actual in questions:
+                self.stdout.write(f"Question {pk}: stored {stored}, actual {actual}")
+            if choices or questions:
+                raise CommandError(f"{len(choices)} choice and {len(questions)} "
+                                   f"question counters are out of date.")
+            self.stdout.write(self.style.SUCCESS("All vote counters are up to date."))
+            return
+
+        changed_choices, changed_questions = rebuild_vote_counts(question_ids)
+        if question_ids is None:
+            question_ids = Question.objects.values_list('pk', flat=True)
+        for question_id in question_ids:
+            bump_results_version(question_id)
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt vote counters: {changed_choices} choices and "
+            f"{changed_questions} questions updated."
+        ))
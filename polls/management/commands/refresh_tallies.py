@@ -0,0 +1,72 @@
+"""Management command that brings the materialized vote tallies up to date."""
+import logging
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from polls.tallies import find_tally_mismatches, rebuild_tallies, refresh_tallies
+
+logger = logging.getLogger('polls')
+
+
+class Command(BaseCommand):
+    """Apply new vote events to the ChoiceTally table, or rebuild or verify it."""
+
+    help = ("Apply the vote events since the last run to the vote tallies. With --rebuild, "
+            "recompute them from the Vote table; with --check, verify them against it.")
+
+    def add_arguments(self, parser):
+        """Add the --rebuild, --check, --batch-size, --follow and --interval options."""
+        parser.add_argument(
+            '--rebuild', action='store_true',
+            help="Recompute every tally from the Vote table instead of from the events.",
+        )
+        parser.add_argument(
+            '--check', action='store_true',
+            help="Only report tallies that disagree with the Vote table; exit 1 if any do.",
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=10000,
+            help="Number of events applied per transaction (default 10000).",
+        )
+        parser.add_argument(
+            '--follow', action='store_true',
+            help="Keep applying new events every --interval seconds until interrupted.",
+        )
+        parser.add_argument(
+            '--interval', type=float, default=1.0,
+            help="Seconds between refreshes with --follow (default 1).",
+        )
+
+    def handle(self, *args, rebuild=False, check=False, batch_size=10000, follow=False,
+               interval=1.0, **options):
+        """Refresh, rebuild or verify the tallies."""
+        if check:
+            mismatches = find_tally_mismatches(batch_size)
+            for pk, stored, actual in mismatches:
+                self.stdout.write(f"Choice {pk}: tally {stored}, actual {actual}")
+            if mismatches:
+                raise CommandError(f"{len(mismatches)} choice tallies are out of date.")
+            self.stdout.write(self.style.SUCCESS("All vote tallies are up to date."))
+            return
+
+        if rebuild:
+            written = rebuild_tallies(batch_size)
+            self.stdout.write(self.style.SUCCESS(f"Rebuilt {written} vote tallies."))
+            return
+
+        if not follow:
+            applied = refresh_tallies(batch_size)
+            self.stdout.write(self.style.SUCCESS(f"Applied {applied} vote events."))
+            return
+
+        self.stdout.write("Refreshing vote tallies; press Ctrl+C to stop.")
+        try:
+            while True:
+                close_old_connections()
+                applied = refresh_tallies(batch_size)
+                if applied:
+                    logger.info("Applied %s vote events to the tallies", applied,
+                                extra={'event': 'tally_refresh', 'applied': applied})
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,40 @@
+"""Management command that keeps the stored question statuses up to date."""
+from django.core.management.base import BaseCommand
+from polls.cache import refresh_statuses
+from polls.scheduler import StatusScheduler
+
+
+class Command(BaseCommand):
+    """Flip question statuses to open or closed as their pub_date and end_date pass."""
+
+    help = ("Update the stored status of questions exactly when their pub_date and "
+            "end_date pass. With --once, update them now and exit.")
+
+    def add_arguments(self, parser):
+        """Add the --once, --horizon and --reload-interval options."""
+        parser.add_argument(
+            '--once', action='store_true',
+            help="Update the statuses that are due now and exit, e.g. from cron.",
+        )
+        parser.add_argument(
+            '--horizon', type=int, default=3600,
+            help="Seconds ahead to load upcoming status changes for (default 3600).",
+        )
+        parser.add_argument(
+            '--reload-interval', type=int, default=60,
+            help="Seconds between reloads of the upcoming status changes, to pick up "
+                 "new and changed questions (default 60).",
+        )
+
+    def handle(self, *args, once=False, horizon=3600, reload_interval=60, **options):
+        """Update the statuses once, or run the scheduler until interrupted."""
+        if once:
+            changed = refresh_statuses()[0]
+            self.stdout.write(self.style.SUCCESS(f"Updated the status of {changed} questions."))
+            return
+        scheduler = StatusScheduler(horizon=horizon, reload_interval=reload_interval)
+        self.stdout.write("Status scheduler started; press Ctrl+C to stop.")
+        try:
+            scheduler.run()
+        except KeyboardInterrupt:
+            scheduler.stop()
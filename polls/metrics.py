@@ -0,0 +1,252 @@
+"""
+Per-request metrics for the polls site: latency, database queries and cache use.
+
+RequestMetricsMiddleware times every request and keeps, per view, histograms
+of the request duration, the number of database queries and the time spent
+in them, together with request and cache counters. The numbers belong to
+the current process; with several server workers, each one reports its own.
+They are rendered in the Prometheus text format by the metrics view.
+"""
+import bisect
+import contextvars
+import logging
+import random
+import threading
+import time
+from collections import Counter
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+logger = logging.getLogger('polls.metrics')
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+# The RequestStats of the request being handled, also seen by sync_to_async threads.
+current_request = contextvars.ContextVar('polls_request_stats', default=None)
+
+
+class RequestStats:
+    """What one request did: its database queries and cache hits and misses."""
+
+    __slots__ = ('view', 'queries', 'db_time', 'cache_hits', 'cache_misses')
+
+    def __init__(self):
+        """Start with nothing counted."""
+        self.view = None
+        self.queries = 0
+        self.db_time = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+
+class Histogram:
+    """A thread-safe histogram with fixed bucket upper bounds, like a Prometheus histogram."""
+
+    def __init__(self, buckets):
+        """Create an empty histogram with the given increasing upper bounds."""
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+
+    def observe(self, value):
+        """Add one observation of `value`."""
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    def snapshot(self):
+        """Return the cumulative bucket counts, including +Inf, the count and the sum."""
+        with self._lock:
+            counts, total = list(self._counts), self._sum
+        cumulative = []
+        running = 0
+        for count in counts:
+            running += count
+            cumulative.append(running)
+        return cumulative, running, total
+
+
+class MetricsRegistry:
+    """The request metrics of this process, grouped by view name."""
+
+    def __init__(self):
+        """Start with no metrics."""
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Drop all metrics."""
+        with self._lock:
+            self.durations = {}
+            self.query_counts = {}
+            self.db_times = {}
+            self.requests = Counter()
+
+    def _histogram(self, histograms, view, buckets):
+        """Return the histogram of `view` in `histograms`, creating it if needed."""
+        histogram = histograms.get(view)
+        if histogram is None:
+            with self._lock:
+                histogram = histograms.setdefault(view, Histogram(buckets))
+        return histogram
+
+    def record(self, view, method, status, duration, stats):
+        """Record a finished request to `view` that took `duration` seconds."""
+        self._histogram(self.durations, view, DURATION_BUCKETS).observe(duration)
+        self._histogram(self.query_counts, view, QUERY_COUNT_BUCKETS).observe(stats.queries)
+        self._histogram(self.db_times, view, DURATION_BUCKETS).observe(stats.db_time)
+        with self._lock:
+            self.requests[view, method, status] += 1
+
+    def render(self, cache_stats):
+        """Return all metrics, and the `cache_stats` snapshot, in the Prometheus text format."""
+        lines = []
+        histograms = [
+            ('polls_request_duration_seconds', "Time taken to handle a request.", self.durations),
+            ('polls_request_db_queries', "Database queries made by a request.", self.query_counts),
+            ('polls_request_db_seconds', "Time a request spent in database queries.",
+             self.db_times),
+        ]
+        for name, description, by_view in histograms:
+            lines += [f'# HELP {name} {description}', f'# TYPE {name} histogram']
+            for view, histogram in sorted(by_view.items()):
+                cumulative, count, total = histogram.snapshot()
+                bounds = [_format_number(bound) for bound in histogram.buckets] + ['+Inf']
+                for bound, value in zip(bounds, cumulative):
+                    lines.append(f'{name}_bucket{{view="{view}",le="{bound}"}} {value}')
+                lines.append(f'{name}_sum{{view="{view}"}} {_format_number(total)}')
+                lines.append(f'{name}_count{{view="{view}"}} {count}')
+
+        lines += ['# HELP polls_requests_total Requests handled, by view, method and status.',
+                  '# TYPE polls_requests_total counter']
+        with self._lock:
+            requests = sorted(self.requests.items())
+        for (view, method, status), count in requests:
+            lines.append(f'polls_requests_total{{view="{view}",method="{method}",'
+                         f'status="{status}"}} {count}')
+
+        for kind in ('hits', 'misses'):
+            lines += [f'# HELP polls_cache_{kind}_total Cache {kind} of the polls caches.',
+                      f'# TYPE polls_cache_{kind}_total counter']
+            for cache_name, counts in sorted(cache_stats.items()):
+                lines.append(f'polls_cache_{kind}_total{{cache="{cache_name}"}} {counts[kind]}')
+        return '\n'.join(lines) + '\n'
+
+
+def _format_number(value):
+    """Format a number for the Prometheus text format."""
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+registry = MetricsRegistry()
+
+
+def record_query(execute, sql, params, many, context):
+    """
+    Database execute wrapper that counts the queries of the current request.
+
+    Queries slower than POLLS_SLOW_QUERY_MS are logged, a sample of
+    POLLS_SLOW_QUERY_SAMPLE_RATE of them, with their SQL but not their
+    parameters.
+    """
+    stats = current_request.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - start
+        stats.queries += 1
+        stats.db_time += elapsed
+        threshold = settings.POLLS_SLOW_QUERY_MS
+        if (threshold and elapsed * 1000 >= threshold
+                and random.random() < settings.POLLS_SLOW_QUERY_SAMPLE_RATE):
+            logger.warning(f"Slow query in {stats.view or 'unknown view'} "
+                           f"({elapsed * 1000:.1f} ms): {sql[:1000]}",
+                           extra={'view': stats.view, 'duration_ms': round(elapsed * 1000, 2)})
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    """Add record_query() to the execute wrappers of a new database connection."""
+    if record_query not in connection.execute_wrappers:
+        # First in the list, so the pop() of a later execute_wrapper() block can't remove it.
+        connection.execute_wrappers.insert(0, record_query)
+
+
+def count_cache_lookup(hit):
+    """Count a cache hit, or a miss if not `hit`, for the current request."""
+    stats = current_request.get()
+    if stats is not None:
+        if hit:
+            stats.cache_hits += 1
+        else:
+            stats.cache_misses += 1
+
+
+class RequestMetricsMiddleware:
+    """Record the duration, database use and cache use of each request, per view."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        """Store the next handler, and adapt to it being synchronous or asynchronous."""
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        """Handle the request and record its metrics."""
+        if self.is_async:
+            return self.__acall__(request)
+        stats = RequestStats()
+        token = current_request.set(stats)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            current_request.reset(token)
+        self.finish(request, response, time.perf_counter() - start, stats)
+        return response
+
+    async def __acall__(self, request):
+        """Asynchronous version of __call__()."""
+        stats = RequestStats()
+        token = current_request.set(stats)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_request.reset(token)
+        self.finish(request, response, time.perf_counter() - start, stats)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        """Note the name of the view, for slow query logs."""
+        stats = current_request.get()
+        if stats is not None and request.resolver_match is not None:
+            stats.view = request.resolver_match.view_name
+
+    def finish(self, request, response, duration, stats):
+        """Record the metrics of a finished request and log them at DEBUG level."""
+        match = request.resolver_match
+        view = match.view_name if match is not None else 'unresolved'
+        registry.record(view, request.method, response.status_code, duration, stats)
+        if logger.isEnabledFor(logging.DEBUG):
+            fields = {
+                'view': view,
+                'method': request.method,
+                'status': response.status_code,
+                'duration_ms': round(duration * 1000, 2),
+                'db_queries': stats.queries,
+                'db_time_ms': round(stats.db_time * 1000, 2),
+                'cache_hits': stats.cache_hits,
+                'cache_misses': stats.cache_misses,
+            }
+            logger.debug(' '.join(f'{key}={value}' for key, value in fields.items()),
+                         extra=fields)
@@ -0,0 +1,41 @@
+# Generated by Django 5.1 on 2026-10-17 06:16
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def populate_vote_counts(apps, schema_editor):
+    """Fill the new counters from the existing Vote rows."""
+    Question = apps.get_model('polls', 'Question')
+    Choice = apps.get_model('polls', 'Choice')
+    Vote = apps.get_model('polls', 'Vote')
+    Choice.objects.update(vote_count=Coalesce(Subquery(
+        Vote.objects.filter(choice=OuterRef('pk'))
+        .values('choice').annotate(total=Count('pk')).values('total')
+    ), 0))
+    Question.objects.update(vote_count=Coalesce(Subquery(
+        Choice.objects.filter(question=OuterRef('pk'))
+        .values('question').annotate(total=Sum('vote_count')).values('total')
+    ), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0003_remove_choice_votes_vote'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='choice',
+            name='vote_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='vote_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='total votes'),
+        ),
+        migrations.RunPython(populate_vote_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,93 @@
+# Generated by Django 5.1 on 2026-10-17 06:17
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models, transaction
+from django.db.models import Count, Max, Min, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+# Number of Vote rows copied per transaction, so the backfill never holds
+# row locks on the whole table at once.
+BATCH_SIZE = 5000
+
+
+def backfill_vote_question(apps, schema_editor):
+    """Copy each vote's question from its choice, one primary-key range at a time."""
+    Choice = apps.get_model('polls', 'Choice')
+    Vote = apps.get_model('polls', 'Vote')
+    db_alias = schema_editor.connection.alias
+    votes = Vote.objects.using(db_alias)
+    bounds = votes.aggregate(low=Min('pk'), high=Max('pk'))
+    if bounds['low'] is None:
+        return
+    question_of_choice = Subquery(
+        Choice.objects.using(db_alias).filter(pk=OuterRef('choice_id')).values('question_id')
+    )
+    for start in range(bounds['low'], bounds['high'] + 1, BATCH_SIZE):
+        with transaction.atomic(using=db_alias):
+            votes.filter(pk__gte=start, pk__lt=start + BATCH_SIZE,
+                         question__isnull=True).update(question_id=question_of_choice)
+
+
+def remove_duplicate_votes(apps, schema_editor):
+    """Keep only the latest vote of each user for each question, then fix the counters."""
+    Question = apps.get_model('polls', 'Question')
+    Choice = apps.get_model('polls', 'Choice')
+    Vote = apps.get_model('polls', 'Vote')
+    db_alias = schema_editor.connection.alias
+    duplicates = list(
+        Vote.objects.using(db_alias).values('user_id', 'question_id')
+        .annotate(total=Count('pk'), latest=Max('pk')).filter(total__gt=1)
+    )
+    if not duplicates:
+        return
+    with transaction.atomic(using=db_alias):
+        for group in duplicates:
+            (Vote.objects.using(db_alias)
+             .filter(user_id=group['user_id'], question_id=group['question_id'])
+             .exclude(pk=group['latest']).delete())
+        question_ids = {group['question_id'] for group in duplicates}
+        Choice.objects.using(db_alias).filter(question_id__in=question_ids).update(
+            vote_count=Coalesce(Subquery(
+                Vote.objects.using(db_alias).filter(choice=OuterRef('pk'))
+                .values('choice').annotate(total=Count('pk')).values('total')
+            ), 0))
+        Question.objects.using(db_alias).filter(pk__in=question_ids).update(
+            vote_count=Coalesce(Subquery(
+                Choice.objects.using(db_alias).filter(question=OuterRef('pk'))
+                .values('question').annotate(total=Sum('vote_count')).values('total')
+            ), 0))
+
+
+class Migration(migrations.Migration):
+
+    # Each backfill batch commits on its own.
+    atomic = False
+
+    dependencies = [
+        ('polls', '0004_choice_vote_count_question_vote_count'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vote',
+            name='question',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, to='polls.question'),
+        ),
+        migrations.RunPython(backfill_vote_question, migrations.RunPython.noop),
+        migrations.RunPython(remove_duplicate_votes, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='vote',
+            name='question',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='polls.question'),
+        ),
+        migrations.AddIndex(
+            model_name='vote',
+            index=models.Index(fields=['question', 'choice'], name='polls_vote_question_choice'),
+        ),
+        migrations.AddConstraint(
+            model_name='vote',
+            constraint=models.UniqueConstraint(fields=('user', 'question'), name='unique_vote_per_user_question'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.1.15 on 2026-10-17 07:21
+
+from django.db import migrations, models
+from django.db.models import Case, Value, When
+from django.utils import timezone
+
+
+def backfill_status(apps, schema_editor):
+    """Set the status of existing questions from their pub_date and end_date."""
+    Question = apps.get_model('polls', 'Question')
+    now = timezone.now()
+    # Every question starts out scheduled; move the published ones on.
+    Question.objects.using(schema_editor.connection.alias).filter(pub_date__lte=now).update(
+        status=Case(When(end_date__lt=now, then=Value('closed')), default=Value('open')))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0005_vote_question'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='question',
+            name='status',
+            field=models.CharField(choices=[('scheduled', 'Scheduled'), ('open', 'Open'), ('closed', 'Closed')], db_index=True, default='scheduled', editable=False, max_length=9),
+        ),
+        migrations.RunPython(backfill_status, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.1.15 on 2026-10-17 07:27
+
+from django.db import migrations, models
+
+
+def create_search_index(apps, schema_editor):
+    """
+    On PostgreSQL, index the question text by trigrams.
+
+    Case-insensitive "contains" searches compare UPPER(question_text), so
+    the index is on that expression. Other databases, and servers built
+    without the pg_trgm contrib module, search by scanning.
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+        if cursor.fetchone() is None:
+            return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    schema_editor.execute('CREATE INDEX IF NOT EXISTS polls_question_text_trgm ON polls_question '
+                          'USING gin (UPPER(question_text::text) gin_trgm_ops)')
+
+
+def drop_search_index(apps, schema_editor):
+    """Drop the trigram index again, leaving the pg_trgm extension in place."""
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS polls_question_text_trgm')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0006_question_status'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='question',
+            index=models.Index(fields=['-pub_date', '-id'], name='polls_question_pub_date_id'),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 5.1.15 on 2026-10-17 07:43
+
+import django.db.models.deletion
+import polls.models
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def build_tallies(apps, schema_editor):
+    """Fill the tallies from the existing votes, which have no vote events."""
+    Vote = apps.get_model('polls', 'Vote')
+    ChoiceTally = apps.get_model('polls', 'ChoiceTally')
+    TallyCheckpoint = apps.get_model('polls', 'TallyCheckpoint')
+    db = schema_editor.connection.alias
+    ChoiceTally.objects.using(db).bulk_create(
+        ChoiceTally(choice_id=choice_id, question_id=question_id, votes=votes)
+        for choice_id, question_id, votes in
+        Vote.objects.using(db).values('choice').annotate(votes=Count('pk')).order_by('choice')
+        .values_list('choice', 'question', 'votes')
+    )
+    TallyCheckpoint.objects.using(db).create(name='choice_tallies', last_event_id=0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0007_question_list_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TallyCheckpoint',
+            fields=[
+                ('name', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('last_event_id', models.BigIntegerField(default=0)),
+                ('updated', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ChoiceTally',
+            fields=[
+                ('choice', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='tally', serialize=False, to='polls.choice')),
+                ('votes', models.IntegerField(default=0)),
+                ('question', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='polls.question')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='VoteEvent',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('created', models.DateTimeField(default=polls.models.get_current_time)),
+                ('choice', models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='polls.choice')),
+                ('previous_choice', models.ForeignKey(db_constraint=False, db_index=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='polls.choice')),
+                ('question', models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='polls.question')),
+                ('user', models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.RunPython(build_tallies, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.1.15 on 2026-10-17 09:18
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0008_vote_events_and_tallies'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='voteevent',
+            name='choice',
+            field=models.ForeignKey(db_constraint=False, db_index=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='polls.choice'),
+        ),
+    ]
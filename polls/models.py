@@ -1,31 +1,138 @@
 """This module defines model-related classes for the polls application."""
 import datetime
 from django.contrib import admin
-from django.db import models
+from django.db import connections, models, transaction
 from django.utils import timezone
 from django.contrib.auth.models import User
 
 
+# A question closes this long after its end_date, the smallest step a DateTimeField stores.
+CLOSING_DELAY = datetime.timedelta(microseconds=1)
+
+
 def get_current_time():
     """Return the current date and time."""
     return timezone.now()
 
 
+class QuestionQuerySet(models.QuerySet):
+    """
+    Query helpers that evaluate a question's publication state in the database.
+
+    Each method mirrors one of the Question model methods so that views can
+    filter with a single query instead of loading every question into Python.
+    """
+
+    def published(self):
+        """Return questions whose pub_date is on or before now, see Question.is_published()."""
+        return self.filter(pub_date__lte=timezone.now())
+
+    def open_for_voting(self):
+        """Return questions that currently accept votes, see Question.can_vote()."""
+        now = timezone.now()
+        return self.filter(pub_date__lte=now).filter(
+            models.Q(end_date__isnull=True) | models.Q(end_date__gte=now)
+        )
+
+    def closed(self):
+        """Return published questions whose voting period has already ended."""
+        now = timezone.now()
+        return self.filter(pub_date__lte=now, end_date__lt=now)
+
+    def visible(self):
+        """Return the questions the site shows: those whose stored status is open or closed."""
+        return self.filter(status__in=[Question.Status.OPEN, Question.Status.CLOSED])
+
+    def refresh_status(self, now=None):
+        """
+        Store the new status of questions whose pub_date or end_date has passed.
+
+        Only scheduled and open questions can be due for a change, so the
+        update finds them through the status index instead of checking every
+        question. Return the number of questions changed.
+        """
+        if now is None:
+            now = timezone.now()
+        due = (models.Q(status=Question.Status.SCHEDULED, pub_date__lte=now)
+               | models.Q(status=Question.Status.OPEN, end_date__lt=now))
+        return self.filter(due).update(status=models.Case(
+            models.When(end_date__lt=now, then=models.Value(Question.Status.CLOSED)),
+            default=models.Value(Question.Status.OPEN),
+        ))
+
+    def next_status_change(self, now=None):
+        """
+        Return when the stored status of a question next has to change, or None.
+
+        That is the earliest pub_date of a scheduled question or, just after
+        it, the earliest end_date of an open one, as voting is still allowed
+        at end_date itself.
+        """
+        if now is None:
+            now = timezone.now()
+        found = self.aggregate(
+            next_pub_date=models.Min('pub_date', filter=models.Q(
+                status=Question.Status.SCHEDULED, pub_date__gt=now)),
+            next_end_date=models.Min('end_date', filter=models.Q(
+                status=Question.Status.OPEN, end_date__gte=now)),
+        )
+        changes = [found['next_pub_date']]
+        if found['next_end_date'] is not None:
+            changes.append(found['next_end_date'] + CLOSING_DELAY)
+        return min((change for change in changes if change is not None), default=None)
+
+    def with_choices(self):
+        """Prefetch each question's choices, with their stored vote counters, in one query."""
+        return self.prefetch_related(
+            models.Prefetch('choice_set', queryset=Choice.objects.order_by('pk'))
+        )
+
+
 class Question(models.Model):
     """
     Represents a poll question in the application.
 
-    Each question has its own text and a publication date.
+    Each question has its own text and a publication date. Its voting status
+    is stored as well, so pages can filter and show it without comparing
+    dates; save() sets it, and QuestionQuerySet.refresh_status() moves it on
+    as pub_date and end_date pass.
     """
 
+    class Status(models.TextChoices):
+        """Where a question is in its voting period."""
+
+        SCHEDULED = 'scheduled', 'Scheduled'
+        OPEN = 'open', 'Open'
+        CLOSED = 'closed', 'Closed'
+
     question_text = models.CharField(max_length=200)
     pub_date = models.DateTimeField('date published', default=get_current_time)
     end_date = models.DateTimeField('date ended', null=True, blank=True)
+    vote_count = models.PositiveIntegerField('total votes', default=0, editable=False)
+    status = models.CharField(max_length=9, choices=Status.choices, default=Status.SCHEDULED,
+                              db_index=True, editable=False)
+
+    objects = QuestionQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Serves the newest-first keyset pagination of the question list.
+            # On PostgreSQL, migration 0007 also adds a trigram index for searches.
+            models.Index(fields=['-pub_date', '-id'], name='polls_question_pub_date_id'),
+        ]
 
     def __str__(self):
         """Return a string representation of the question text."""
         return self.question_text
 
+    def save(self, *args, **kwargs):
+        """Store the status that the question's dates give it now, then save it."""
+        self.status = self.status_at(timezone.now())
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'status' not in update_fields:
+            kwargs['update_fields'] = [*update_fields, 'status']
+        super().save(*args, **kwargs)
+
     @admin.display(
         boolean=True,
         ordering='pub_date',
@@ -48,10 +155,15 @@ class Question(models.Model):
         Voting is allowed if the question is published and either has no end date
         or the current time is before the end date.
         """
-        now = timezone.now()
-        if self.end_date is None:
-            return self.pub_date <= now
-        return self.pub_date <= now <= self.end_date
+        return self.status_at(timezone.now()) == self.Status.OPEN
+
+    def status_at(self, now):
+        """Return the status of the question at the time `now`; voting includes end_date."""
+        if now < self.pub_date:
+            return self.Status.SCHEDULED
+        if self.end_date is not None and now > self.end_date:
+            return self.Status.CLOSED
+        return self.Status.OPEN
 
 
 class Choice(models.Model):
@@ -63,23 +175,147 @@ class Choice(models.Model):
 
     question = models.ForeignKey(Question, on_delete=models.CASCADE)
     choice_text = models.CharField(max_length=200)
+    vote_count = models.PositiveIntegerField(default=0, editable=False)
 
     @property
     def votes(self):
-        """Return the votes for this choice."""
-        return self.vote_set.count()
+        """Return the votes for this choice, as kept in the stored vote_count counter."""
+        return self.vote_count
 
     def __str__(self):
         """Return a string representation of the choice text."""
         return self.choice_text
 
 
+class VoteQuerySet(models.QuerySet):
+    """Query helpers for recording votes."""
+
+    def lock_voters(self, user_ids):
+        """
+        Lock the rows of the users `user_ids` until the transaction ends.
+
+        Every writer of votes takes this lock first, so a user's votes are
+        read and written by one transaction at a time, including the first
+        vote for a question, which has no Vote row to lock yet. Return the
+        ids of the users that exist.
+        """
+        no_key = connections[self.db].features.has_select_for_no_key_update
+        return set(User.objects.using(self.db).select_for_update(no_key=no_key)
+                   .filter(pk__in=user_ids).order_by('pk').values_list('pk', flat=True))
+
+    def record(self, user, choice):
+        """
+        Record `user`'s vote for `choice` and keep the vote counters in step.
+
+        The vote row is created, or locked and updated, inside one transaction
+        that holds the lock_voters() lock of the user, so concurrent votes of
+        the same user, direct or buffered, end up as a single vote with exact
+        counters. Return the id of the previously chosen choice, or None for a
+        new vote.
+        """
+        with transaction.atomic(using=self.db):
+            self.lock_voters([user.pk])
+            vote, created = self.select_for_update().get_or_create(
+                user=user, question_id=choice.question_id, defaults={'choice': choice},
+            )
+            if created:
+                Choice.objects.filter(pk=choice.pk).update(
+                    vote_count=models.F('vote_count') + 1)
+                Question.objects.filter(pk=choice.question_id).update(
+                    vote_count=models.F('vote_count') + 1)
+                VoteEvent.objects.create(
+                    user=user, question_id=choice.question_id, choice=choice)
+                return None
+
+            previous_choice_id = vote.choice_id
+            if previous_choice_id != choice.pk:
+                vote.choice = choice
+                vote.save(update_fields=['choice'])
+                Choice.objects.filter(pk__in=[previous_choice_id, choice.pk]).update(
+                    vote_count=models.Case(
+                        models.When(pk=choice.pk, then=models.F('vote_count') + 1),
+                        default=models.F('vote_count') - 1,
+                    ))
+                VoteEvent.objects.create(
+                    user=user, question_id=choice.question_id, choice=choice,
+                    previous_choice_id=previous_choice_id)
+            return previous_choice_id
+
+
 class Vote(models.Model):
     """
     Records a choice made by a user in response to a poll question.
 
-    Each vote is associated with a user and a choice.
+    Each vote is associated with a user and a choice. The choice's question is
+    stored on the vote as well, so that a user's vote for a question can be
+    found with one index lookup and the database can enforce one vote per
+    user and question.
     """
 
     user = models.ForeignKey(User, on_delete=models.CASCADE)
+    # indexed by the (question, choice) index below
+    question = models.ForeignKey(Question, on_delete=models.CASCADE, db_index=False)
     choice = models.ForeignKey(Choice, on_delete=models.CASCADE)
+
+    objects = VoteQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'question'],
+                                    name='unique_vote_per_user_question'),
+        ]
+        indexes = [
+            models.Index(fields=['question', 'choice'], name='polls_vote_question_choice'),
+        ]
+
+    def save(self, *args, **kwargs):
+        """Fill in the question from the choice before saving."""
+        if self.question_id is None and self.choice_id is not None:
+            self.question_id = self.choice.question_id
+        super().save(*args, **kwargs)
+
+
+class VoteEvent(models.Model):
+    """
+    One change to a user's vote, in an append-only log.
+
+    Every first vote, every switch to another choice and every deleted vote,
+    such as of a deleted user, adds an event; events are never changed.
+    `previous_choice` is empty for a first vote and is the choice the vote
+    moved away from otherwise; `choice` is empty for a deleted vote. The
+    references are not enforced by the database, so the log outlives
+    deleted users, questions and choices.
+    """
+
+    id = models.BigAutoField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.DO_NOTHING, db_constraint=False,
+                             db_index=False, related_name='+')
+    question = models.ForeignKey(Question, on_delete=models.DO_NOTHING, db_constraint=False,
+                                 db_index=False, related_name='+')
+    choice = models.ForeignKey(Choice, on_delete=models.DO_NOTHING, db_constraint=False,
+                               db_index=False, null=True, related_name='+')
+    previous_choice = models.ForeignKey(Choice, on_delete=models.DO_NOTHING, db_constraint=False,
+                                        db_index=False, null=True, related_name='+')
+    created = models.DateTimeField(default=get_current_time)
+
+
+class ChoiceTally(models.Model):
+    """
+    The number of votes for a choice, materialized from the VoteEvent log.
+
+    polls.tallies.refresh_tallies() applies the events after the
+    TallyCheckpoint, so this table trails the log until it runs.
+    """
+
+    choice = models.OneToOneField(Choice, on_delete=models.CASCADE, primary_key=True,
+                                  related_name='tally')
+    question = models.ForeignKey(Question, on_delete=models.CASCADE)
+    votes = models.IntegerField(default=0)
+
+
+class TallyCheckpoint(models.Model):
+    """The id of the last VoteEvent applied to a materialized table, by table name."""
+
+    name = models.CharField(max_length=50, primary_key=True)
+    last_event_id = models.BigIntegerField(default=0)
+    updated = models.DateTimeField(auto_now=True)
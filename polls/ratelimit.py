@@ -0,0 +1,254 @@
+"""
+Token-bucket rate limiting of votes and logins, per user and per client IP.
+
+Each limit is a bucket that holds up to `burst` tokens and refills at `rate`
+tokens a second; every request takes a token, and a request that finds the
+bucket empty is answered with 429 Too Many Requests. RateLimitMiddleware
+checks the limits in POLLS_RATE_LIMITS before the view runs, so a rejected
+request costs no database work beyond, for a per-user limit, loading the
+session.
+
+The buckets live in a pluggable backend named by POLLS_RATE_LIMIT_BACKEND:
+LocalBuckets keeps them in the memory of each server process, and
+CacheBuckets in the shared cache, so that all servers count together.
+"""
+import functools
+import ipaddress
+import logging
+import math
+import threading
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.module_loading import import_string
+from .routers import SAFE_METHODS
+
+logger = logging.getLogger('polls')
+
+RATE_LIMIT_CACHE_KEY = 'polls:ratelimit:{key}'
+PERIODS = {'s': 1, 'm': 60, 'h': 3600}
+SCOPES = ('user', 'ip')
+
+
+class Limit:
+    """A token bucket of `burst` tokens refilled at `rate` tokens a second, per `scope`."""
+
+    def __init__(self, scope, rate, burst):
+        """Create a limit for the given scope, "user" or "ip"."""
+        self.scope = scope
+        self.rate = rate
+        self.burst = burst
+
+    def __repr__(self):
+        """Return the limit in the form it is configured in."""
+        return f"Limit({self.scope!r}, {self.rate!r}, {self.burst!r})"
+
+
+@functools.lru_cache
+def parse_limits(value):
+    """
+    Parse limits like ``user:2/s:20,ip:50/m:100`` into a list of Limits.
+
+    Each entry is a scope, "user" or "ip", a number of requests per second,
+    minute or hour, and the burst of requests allowed at once.
+    """
+    limits = []
+    for entry in filter(None, (part.strip() for part in value.split(','))):
+        try:
+            scope, rate, burst = entry.split(':')
+            count, period = rate.split('/')
+            limit = Limit(scope, int(count) / PERIODS[period], int(burst))
+        except (KeyError, ValueError):
+            raise ValueError(f"Invalid rate limit {entry!r}; use scope:count/period:burst, "
+                             f"for example user:2/s:20.") from None
+        if scope not in SCOPES or limit.rate <= 0 or limit.burst < 1:
+            raise ValueError(f"Invalid rate limit {entry!r}.")
+        limits.append(limit)
+    return limits
+
+
+@functools.lru_cache
+def trusted_networks(proxies):
+    """Return the networks of the `proxies` addresses, which may be CIDR ranges."""
+    return [ipaddress.ip_network(proxy, strict=False) for proxy in proxies]
+
+
+def is_trusted(address):
+    """Return True if `address` is one of the POLLS_TRUSTED_PROXIES."""
+    return any(address in network
+               for network in trusted_networks(tuple(settings.POLLS_TRUSTED_PROXIES)))
+
+
+def get_client_ip(request):
+    """
+    Get the visitor's IP address.
+
+    X-Forwarded-For is only believed when the request comes from one of the
+    POLLS_TRUSTED_PROXIES. Its entries are then read from the right, the
+    ones added by the proxies closest to the server, and the first address
+    that is not a trusted proxy is the client. Entries left of it were sent
+    by the client and may be forged.
+    """
+    client = request.META.get('REMOTE_ADDR')
+    forwarded = request.META.get('HTTP_X_FORWARDED_FOR')
+    if not forwarded or client is None or not settings.POLLS_TRUSTED_PROXIES:
+        return client
+    for hop in [client, *reversed(forwarded.split(','))]:
+        try:
+            address = ipaddress.ip_address(hop.strip())
+        except ValueError:
+            break
+        client = str(address)
+        if not is_trusted(address):
+            break
+    return client
+
+
+def take(tokens, updated, limit, now):
+    """
+    Take a token from a bucket that held `tokens` at time `updated`.
+
+    Return the new number of tokens, or None if the bucket is empty, and the
+    seconds until the next token.
+    """
+    tokens = min(limit.burst, tokens + (now - updated) * limit.rate)
+    if tokens >= 1:
+        return tokens - 1, 0
+    return None, (1 - tokens) / limit.rate
+
+
+class LocalBuckets:
+    """Token buckets in the memory of this server process."""
+
+    # Number of buckets above which the full ones are forgotten.
+    max_buckets = 100000
+
+    def __init__(self, clock=time.time):
+        """Create a backend with no buckets, reading the time from `clock`."""
+        self.clock = clock
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def consume(self, key, limit):
+        """Take a token from the bucket `key`; return the seconds to wait, 0 if it was taken."""
+        now = self.clock()
+        with self._lock:
+            tokens, updated, _ = self._buckets.get(key, (limit.burst, now, now))
+            tokens, wait = take(tokens, updated, limit, now)
+            if tokens is not None:
+                if len(self._buckets) >= self.max_buckets:
+                    self._prune(now)
+                full_at = now + (limit.burst - tokens) / limit.rate
+                self._buckets[key] = (tokens, now, full_at)
+        return wait
+
+    def _prune(self, now):
+        """Forget the buckets that have refilled, as a missing bucket counts as full."""
+        self._buckets = {key: bucket for key, bucket in self._buckets.items()
+                         if bucket[2] > now}
+
+    def reset(self):
+        """Refill every bucket."""
+        with self._lock:
+            self._buckets.clear()
+
+
+class CacheBuckets:
+    """
+    Token buckets in the shared cache, counted across all server processes.
+
+    A bucket is read and written back without a lock, so concurrent requests
+    with the same key may occasionally both take the last token.
+    """
+
+    def __init__(self, clock=time.time):
+        """Create a backend reading the time from `clock`."""
+        self.clock = clock
+
+    def consume(self, key, limit):
+        """Take a token from the bucket `key`; return the seconds to wait, 0 if it was taken."""
+        now = self.clock()
+        cache_key = RATE_LIMIT_CACHE_KEY.format(key=key)
+        tokens, updated = cache.get(cache_key, (limit.burst, now))
+        tokens, wait = take(tokens, updated, limit, now)
+        if tokens is not None:
+            # An expired bucket would have refilled anyway.
+            cache.set(cache_key, (tokens, now),
+                      timeout=math.ceil((limit.burst - tokens) / limit.rate) + 1)
+        return wait
+
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    """Return the process-wide instance of the POLLS_RATE_LIMIT_BACKEND class."""
+    path = settings.POLLS_RATE_LIMIT_BACKEND
+    with _backends_lock:
+        if path not in _backends:
+            _backends[path] = import_string(path)()
+        return _backends[path]
+
+
+def check_rate_limits(request, endpoint):
+    """
+    Take a token from each of the `endpoint` limits that apply to the request.
+
+    Return None if all allowed it, or else the seconds until it would be allowed.
+    """
+    limits = parse_limits(settings.POLLS_RATE_LIMITS.get(endpoint, ''))
+    if not limits:
+        return None
+    backend = get_rate_limiter()
+    ip_address = get_client_ip(request)
+    user_id = None
+    # Per-IP limits first: they need nothing but the request.
+    for limit in sorted(limits, key=lambda limit: limit.scope != 'ip'):
+        if limit.scope == 'ip':
+            key = f'{endpoint}:ip:{ip_address}'
+        else:
+            user_id = request.session.get(SESSION_KEY)
+            if user_id is None:
+                continue
+            key = f'{endpoint}:user:{user_id}'
+        wait = backend.consume(key, limit)
+        if wait:
+            logger.warning("Rate limited %s request from %s", endpoint, ip_address,
+                           extra={'event': 'rate_limited', 'user_id': user_id,
+                                  'ip': ip_address, 'endpoint': endpoint,
+                                  'scope': limit.scope})
+            return wait
+    return None
+
+
+class RateLimitMiddleware:
+    """Answer requests over the POLLS_RATE_LIMITS of their view with 429 Too Many Requests."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        """Store the next handler, and adapt to it being synchronous or asynchronous."""
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        """Handle the request; the limits are checked in process_view()."""
+        return self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        """Return a 429 response if the request is over a limit of its view, else None."""
+        if request.method in SAFE_METHODS or request.resolver_match is None:
+            return None
+        wait = check_rate_limits(request, request.resolver_match.view_name)
+        if wait is None:
+            return None
+        response = HttpResponse("Too many requests; please try again later.\n",
+                                content_type='text/plain', status=429)
+        response['Retry-After'] = str(math.ceil(wait))
+        return response
@@ -0,0 +1,123 @@
+"""
+Routing of poll reads to read replicas, with a read-your-writes window.
+
+ReadReplicaMiddleware picks one of POLLS_READ_REPLICAS for each GET or HEAD
+request, and ReplicaRouter sends that request's reads of polls models to it.
+Everything else goes to the primary: writes, requests with other methods,
+sessions and users, and reads made outside a request. After a write the
+browser gets a cookie that keeps its requests on the primary for
+POLLS_READ_YOUR_WRITES_SECONDS, so it sees its own vote despite replication
+lag.
+"""
+import contextlib
+import contextvars
+import random
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+PRIMARY_COOKIE = 'polls_primary_until'
+SAFE_METHODS = ('GET', 'HEAD')
+
+# The replica the current request reads from, or None to read from the primary.
+current_replica = contextvars.ContextVar('polls_replica', default=None)
+
+
+@contextlib.contextmanager
+def primary_reads():
+    """
+    Read from the primary inside the block, even during a request that uses a replica.
+
+    Use it for reads that are stored in the shared cache, as a copy taken
+    from a lagging replica would outlive the lag.
+    """
+    token = current_replica.set(None)
+    try:
+        yield
+    finally:
+        current_replica.reset(token)
+
+
+class ReplicaRouter:
+    """Send reads of polls models to the current request's replica, and the rest to the primary."""
+
+    def db_for_read(self, model, **hints):
+        """Return the replica of the current request for polls models, else the primary."""
+        replica = current_replica.get()
+        if replica is not None and model._meta.app_label == 'polls':
+            return replica
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        """Write to the primary, also for objects that were read from a replica."""
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        """Allow relations between objects of the primary and its replicas, which hold the same data."""
+        databases = {DEFAULT_DB_ALIAS, *settings.POLLS_READ_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        """Migrate only the primary; the replicas copy its schema."""
+        return db not in settings.POLLS_READ_REPLICAS
+
+
+def pinned_to_primary(request):
+    """Return True if the request's browser wrote recently and must read from the primary."""
+    try:
+        return float(request.COOKIES[PRIMARY_COOKIE]) > time.time()
+    except (KeyError, ValueError):
+        return False
+
+
+class ReadReplicaMiddleware:
+    """Choose where each request reads from, and pin browsers that write to the primary."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        """Store the next handler, and adapt to it being synchronous or asynchronous."""
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        """Handle the request with reads routed to a replica where that is safe."""
+        if self.is_async:
+            return self.__acall__(request)
+        token = current_replica.set(self.choose_replica(request))
+        try:
+            response = self.get_response(request)
+        finally:
+            current_replica.reset(token)
+        return self.pin(request, response)
+
+    async def __acall__(self, request):
+        """Asynchronous version of __call__()."""
+        token = current_replica.set(self.choose_replica(request))
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_replica.reset(token)
+        return self.pin(request, response)
+
+    def choose_replica(self, request):
+        """Return the replica for the request to read from, or None for the primary."""
+        replicas = settings.POLLS_READ_REPLICAS
+        if (not replicas or request.method not in SAFE_METHODS
+                or pinned_to_primary(request)):
+            return None
+        return random.choice(replicas)
+
+    def pin(self, request, response):
+        """After a request that may have written, keep the browser on the primary for a while."""
+        window = settings.POLLS_READ_YOUR_WRITES_SECONDS
+        if settings.POLLS_READ_REPLICAS and window > 0 and request.method not in SAFE_METHODS:
+            response.set_cookie(PRIMARY_COOKIE, f"{time.time() + window:.3f}",
+                                max_age=window, httponly=True, samesite='Lax')
+        return response
@@ -0,0 +1,89 @@
+"""
+The status scheduler: moves stored question statuses on as their dates pass.
+
+Pages bring the statuses up to date themselves when a status change has come
+due, see polls.cache.refresh_statuses_if_due(). The scheduler does it without
+waiting for a request, so the admin, exports and anything reading the table
+directly see a question open and close exactly at its pub_date and end_date.
+"""
+import datetime
+import heapq
+import logging
+import threading
+from django.db import close_old_connections
+from django.utils import timezone
+from .cache import refresh_statuses
+from .models import CLOSING_DELAY, Question
+
+logger = logging.getLogger('polls')
+
+
+class StatusScheduler:
+    """
+    Wake up at each upcoming status change and store the new statuses.
+
+    The upcoming changes of the next `horizon` seconds are kept in a heap of
+    (time, question id) pairs. They are reloaded every `reload_interval`
+    seconds, to pick up questions that were added or changed since.
+    """
+
+    def __init__(self, horizon=3600, reload_interval=60):
+        """Create a scheduler with an empty heap."""
+        self.horizon = horizon
+        self.reload_interval = reload_interval
+        self.heap = []
+        self.reload_at = None
+        self.stopped = threading.Event()
+
+    def load(self, now):
+        """Fill the heap with the status changes due up to `horizon` seconds after `now`."""
+        until = now + datetime.timedelta(seconds=self.horizon)
+        scheduled = (Question.objects.filter(status=Question.Status.SCHEDULED,
+                                             pub_date__lte=until)
+                     .values_list('pub_date', 'pk'))
+        closing = (Question.objects.filter(status=Question.Status.OPEN, end_date__lt=until)
+                   .values_list('end_date', 'pk'))
+        self.heap = [(pub_date, pk) for pub_date, pk in scheduled]
+        self.heap += [(end_date + CLOSING_DELAY, pk) for end_date, pk in closing]
+        heapq.heapify(self.heap)
+        self.reload_at = now + datetime.timedelta(seconds=self.reload_interval)
+
+    def run_pending(self, now=None):
+        """
+        Store the new statuses if any status change is due at `now`.
+
+        Return the number of questions whose status changed.
+        """
+        if now is None:
+            now = timezone.now()
+        if self.reload_at is None or now >= self.reload_at:
+            self.load(now)
+        due = []
+        while self.heap and self.heap[0][0] <= now:
+            due.append(heapq.heappop(self.heap)[1])
+        if not due:
+            return 0
+        changed = refresh_statuses(now)[0]
+        if changed:
+            logger.info("Updated the status of %s questions", changed,
+                        extra={'event': 'status_refresh', 'changed': changed})
+        return changed
+
+    def seconds_until_next(self, now):
+        """Return how long to sleep before the next status change or reload."""
+        wake_at = self.reload_at
+        if self.heap:
+            wake_at = min(wake_at, self.heap[0][0])
+        return max((wake_at - now).total_seconds(), 0)
+
+    def run(self):
+        """Run pending status changes until stop() is called."""
+        refresh_statuses()
+        while not self.stopped.is_set():
+            close_old_connections()
+            self.run_pending()
+            self.stopped.wait(self.seconds_until_next(timezone.now()))
+
+    def stop(self):
+        """Make run() return after the current step."""
+        self.stopped.set()
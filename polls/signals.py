@@ -0,0 +1,54 @@
+"""Signal receivers that keep the polls application's caches up to date."""
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .backends import invalidate_user
+from .cache import bump_results_version, invalidate_index, invalidate_status_change
+from .live import broadcaster
+from .models import Choice, Question, Vote, VoteEvent
+
+
+@receiver(post_save, sender=Question)
+@receiver(post_delete, sender=Question)
+@receiver(post_save, sender=Choice)
+@receiver(post_delete, sender=Choice)
+def invalidate_cached_questions(sender, instance, **kwargs):
+    """
+    Drop the cached index page, results and status change time when a question or choice changes.
+
+    The new results version is started once the change is committed; started
+    earlier, results read from the uncommitted rows could be cached under it.
+    """
+    invalidate_index()
+    if sender is Question:
+        # The question's dates may bring the next status change forward.
+        invalidate_status_change()
+    question_id = instance.pk if sender is Question else instance.question_id
+    transaction.on_commit(lambda: broadcaster.publish(
+        question_id, bump_results_version(question_id), None))
+
+
+@receiver(post_delete, sender=Vote)
+def uncount_deleted_vote(sender, instance, **kwargs):
+    """
+    Take a deleted vote, e.g. of a deleted user, off its choice's and question's counters.
+
+    The removal is logged as a VoteEvent without a choice, for the tallies.
+    The new results version is published once the deletion is committed.
+    """
+    Choice.objects.filter(pk=instance.choice_id).update(vote_count=F('vote_count') - 1)
+    Question.objects.filter(pk=instance.question_id).update(vote_count=F('vote_count') - 1)
+    VoteEvent.objects.create(user_id=instance.user_id, question_id=instance.question_id,
+                             choice=None, previous_choice_id=instance.choice_id)
+    question_id, choice_id = instance.question_id, instance.choice_id
+    transaction.on_commit(lambda: broadcaster.publish(
+        question_id, bump_results_version(question_id), {choice_id: -1}))
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def invalidate_cached_user(sender, instance, **kwargs):
+    """Drop the cached user when it changes, e.g. logs in, changes password or is deactivated."""
+    invalidate_user(instance.pk)
@@ -0,0 +1,189 @@
+"""
+Serving of the collected static files, compressed and cached by browsers.
+
+collectstatic stores every file under a name with a hash of its contents,
+such as polls/style.4a2b9c1d0e3f.css, and writes gzip (and, when the Brotli
+package is installed, brotli) copies of the text files next to it. The
+templates link to the hashed names, so StaticFilesMiddleware can tell
+browsers to keep those files for a year: a changed file gets a new name.
+
+The middleware serves the files from STATIC_ROOT in the server process,
+picking the smallest encoding the browser accepts, before any other
+middleware or view runs.
+"""
+import gzip
+import mimetypes
+import os
+import re
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.files.base import ContentFile
+from django.http import FileResponse, HttpResponseNotModified
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from .routers import SAFE_METHODS
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Files worth compressing, by extension; images and fonts are compressed already.
+COMPRESSIBLE_EXTENSIONS = ('.css', '.js', '.map', '.svg', '.txt', '.json', '.xml', '.html')
+# Files smaller than this gain too little from compression.
+MIN_COMPRESS_SIZE = 256
+# Encodings, best first, with the suffix of their precompressed copies.
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+
+def compress(content):
+    """Return {encoding: compressed content} of the encodings that make `content` smaller."""
+    variants = {'gzip': gzip.compress(content, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants['br'] = brotli.compress(content)
+    return {encoding: data for encoding, data in variants.items() if len(data) < len(content)}
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """ManifestStaticFilesStorage that also writes precompressed copies of the text files."""
+
+    def post_process(self, paths, dry_run=False, **options):
+        """Store the hashed files, then a .gz and .br copy of each compressible one."""
+        processed = []
+        for name, hashed_name, done in super().post_process(paths, dry_run, **options):
+            if done:
+                processed.append(hashed_name)
+            yield name, hashed_name, done
+        if dry_run:
+            return
+        for name in [*paths, *processed]:
+            if name.endswith(COMPRESSIBLE_EXTENSIONS) and self.exists(name):
+                with self.open(name) as file:
+                    content = file.read()
+                if len(content) < MIN_COMPRESS_SIZE:
+                    continue
+                for encoding, data in compress(content).items():
+                    suffix = dict(ENCODINGS)[encoding]
+                    if self.exists(name + suffix):
+                        self.delete(name + suffix)
+                    self._save(name + suffix, ContentFile(data))
+
+    def stored_name(self, name):
+        """
+        Return the hashed name of `name`.
+
+        Before collectstatic has run there is no manifest, and the plain name
+        is used, so that pages still render, e.g. in tests.
+        """
+        try:
+            return super().stored_name(name)
+        except ValueError:
+            if self.hashed_files:
+                raise
+            return name
+
+
+class StaticFile:
+    """A collected static file, with its precompressed copies."""
+
+    def __init__(self, path, immutable):
+        """Describe the file at `path`; `immutable` if its name has a content hash."""
+        stat = os.stat(path)
+        self.path = path
+        self.immutable = immutable
+        self.content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        self.last_modified = stat.st_mtime
+        self.etag = f'"{int(stat.st_mtime):x}-{stat.st_size:x}"'
+        self.variants = {encoding: path + suffix for encoding, suffix in ENCODINGS
+                         if os.path.isfile(path + suffix)}
+
+    def choose(self, accept_encoding):
+        """Return the (path, encoding) to send to a client that accepts `accept_encoding`."""
+        for encoding, variant in self.variants.items():
+            if re.search(rf'\b{encoding}\b', accept_encoding):
+                return variant, encoding
+        return self.path, None
+
+
+def find_static_files(root):
+    """Return {URL path: StaticFile} of the files collected into `root`."""
+    hashed_names = set(CompressedManifestStaticFilesStorage(location=root).hashed_files.values())
+    suffixes = tuple(suffix for _, suffix in ENCODINGS)
+    files = {}
+    for directory, _, filenames in os.walk(root):
+        for filename in filenames:
+            path = os.path.join(directory, filename)
+            name = os.path.relpath(path, root).replace(os.sep, '/')
+            if name.endswith(suffixes) and os.path.isfile(path.rsplit('.', 1)[0]):
+                continue
+            files[settings.STATIC_URL + name] = StaticFile(path, name in hashed_names)
+    return files
+
+
+class StaticFilesMiddleware:
+    """
+    Serve the files collected into STATIC_ROOT under STATIC_URL.
+
+    The files are listed once, when the first request arrives, so a
+    collectstatic takes effect when the server is restarted. Hashed names
+    are cached by browsers for a year, other names for POLLS_STATIC_MAX_AGE
+    seconds.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        """Store the next handler, and adapt to it being synchronous or asynchronous."""
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+        self.files = None
+
+    def __call__(self, request):
+        """Serve the request's static file, or pass the request on."""
+        if self.is_async:
+            return self.__acall__(request)
+        static_file = self.find(request)
+        if static_file is None:
+            return self.get_response(request)
+        return self.serve(request, static_file)
+
+    async def __acall__(self, request):
+        """Asynchronous version of __call__()."""
+        static_file = self.find(request)
+        if static_file is None:
+            return await self.get_response(request)
+        return self.serve(request, static_file)
+
+    def find(self, request):
+        """Return the StaticFile the request asks for, or None."""
+        if (not settings.POLLS_SERVE_STATIC or request.method not in SAFE_METHODS
+                or not request.path.startswith(settings.STATIC_URL)):
+            return None
+        if self.files is None:
+            self.files = find_static_files(os.fspath(settings.STATIC_ROOT))
+        return self.files.get(request.path)
+
+    def serve(self, request, static_file):
+        """Return the response with `static_file`, or 304 Not Modified."""
+        path, encoding = static_file.choose(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        etag = static_file.etag if encoding is None else f'{static_file.etag[:-1]}-{encoding}"'
+        response = get_conditional_response(request, etag=etag,
+                                            last_modified=static_file.last_modified)
+        if response is None:
+            response = FileResponse(open(path, 'rb'), content_type=static_file.content_type)
+            if encoding is not None:
+                response['Content-Encoding'] = encoding
+        elif not isinstance(response, HttpResponseNotModified):
+            return response
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(static_file.last_modified)
+        response['Vary'] = 'Accept-Encoding'
+        max_age = IMMUTABLE_MAX_AGE if static_file.immutable else settings.POLLS_STATIC_MAX_AGE
+        response['Cache-Control'] = f'public, max-age={max_age}' + (
+            ', immutable' if static_file.immutable else '')
+        return response
@@ -0,0 +1,252 @@
+"""
+Helpers for rebuilding and verifying the vote counts of the polls application.
+
+There are two kinds of counts. Choice.vote_count and Question.vote_count are
+kept in step by every vote as it is written. ChoiceTally rows are derived
+from the append-only VoteEvent log instead: refresh_tallies() applies the
+events after the last one it applied, so keeping them up to date costs as
+much as the votes since the previous refresh, however many votes there are.
+"""
+from collections import defaultdict
+from django.db import connection, transaction
+from django.db.models import Count, F, Max, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from .models import Choice, ChoiceTally, Question, TallyCheckpoint, Vote, VoteEvent
+
+# Name of the TallyCheckpoint of the ChoiceTally table.
+TALLY_CHECKPOINT = 'choice_tallies'
+# Questions rebuilt or checked per transaction, while votes are held off.
+SCAN_BATCH_SIZE = 500
+
+
+def _choice_vote_counts():
+    """Return a subquery counting the Vote rows of the outer Choice."""
+    return Coalesce(Subquery(
+        Vote.objects.filter(choice=OuterRef('pk'))
+        .values('choice').annotate(total=Count('pk')).values('total')
+    ), 0)
+
+
+def _question_vote_counts():
+    """Return a subquery summing the choice counters of the outer Question."""
+    return Coalesce(Subquery(
+        Choice.objects.filter(question=OuterRef('pk'))
+        .values('question').annotate(total=Sum('vote_count')).values('total')
+    ), 0)
+
+
+def rebuild_vote_counts(question_ids=None):
+    """
+    Recompute Choice.vote_count and Question.vote_count from the Vote table.
+
+    Only the questions in `question_ids` are rebuilt when it is given.
+    Return a tuple with the number of choices and questions whose counter changed.
+    """
+    choices = Choice.objects.all()
+    questions = Question.objects.all()
+    if question_ids is not None:
+        choices = choices.filter(question_id__in=question_ids)
+        questions = questions.filter(pk__in=question_ids)
+
+    with transaction.atomic():
+        changed_choices = (choices.alias(actual=_choice_vote_counts())
+                           .exclude(vote_count=F('actual'))
+                           .update(vote_count=_choice_vote_counts()))
+        changed_questions = (questions.alias(actual=_question_vote_counts())
+                             .exclude(vote_count=F('actual'))
+                             .update(vote_count=_question_vote_counts()))
+    return changed_choices, changed_questions
+
+
+def find_vote_count_mismatches(question_ids=None):
+    """
+    Return the choices and questions whose stored counter disagrees with the Vote table.
+
+    The result is a tuple of two lists of (pk, stored, actual) tuples.
+    """
+    choices = Choice.objects.all()
+    questions = Question.objects.all()
+    if question_ids is not None:
+        choices = choices.filter(question_id__in=question_ids)
+        questions = questions.filter(pk__in=question_ids)
+
+    choice_mismatches = list(
+        choices.annotate(actual=_choice_vote_counts())
+        .exclude(vote_count=F('actual'))
+        .values_list('pk', 'vote_count', 'actual')
+    )
+    question_mismatches = list(
+        questions.annotate(actual=Coalesce(Subquery(
+            Vote.objects.filter(choice__question=OuterRef('pk'))
+            .values('choice__question').annotate(total=Count('pk')).values('total')
+        ), 0))
+        .exclude(vote_count=F('actual'))
+        .values_list('pk', 'vote_count', 'actual')
+    )
+    return choice_mismatches, question_mismatches
+
+
+def _lock_event_log():
+    """
+    Wait for the transactions that are writing vote events, and return the last event id.
+
+    Must be called in a transaction. Event ids are handed out before their
+    transaction commits, so a later id can become visible before an earlier
+    one. On PostgreSQL the log is locked against writes until the
+    transaction ends, so every id up to the returned one is visible and no
+    event can be skipped. SQLite writes one transaction at a time anyway.
+    """
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute(f'LOCK TABLE {VoteEvent._meta.db_table} IN SHARE MODE')
+    return VoteEvent.objects.aggregate(last=Max('pk'))['last'] or 0
+
+
+def _lock_checkpoint():
+    """Return the TallyCheckpoint of the tallies, locked until the transaction ends."""
+    return TallyCheckpoint.objects.select_for_update().get_or_create(name=TALLY_CHECKPOINT)[0]
+
+
+def _apply_events(checkpoint, until, batch_size):
+    """
+    Apply up to `batch_size` events after `checkpoint` and up to id `until` to the tallies.
+
+    Events of choices that have been deleted since are skipped.
+    Return the number of events applied.
+    """
+    events = list(VoteEvent.objects.filter(pk__gt=checkpoint.last_event_id, pk__lte=until)
+                  .order_by('pk')
+                  .values_list('pk', 'question_id', 'choice_id', 'previous_choice_id')
+                  [:batch_size])
+    if not events:
+        return 0
+    deltas = defaultdict(int)
+    questions = {}
+    for _, question_id, choice_id, previous_choice_id in events:
+        if choice_id is not None:
+            deltas[choice_id] += 1
+            questions[choice_id] = question_id
+        if previous_choice_id is not None:
+            deltas[previous_choice_id] -= 1
+            questions[previous_choice_id] = question_id
+
+    tallies = ChoiceTally.objects.select_for_update().in_bulk(deltas)
+    for choice_id, tally in tallies.items():
+        tally.votes += deltas[choice_id]
+    ChoiceTally.objects.bulk_update(tallies.values(), ['votes'])
+    new_choices = Choice.objects.filter(pk__in=deltas.keys() - tallies.keys())
+    ChoiceTally.objects.bulk_create(
+        ChoiceTally(choice_id=pk, question_id=questions[pk], votes=deltas[pk])
+        for pk in new_choices.values_list('pk', flat=True)
+    )
+    checkpoint.last_event_id = events[-1][0]
+    checkpoint.save(update_fields=['last_event_id', 'updated'])
+    return len(events)
+
+
+def refresh_tallies(batch_size=10000):
+    """
+    Apply the vote events written since the last refresh to the ChoiceTally table.
+
+    Events are applied in batches of `batch_size`, each in its own
+    transaction that also advances the checkpoint, so an interrupted refresh
+    resumes where it stopped. Concurrent refreshes take turns on the
+    checkpoint. If there is no checkpoint yet, the tallies are rebuilt from
+    the Vote table instead. Return the number of events applied.
+    """
+    if not TallyCheckpoint.objects.filter(name=TALLY_CHECKPOINT).exists():
+        # Without a checkpoint the tallies were never built; events alone
+        # would miss the votes written before them.
+        rebuild_tallies(batch_size)
+        return 0
+    with transaction.atomic():
+        until = _lock_event_log()
+    applied = 0
+    while True:
+        with transaction.atomic():
+            count = _apply_events(_lock_checkpoint(), until, batch_size)
+        if not count:
+            return applied
+        applied += count
+
+
+def _question_batches():
+    """Yield the ids of all questions, SCAN_BATCH_SIZE at a time, in id order."""
+    last = 0
+    while True:
+        question_ids = list(Question.objects.filter(pk__gt=last).order_by('pk')
+                            .values_list('pk', flat=True)[:SCAN_BATCH_SIZE])
+        if not question_ids:
+            return
+        yield question_ids
+        last = question_ids[-1]
+
+
+def _catch_up(batch_size):
+    """
+    Lock the event log and apply every event not yet applied to the tallies.
+
+    Must be called in a transaction. Until it ends, no vote can change, so
+    the tallies then agree with the Vote table unless they have drifted.
+    """
+    until = _lock_event_log()
+    checkpoint = _lock_checkpoint()
+    while _apply_events(checkpoint, until, batch_size):
+        pass
+
+
+def rebuild_tallies(batch_size=10000):
+    """
+    Recompute the ChoiceTally table from the Vote table.
+
+    Use it after votes were written without events, such as by an import,
+    and to repair drift. The questions are rebuilt SCAN_BATCH_SIZE at a time,
+    each batch in a transaction that holds off votes only while it catches
+    up with the events and recounts that batch. Return the number of
+    tallies written.
+    """
+    with transaction.atomic():
+        until = _lock_event_log()
+        checkpoint, created = (TallyCheckpoint.objects.select_for_update()
+                               .get_or_create(name=TALLY_CHECKPOINT,
+                                              defaults={'last_event_id': until}))
+        if created:
+            # Tallies without a checkpoint were never built; every question is
+            # recounted below, so the events so far need not be applied.
+            ChoiceTally.objects.all().delete()
+    written = 0
+    for question_ids in _question_batches():
+        with transaction.atomic():
+            _catch_up(batch_size)
+            ChoiceTally.objects.filter(question_id__in=question_ids).delete()
+            written += len(ChoiceTally.objects.bulk_create(
+                ChoiceTally(choice_id=choice_id, question_id=question_id, votes=votes)
+                for choice_id, question_id, votes in
+                Vote.objects.filter(question_id__in=question_ids)
+                .values('choice').annotate(votes=Count('pk')).order_by('choice')
+                .values_list('choice', 'question', 'votes')
+            ))
+    return written
+
+
+def find_tally_mismatches(batch_size=10000):
+    """
+    Return the choices whose tally disagrees with the Vote table.
+
+    The questions are checked SCAN_BATCH_SIZE at a time. For each batch the
+    tallies are first brought up to date while votes are held off, so only
+    real drift is reported. The result is a list of (pk, stored, actual)
+    tuples, where a missing tally counts as 0.
+    """
+    mismatches = []
+    for question_ids in _question_batches():
+        with transaction.atomic():
+            _catch_up(batch_size)
+            mismatches.extend(
+                Choice.objects.filter(question_id__in=question_ids)
+                .annotate(stored=Coalesce('tally__votes', 0), actual=_choice_vote_counts())
+                .exclude(stored=F('actual'))
+                .order_by('pk')
+                .values_list('pk', 'stored', 'actual')
+            )
+    return mismatches
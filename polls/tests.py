@@ -1,11 +1,51 @@
 """This file contains tests for the polling application, including model methods and view functionality."""
+import asyncio
 import datetime
-from django.test import TestCase
+import gzip
+import importlib
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import mock, skipUnless
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import IntegrityError, OperationalError, connection, transaction
+from asgiref.sync import sync_to_async
+from django.http import Http404, HttpResponse
+from django.test import (Client, AsyncRequestFactory, RequestFactory, TestCase,
+                         TransactionTestCase, override_settings)
 from django.utils import timezone
-from django.urls import reverse
-from .models import Question, Choice, Vote
+from django.urls import clear_url_caches, resolve, reverse
+from .models import (CLOSING_DELAY, ChoiceTally, Question, Choice, TallyCheckpoint, Vote,
+                     VoteEvent)
+from django.contrib import admin
 from django.contrib.auth.models import User
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.cache import cache
 from mysite import settings
+from mysite import urls as mysite_urls
+from . import cache as polls_cache
+from . import async_views, views
+from . import urls as polls_urls
+from .admin import QuestionAdmin, make_export_action
+from .cache import bump_results_version
+from .dashboard import get_dashboard
+from .importer import iter_json_array
+from .ingest import VoteBuffer
+from .live import broadcaster
+from .logs import JsonFormatter, QueuedStreamHandler, RateLimitFilter
+from .metrics import Histogram, RequestMetricsMiddleware, registry as metrics_registry
+from .ratelimit import get_client_ip, get_rate_limiter, parse_limits
+from .routers import (PRIMARY_COOKIE, ReadReplicaMiddleware, ReplicaRouter, current_replica,
+                      primary_reads)
+from .scheduler import StatusScheduler
+from .tallies import (find_tally_mismatches, find_vote_count_mismatches, rebuild_tallies,
+                      rebuild_vote_counts, refresh_tallies)
 
 
 class QuestionModelTests(TestCase):
@@ -86,6 +126,10 @@ def create_question(question_text, days):
 class QuestionIndexViewTests(TestCase):
     """Tests for the index view of KU Polls."""
 
+    def setUp(self):
+        """Start each test with an empty cache."""
+        cache.clear()
+
     def test_no_questions(self):
         """If no questions exist, an appropriate message is displayed."""
         response = self.client.get(reverse('polls:index'))
@@ -200,6 +244,42 @@ class UserAuthTest(TestCase):
         self.assertRedirects(response, login_with_next)
 
 
+@override_settings(SESSION_ENGINE='django.contrib.sessions.backends.cached_db',
+                   POLLS_USER_CACHE_TIMEOUT=300)
+class CachedSessionTests(TestCase):
+    """Tests for cached sessions and the cached user of logged-in requests."""
+
+    def setUp(self):
+        """Log a user in with an empty cache."""
+        cache.clear()
+        self.user = User.objects.create_user(username='test_user', password='password')
+        self.client.login(username='test_user', password='password')
+
+    def test_logged_in_page_reads_no_session_or_user(self):
+        """Once cached, the session and user of a logged-in request cost no queries."""
+        url = reverse('polls:index')
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertContains(response, 'Welcome back, test_user')
+
+    def test_password_change_drops_cached_user(self):
+        """Changing the password logs out other sessions despite the cached user."""
+        url = reverse('polls:index')
+        self.client.get(url)
+        self.user.set_password('new password')
+        self.user.save()
+        response = self.client.get(url)
+        self.assertFalse(response.context['user'].is_authenticated)
+
+    def test_session_of_default_backend_stays_logged_in(self):
+        """Sessions logged in with Django's ModelBackend before the cache are still valid."""
+        client = Client()
+        client.force_login(self.user, backend='django.contrib.auth.backends.ModelBackend')
+        response = client.get(reverse('polls:index'))
+        self.assertContains(response, 'Welcome back, test_user')
+
+
 class VoteLimitTests(TestCase):
     """Tests to ensure vote limitations are enforced."""
 
@@ -240,3 +320,1656 @@ class VoteLimitTests(TestCase):
 
         login_url_with_next = f"{reverse('login')}?next={vote_url}"
         self.assertRedirects(response, login_url_with_next)
+
+
+class QuestionQuerySetTests(TestCase):
+    """Tests that the QuestionQuerySet filters agree with the Question model methods."""
+
+    def setUp(self):
+        """Create questions covering every combination of pub_date and end_date."""
+        now = timezone.now()
+        self.future = Question.objects.create(
+            question_text="Future", pub_date=now + datetime.timedelta(days=1))
+        self.open_no_end = Question.objects.create(
+            question_text="Open, no end date", pub_date=now - datetime.timedelta(days=1))
+        self.open_with_end = Question.objects.create(
+            question_text="Open, with end date", pub_date=now - datetime.timedelta(days=1),
+            end_date=now + datetime.timedelta(days=1))
+        self.closed = Question.objects.create(
+            question_text="Closed", pub_date=now - datetime.timedelta(days=2),
+            end_date=now - datetime.timedelta(days=1))
+
+    def test_published_matches_is_published(self):
+        """published() returns exactly the questions where is_published() is True."""
+        expected = {q.pk for q in Question.objects.all() if q.is_published()}
+        self.assertEqual(set(Question.objects.published().values_list('pk', flat=True)), expected)
+        self.assertNotIn(self.future.pk, expected)
+
+    def test_open_for_voting_matches_can_vote(self):
+        """open_for_voting() returns exactly the questions where can_vote() is True."""
+        expected = {q.pk for q in Question.objects.all() if q.can_vote()}
+        self.assertEqual(set(Question.objects.open_for_voting().values_list('pk', flat=True)),
+                         expected)
+        self.assertEqual(expected, {self.open_no_end.pk, self.open_with_end.pk})
+
+    def test_closed(self):
+        """closed() returns published questions that can no longer be voted on."""
+        self.assertQuerySetEqual(Question.objects.closed(), [self.closed])
+
+
+class PublishedQueryCountTests(TestCase):
+    """The index, detail and results pages look up questions with a single query."""
+
+    def setUp(self):
+        """Create many published and unpublished questions."""
+        cache.clear()
+        for n in range(30):
+            create_question(question_text=f"Past question {n}.", days=-n - 1)
+            create_question(question_text=f"Future question {n}.", days=n + 1)
+        self.question = create_question(question_text="Latest question.", days=0)
+        polls_cache.refresh_statuses()
+
+    @override_settings(POLLS_INDEX_PAGE_SIZE=20)
+    def test_index_is_single_query(self):
+        """
+        Each index page runs one query no matter how many questions exist.
+
+        The stored statuses and the time of the next status change are up to
+        date, so nothing else is queried, and a cached page runs no queries at all.
+        """
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('polls:index'))
+        self.assertEqual(len(response.context['latest_question_list']), 20)
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('polls:index'))
+        next_cursor = response.context['page'].next_cursor
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('polls:index'), {'after': next_cursor})
+        self.assertEqual(len(response.context['latest_question_list']), 11)
+
+    def test_detail_question_lookup_is_single_query(self):
+        """The detail page runs one query for the question and one for its choices."""
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('polls:detail', args=(self.question.id,)))
+        self.assertContains(response, self.question.question_text)
+
+    def test_results_question_lookup_is_single_query(self):
+        """The results page runs one query for the question and one for its choices."""
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('polls:results', args=(self.question.id,)))
+        self.assertContains(response, self.question.question_text)
+
+
+class VoteCounterTests(TestCase):
+    """Tests for the stored vote counters on Choice and Question."""
+
+    def setUp(self):
+        """Create a user, a question and two choices."""
+        self.user = User.objects.create_user(username='test_user', password='password')
+        self.question = Question.objects.create(question_text='Test Question')
+        self.choice1 = Choice.objects.create(choice_text='Choice 1', question=self.question)
+        self.choice2 = Choice.objects.create(choice_text='Choice 2', question=self.question)
+        self.vote_url = reverse('polls:vote', args=[self.question.id])
+
+    def assertCounts(self, choice1, choice2):
+        """Assert the stored counters of both choices and of the question."""
+        self.choice1.refresh_from_db()
+        self.choice2.refresh_from_db()
+        self.question.refresh_from_db()
+        self.assertEqual((self.choice1.votes, self.choice2.votes), (choice1, choice2))
+        self.assertEqual(self.question.vote_count, choice1 + choice2)
+
+    def test_new_vote_increments_counters(self):
+        """A first vote increments the chosen choice and the question total."""
+        self.client.login(username='test_user', password='password')
+        self.client.post(self.vote_url, {'choice': self.choice1.id})
+        self.assertCounts(1, 0)
+
+    def test_deleted_voter_is_uncounted(self):
+        """Deleting a user takes their vote off the counters and the cached results."""
+        Vote.objects.record(self.user, self.choice1)
+        Vote.objects.record(User.objects.create_user(username='other'), self.choice2)
+        self.assertEqual(polls_cache.get_results(self.question.id)['total'], 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.delete()
+        self.assertCounts(0, 1)
+        self.assertEqual(polls_cache.get_results(self.question.id)['total'], 1)
+
+    def test_changed_vote_moves_counter(self):
+        """Switching choice moves one vote between choices and keeps the total."""
+        self.client.login(username='test_user', password='password')
+        self.client.post(self.vote_url, {'choice': self.choice1.id})
+        self.client.post(self.vote_url, {'choice': self.choice2.id})
+        self.assertCounts(0, 1)
+
+    def test_repeated_vote_does_not_change_counters(self):
+        """Voting again for the same choice leaves the counters unchanged."""
+        self.client.login(username='test_user', password='password')
+        self.client.post(self.vote_url, {'choice': self.choice1.id})
+        self.client.post(self.vote_url, {'choice': self.choice1.id})
+        self.assertCounts(1, 0)
+
+    def test_rebuild_vote_counts_command(self):
+        """rebuild_vote_counts --check reports drift and a rebuild repairs it."""
+        Vote.objects.create(user=self.user, choice=self.choice2)
+        with self.assertRaises(CommandError):
+            call_command('rebuild_vote_counts', '--check', stdout=StringIO())
+        call_command('rebuild_vote_counts', stdout=StringIO())
+        self.assertCounts(0, 1)
+        call_command('rebuild_vote_counts', '--check', stdout=StringIO())
+
+
+class VoteTallyTests(TestCase):
+    """Tests for the vote event log and the tallies materialized from it."""
+
+    def setUp(self):
+        """Create two users, a question and two choices."""
+        self.user1 = User.objects.create_user(username='user1', password='password')
+        self.user2 = User.objects.create_user(username='user2', password='password')
+        self.question = Question.objects.create(question_text='Test Question')
+        self.choice1 = Choice.objects.create(choice_text='Choice 1', question=self.question)
+        self.choice2 = Choice.objects.create(choice_text='Choice 2', question=self.question)
+
+    def tallies(self):
+        """Return the tallies of both choices, 0 for a missing one."""
+        votes = dict(ChoiceTally.objects.values_list('choice_id', 'votes'))
+        return votes.get(self.choice1.pk, 0), votes.get(self.choice2.pk, 0)
+
+    def test_votes_are_logged(self):
+        """A new vote and a switch each log an event; a repeated vote logs none."""
+        self.client.login(username='user1', password='password')
+        vote_url = reverse('polls:vote', args=[self.question.id])
+        self.client.post(vote_url, {'choice': self.choice1.id})
+        self.client.post(vote_url, {'choice': self.choice1.id})
+        self.client.post(vote_url, {'choice': self.choice2.id})
+        self.assertEqual(
+            list(VoteEvent.objects.order_by('pk').values_list('choice', 'previous_choice')),
+            [(self.choice1.pk, None), (self.choice2.pk, self.choice1.pk)],
+        )
+
+    def test_buffered_votes_are_logged(self):
+        """A buffered batch logs the new and changed votes it writes."""
+        Vote.objects.record(self.user1, self.choice1)
+        buffer = VoteBuffer()
+        buffer.submit(self.user1.id, self.question.id, self.choice2.id)
+        buffer.submit(self.user2.id, self.question.id, self.choice2.id)
+        buffer.flush()
+        self.assertEqual(
+            list(VoteEvent.objects.order_by('pk').values_list('user', 'previous_choice')),
+            [(self.user1.pk, None), (self.user1.pk, self.choice1.pk), (self.user2.pk, None)],
+        )
+
+    def test_refresh_applies_new_events_only(self):
+        """Each refresh applies the events since the previous one."""
+        Vote.objects.record(self.user1, self.choice1)
+        self.assertEqual(refresh_tallies(), 1)
+        self.assertEqual(self.tallies(), (1, 0))
+        Vote.objects.record(self.user1, self.choice2)
+        Vote.objects.record(self.user2, self.choice2)
+        self.assertEqual(refresh_tallies(batch_size=1), 2)
+        self.assertEqual(self.tallies(), (0, 2))
+        self.assertEqual(refresh_tallies(), 0)
+
+    def test_first_refresh_counts_votes_without_events(self):
+        """Without a checkpoint, a refresh builds the tallies from the existing votes."""
+        TallyCheckpoint.objects.all().delete()
+        Vote.objects.create(user=self.user1, choice=self.choice1)
+        rebuild_vote_counts()
+        Vote.objects.record(self.user1, self.choice2)
+        refresh_tallies()
+        self.assertEqual(self.tallies(), (0, 1))
+        self.assertEqual(find_tally_mismatches(), [])
+
+    def test_deleted_voter_is_logged(self):
+        """Deleting a user logs the removal of their vote, which the next refresh applies."""
+        Vote.objects.record(self.user1, self.choice1)
+        Vote.objects.record(self.user2, self.choice1)
+        refresh_tallies()
+        self.user1.delete()
+        self.assertEqual(refresh_tallies(), 1)
+        self.assertEqual(self.tallies(), (1, 0))
+        self.assertEqual(find_tally_mismatches(), [])
+
+    @mock.patch('polls.tallies.SCAN_BATCH_SIZE', 1)
+    def test_rebuild_and_check_in_batches(self):
+        """Questions are rebuilt and checked one batch at a time."""
+        other = Question.objects.create(question_text='Other Question')
+        other_choice = Choice.objects.create(choice_text='Other', question=other)
+        Vote.objects.create(user=self.user1, choice=self.choice1)
+        Vote.objects.create(user=self.user1, choice=other_choice)
+        self.assertEqual([pk for pk, _, _ in find_tally_mismatches()],
+                         [self.choice1.pk, other_choice.pk])
+        self.assertEqual(rebuild_tallies(), 2)
+        self.assertEqual(find_tally_mismatches(), [])
+
+    def test_rebuild_and_check(self):
+        """refresh_tallies --check reports drift and --rebuild repairs it."""
+        Vote.objects.record(self.user1, self.choice1)
+        Vote.objects.create(user=self.user2, choice=self.choice2)
+        with self.assertRaises(CommandError):
+            call_command('refresh_tallies', '--check', stdout=StringIO())
+        call_command('refresh_tallies', '--rebuild', stdout=StringIO())
+        self.assertEqual(self.tallies(), (1, 1))
+        Vote.objects.record(self.user1, self.choice2)
+        call_command('refresh_tallies', '--check', stdout=StringIO())
+        self.assertEqual(self.tallies(), (0, 2))
+
+
+class RateLimitTests(TestCase):
+    """Tests for the token-bucket rate limits of votes and logins."""
+
+    def setUp(self):
+        """Create a user and a poll, and give the rate limiter empty buckets and a fake clock."""
+        self.user = User.objects.create_user(username='test_user', password='password')
+        self.question = Question.objects.create(question_text='Test Question')
+        self.choice = Choice.objects.create(choice_text='Choice 1', question=self.question)
+        self.vote_url = reverse('polls:vote', args=[self.question.id])
+        self.now = 1000.0
+        limiter = get_rate_limiter()
+        self.addCleanup(setattr, limiter, 'clock', limiter.clock)
+        self.addCleanup(limiter.reset)
+        limiter.reset()
+        limiter.clock = lambda: self.now
+
+    def vote(self, **extra):
+        """Post a vote and return the response."""
+        return self.client.post(self.vote_url, {'choice': self.choice.id}, **extra)
+
+    @override_settings(POLLS_RATE_LIMITS={'polls:vote': 'ip:10/s:20'})
+    def test_flood_is_held_to_the_rate(self):
+        """A flood of votes gets the burst and then the refill rate through, and 429s for the rest."""
+        self.client.login(username='test_user', password='password')
+        statuses = []
+        # 300 votes in 3 seconds.
+        for _ in range(300):
+            statuses.append(self.vote().status_code)
+            self.now += 0.01
+        self.assertEqual(set(statuses), {302, 429})
+        self.assertEqual(statuses[:20], [302] * 20)
+        self.assertAlmostEqual(statuses.count(302), 20 + 10 * 3, delta=1)
+
+    @override_settings(POLLS_RATE_LIMITS={'polls:vote': 'ip:1/m:1'})
+    def test_rejection_makes_no_queries(self):
+        """A request over its limit is answered before the session, user or poll is read."""
+        self.client.login(username='test_user', password='password')
+        self.vote()
+        with self.assertNumQueries(0):
+            response = self.vote()
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '60')
+        self.assertNotEqual(self.client.get(self.vote_url).status_code, 429)
+
+    @override_settings(POLLS_RATE_LIMITS={'polls:vote': 'user:1/m:2,ip:100/s:100'})
+    def test_user_limit_applies_across_addresses(self):
+        """A user's limit is shared by all the addresses they vote from."""
+        self.client.login(username='test_user', password='password')
+        self.assertEqual(self.vote(REMOTE_ADDR='10.0.0.1').status_code, 302)
+        self.assertEqual(self.vote(REMOTE_ADDR='10.0.0.2').status_code, 302)
+        self.assertEqual(self.vote(REMOTE_ADDR='10.0.0.3').status_code, 429)
+
+    @override_settings(POLLS_RATE_LIMITS={'login': 'ip:2/m:2'})
+    def test_login_attempts_are_limited(self):
+        """Login attempts from one address are limited, and other addresses are not."""
+        data = {'username': 'test_user', 'password': 'wrong'}
+        for _ in range(2):
+            self.assertEqual(self.client.post(reverse('login'), data).status_code, 200)
+        self.assertEqual(self.client.post(reverse('login'), data).status_code, 429)
+        self.assertEqual(self.client.post(reverse('login'), data,
+                                          REMOTE_ADDR='10.0.0.9').status_code, 200)
+
+    def test_invalid_limits_are_rejected(self):
+        """Malformed limits raise ValueError."""
+        self.assertEqual(parse_limits('user:2/s:20,ip:30/m:30')[1].rate, 0.5)
+        for value in ('user:2/s', 'host:2/s:20', 'ip:2/d:20', 'ip:0/s:1'):
+            with self.assertRaises(ValueError):
+                parse_limits(value)
+
+    def test_forwarded_for_is_read_through_trusted_proxies(self):
+        """X-Forwarded-For is believed only from trusted proxies, reading from the right."""
+        request = RequestFactory().get('/', REMOTE_ADDR='10.0.0.1',
+                                       HTTP_X_FORWARDED_FOR='1.2.3.4, 203.0.113.9, 10.0.0.2')
+        self.assertEqual(get_client_ip(request), '10.0.0.1')
+        with override_settings(POLLS_TRUSTED_PROXIES=['10.0.0.0/8']):
+            self.assertEqual(get_client_ip(request), '203.0.113.9')
+        with override_settings(POLLS_TRUSTED_PROXIES=['10.0.0.2']):
+            self.assertEqual(get_client_ip(request), '10.0.0.1')
+
+
+class ChoiceQueryCountTests(TestCase):
+    """The detail and results pages take a fixed number of queries however many choices exist."""
+
+    def setUp(self):
+        """Start each test with an empty cache."""
+        cache.clear()
+
+    def create_poll(self, num_choices):
+        """Create a published question with `num_choices` choices, and refresh the statuses."""
+        question = create_question(question_text=f"Poll with {num_choices} choices.", days=-1)
+        Choice.objects.bulk_create(
+            Choice(question=question, choice_text=f"Choice {n}", vote_count=n)
+            for n in range(num_choices)
+        )
+        polls_cache.refresh_statuses()
+        return question
+
+    def test_detail_query_count(self):
+        """The detail page runs two queries: the question and its prefetched choices."""
+        for num_choices in (2, 20, 200):
+            with self.subTest(num_choices=num_choices):
+                question = self.create_poll(num_choices)
+                with self.assertNumQueries(2):
+                    response = self.client.get(reverse('polls:detail', args=(question.id,)))
+                self.assertContains(response, 'name="choice"', count=num_choices)
+
+    def test_results_query_count(self):
+        """The results page runs two queries: the question and its prefetched choices."""
+        for num_choices in (2, 20, 200):
+            with self.subTest(num_choices=num_choices):
+                question = self.create_poll(num_choices)
+                with self.assertNumQueries(2):
+                    response = self.client.get(reverse('polls:results', args=(question.id,)))
+                self.assertContains(response, 'class="vote_count"', count=num_choices)
+
+
+class VoteModelTests(TestCase):
+    """Tests for the Vote model's denormalized question and its constraints."""
+
+    def setUp(self):
+        """Create a user, a question and two choices."""
+        self.user = User.objects.create_user(username='test_user', password='password')
+        self.question = Question.objects.create(question_text='Test Question')
+        self.choice1 = Choice.objects.create(choice_text='Choice 1', question=self.question)
+        self.choice2 = Choice.objects.create(choice_text='Choice 2', question=self.question)
+
+    def test_save_fills_question_from_choice(self):
+        """A vote saved without a question takes the question of its choice."""
+        vote = Vote.objects.create(user=self.user, choice=self.choice1)
+        self.assertEqual(vote.question, self.question)
+
+    def test_one_vote_per_user_and_question(self):
+        """The database rejects a second vote by the same user for the same question."""
+        Vote.objects.create(user=self.user, choice=self.choice1)
+        with self.assertRaises(IntegrityError):
+            Vote.objects.create(user=self.user, choice=self.choice2)
+
+    def test_detail_shows_last_vote(self):
+        """The detail page checks the choice the user voted for."""
+        Vote.objects.create(user=self.user, choice=self.choice2)
+        self.client.login(username='test_user', password='password')
+        response = self.client.get(reverse('polls:detail', args=(self.question.id,)))
+        self.assertEqual(response.context['last_vote'], self.choice2.id)
+        self.assertContains(response, f'value="{self.choice2.id}" checked')
+
+
+@skipUnless(connection.vendor == 'postgresql', "Concurrent writes need a PostgreSQL database.")
+class ConcurrentVoteTests(TransactionTestCase):
+    """Votes submitted at the same moment from many threads leave exact tallies."""
+
+    NUM_USERS = 20
+    VOTES_PER_USER = 15
+
+    def setUp(self):
+        """Create the voters, a question and three choices."""
+        self.users = [User.objects.create(username=f'voter{n}')
+                      for n in range(self.NUM_USERS)]
+        self.question = Question.objects.create(question_text='Busy Question')
+        self.choices = [Choice.objects.create(choice_text=f'Choice {n}', question=self.question)
+                        for n in range(3)]
+
+    def submit_votes(self, user, choices):
+        """Post one vote per choice in `choices` as `user`, each from its own client."""
+        vote_url = reverse('polls:vote', args=[self.question.id])
+        try:
+            client = Client()
+            client.force_login(user)
+            return [client.post(vote_url, {'choice': choice.id}).status_code
+                    for choice in choices]
+        finally:
+            connection.close()
+
+    def test_concurrent_votes_keep_exact_tallies(self):
+        """Hundreds of simultaneous votes leave one vote per user and matching counters."""
+        jobs = []
+        for n, user in enumerate(self.users):
+            for m in range(self.VOTES_PER_USER):
+                jobs.append((user, [self.choices[(n + m) % 3]]))
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            statuses = [status for result in executor.map(lambda job: self.submit_votes(*job), jobs)
+                        for status in result]
+
+        self.assertEqual(statuses, [302] * len(jobs))
+        self.assertEqual(Vote.objects.filter(question=self.question).count(), self.NUM_USERS)
+        self.assertEqual(find_vote_count_mismatches([self.question.id]), ([], []))
+        self.question.refresh_from_db()
+        self.assertEqual(self.question.vote_count, self.NUM_USERS)
+
+    def test_buffered_first_vote_waits_for_direct_vote(self):
+        """A buffered first vote written while a direct one is uncommitted moves the counters."""
+        user = self.users[0]
+        recorded = threading.Event()
+        release = threading.Event()
+
+        def vote_directly():
+            try:
+                with transaction.atomic():
+                    Vote.objects.record(user, self.choices[0])
+                    recorded.set()
+                    release.wait(5)
+            finally:
+                connection.close()
+
+        def flush_buffer():
+            try:
+                VoteBuffer().write([(user.id, self.question.id, self.choices[1].id)])
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            direct = executor.submit(vote_directly)
+            recorded.wait(5)
+            buffered = executor.submit(flush_buffer)
+            time.sleep(0.2)
+            release.set()
+            direct.result()
+            buffered.result()
+
+        self.assertEqual(Vote.objects.get(user=user).choice, self.choices[1])
+        self.assertEqual(find_vote_count_mismatches([self.question.id]), ([], []))
+        self.question.refresh_from_db()
+        self.assertEqual(self.question.vote_count, 1)
+
+
+class VoteBufferTests(TestCase):
+    """Tests for the write-behind vote buffer."""
+
+    def setUp(self):
+        """Create two users, a question and two choices."""
+        self.user1 = User.objects.create_user(username='user1', password='password')
+        self.user2 = User.objects.create_user(username='user2', password='password')
+        self.question = Question.objects.create(question_text='Test Question')
+        self.choice1 = Choice.objects.create(choice_text='Choice 1', question=self.question)
+        self.choice2 = Choice.objects.create(choice_text='Choice 2', question=self.question)
+
+    def test_flush_keeps_last_vote_per_user(self):
+        """A flushed batch stores each user's latest choice and exact counters."""
+        buffer = VoteBuffer(batch_size=2)
+        buffer.submit(self.user1.id, self.question.id, self.choice1.id)
+        buffer.submit(self.user2.id, self.question.id, self.choice1.id)
+        buffer.submit(self.user1.id, self.question.id, self.choice2.id)
+        self.assertEqual(buffer.flush(), 3)
+        self.assertEqual(buffer.pending(), 0)
+        self.assertEqual(Vote.objects.get(user=self.user1).choice, self.choice2)
+        self.assertEqual(Vote.objects.get(user=self.user2).choice, self.choice1)
+        self.assertEqual(find_vote_count_mismatches(), ([], []))
+
+    def test_flush_updates_existing_vote(self):
+        """A buffered vote replaces a vote recorded earlier."""
+        Vote.objects.record(self.user1, self.choice1)
+        buffer = VoteBuffer()
+        buffer.submit(self.user1.id, self.question.id, self.choice2.id)
+        buffer.flush()
+        self.assertEqual(Vote.objects.get(user=self.user1).choice, self.choice2)
+        self.assertEqual(find_vote_count_mismatches(), ([], []))
+
+    def test_flush_drops_votes_of_deleted_users_and_choices(self):
+        """Votes of a deleted user or choice are dropped; the rest of the batch is written."""
+        user3 = User.objects.create_user(username='user3', password='password')
+        choice3 = Choice.objects.create(choice_text='Choice 3', question=self.question)
+        Vote.objects.record(self.user2, self.choice1)
+        buffer = VoteBuffer()
+        buffer.submit(self.user1.id, self.question.id, self.choice1.id)
+        buffer.submit(self.user2.id, self.question.id, self.choice2.id)
+        buffer.submit(user3.id, self.question.id, self.choice1.id)
+        buffer.submit(self.user1.id, self.question.id, choice3.id)
+        user3.delete()
+        choice3.delete()
+        with self.assertLogs('polls', 'WARNING'):
+            buffer.flush()
+        self.assertEqual(Vote.objects.get(user=self.user2).choice, self.choice2)
+        self.assertFalse(Vote.objects.filter(user=self.user1).exists())
+        self.assertEqual(find_vote_count_mismatches(), ([], []))
+        self.question.refresh_from_db()
+        self.assertEqual(self.question.vote_count, 1)
+
+    @override_settings(POLLS_VOTE_BUFFER_ENABLED=True)
+    def test_vote_view_submits_to_buffer(self):
+        """With buffering enabled the vote view queues the vote instead of writing it."""
+        buffer = VoteBuffer()
+        self.client.login(username='user1', password='password')
+        with mock.patch('polls.views.get_vote_buffer', return_value=buffer):
+            response = self.client.post(reverse('polls:vote', args=[self.question.id]),
+                                        {'choice': self.choice1.id})
+        self.assertRedirects(response, reverse('polls:results', args=[self.question.id]))
+        self.assertFalse(Vote.objects.exists())
+        buffer.flush()
+        self.assertEqual(Vote.objects.get(user=self.user1).choice, self.choice1)
+
+
+class VoteBufferThreadTests(TransactionTestCase):
+    """Tests for the write-behind vote buffer's background thread."""
+
+    def test_stop_flushes_pending_votes(self):
+        """Votes submitted to a running buffer are all written once it is stopped."""
+        users = [User.objects.create(username=f'voter{n}') for n in range(50)]
+        question = Question.objects.create(question_text='Test Question')
+        choices = [Choice.objects.create(choice_text=f'Choice {n}', question=question)
+                   for n in range(2)]
+        buffer = VoteBuffer(batch_size=10, max_latency=0.01)
+        buffer.start()
+        for n, user in enumerate(users):
+            buffer.submit(user.id, question.id, choices[n % 2].id)
+        buffer.stop()
+        self.assertEqual(Vote.objects.count(), 50)
+        question.refresh_from_db()
+        self.assertEqual(question.vote_count, 50)
+
+
+class IndexCacheTests(TestCase):
+    """Tests for the cached question list of the index page."""
+
+    def setUp(self):
+        """Start each test with an empty cache."""
+        cache.clear()
+
+    def test_saving_a_question_invalidates_cache(self):
+        """A new or changed question shows up on the next index request."""
+        question = create_question(question_text="Past question.", days=-1)
+        self.client.get(reverse('polls:index'))
+        question.question_text = "Renamed question."
+        question.save()
+        response = self.client.get(reverse('polls:index'))
+        self.assertContains(response, "Renamed question.")
+
+    def test_deleting_a_question_invalidates_cache(self):
+        """A deleted question disappears from the next index request."""
+        question = create_question(question_text="Past question.", days=-1)
+        self.client.get(reverse('polls:index'))
+        question.delete()
+        response = self.client.get(reverse('polls:index'))
+        self.assertContains(response, "No polls are available.")
+
+    def test_status_is_cached(self):
+        """Each listed question has its stored Open or Closed status."""
+        create_question(question_text="Open question.", days=-1)
+        Question.objects.create(question_text="Closed question.",
+                                pub_date=timezone.now() - datetime.timedelta(days=2),
+                                end_date=timezone.now() - datetime.timedelta(days=1))
+        statuses = {q.question_text: q.get_status_display()
+                    for q in polls_cache.get_index_page().questions}
+        self.assertEqual(statuses, {"Open question.": "Open", "Closed question.": "Closed"})
+
+    def index_timeout(self, now):
+        """Return the timeout get_index_page() caches the first page for at `now`."""
+        with mock.patch('polls.cache.timezone.now', return_value=now), \
+                mock.patch.object(polls_cache.cache, 'set') as cache_set:
+            polls_cache.get_index_page()
+        return next(call.kwargs['timeout'] for call in cache_set.call_args_list
+                    if call.args[0] == polls_cache.INDEX_CACHE_KEY)
+
+    def test_timeout_capped_at_next_pub_date(self):
+        """The cache expires when the next question is published."""
+        now = timezone.now()
+        Question.objects.create(question_text="Soon.", pub_date=now + datetime.timedelta(seconds=30))
+        self.assertEqual(self.index_timeout(now), 31)
+
+    def test_timeout_capped_at_next_end_date(self):
+        """The cache expires just after the next question closes."""
+        now = timezone.now()
+        Question.objects.create(question_text="Closing.", pub_date=now - datetime.timedelta(days=1),
+                                end_date=now + datetime.timedelta(seconds=90))
+        self.assertEqual(self.index_timeout(now), 91)
+
+    def test_timeout_without_boundaries(self):
+        """Without upcoming boundaries the configured timeout is used."""
+        create_question(question_text="Past question.", days=-1)
+        self.assertEqual(self.index_timeout(timezone.now()), settings.POLLS_INDEX_CACHE_TIMEOUT)
+
+
+class QuestionStatusTests(TestCase):
+    """Tests for the stored question status and the status scheduler."""
+
+    def setUp(self):
+        """Create a scheduled question that opens in 30 seconds and closes a minute later."""
+        cache.clear()
+        self.now = timezone.now()
+        self.question = Question.objects.create(
+            question_text="Soon.", pub_date=self.now + datetime.timedelta(seconds=30),
+            end_date=self.now + datetime.timedelta(seconds=90))
+
+    def status(self):
+        """Return the stored status of the question."""
+        return Question.objects.values_list('status', flat=True).get(pk=self.question.pk)
+
+    def test_save_stores_status(self):
+        """Saving a question stores the status its dates give it now."""
+        self.assertEqual(self.question.status, Question.Status.SCHEDULED)
+        self.question.pub_date = self.now - datetime.timedelta(days=2)
+        self.question.end_date = self.now - datetime.timedelta(days=1)
+        self.question.save(update_fields=['pub_date', 'end_date'])
+        self.assertEqual(self.status(), Question.Status.CLOSED)
+
+    def test_refresh_status_at_boundaries(self):
+        """Questions open at pub_date and close just after end_date."""
+        pub_date, end_date = self.question.pub_date, self.question.end_date
+        self.assertEqual(Question.objects.refresh_status(pub_date - CLOSING_DELAY), 0)
+        self.assertEqual(Question.objects.refresh_status(pub_date), 1)
+        self.assertEqual(self.status(), Question.Status.OPEN)
+        self.assertEqual(Question.objects.refresh_status(end_date), 0)
+        self.assertEqual(Question.objects.refresh_status(end_date + CLOSING_DELAY), 1)
+        self.assertEqual(self.status(), Question.Status.CLOSED)
+
+    def test_next_status_change(self):
+        """The next status change is the next pub_date, then just after the next end_date."""
+        self.assertEqual(Question.objects.next_status_change(self.now), self.question.pub_date)
+        Question.objects.refresh_status(self.question.pub_date)
+        self.assertEqual(Question.objects.next_status_change(self.question.pub_date),
+                         self.question.end_date + CLOSING_DELAY)
+
+    def test_refresh_if_due_skips_queries(self):
+        """Until the next status change, checking the statuses runs no queries."""
+        polls_cache.refresh_statuses(self.now)
+        with self.assertNumQueries(0):
+            polls_cache.refresh_statuses_if_due(self.now + datetime.timedelta(seconds=29))
+        with self.assertNumQueries(2):
+            polls_cache.refresh_statuses_if_due(self.question.pub_date)
+        self.assertEqual(self.status(), Question.Status.OPEN)
+
+    def test_scheduler_flips_status_at_boundaries(self):
+        """The scheduler stores the new status exactly when a boundary passes."""
+        scheduler = StatusScheduler()
+        self.assertEqual(scheduler.run_pending(self.now), 0)
+        self.assertEqual(scheduler.seconds_until_next(self.now), 30)
+        self.assertEqual(scheduler.run_pending(self.question.pub_date), 1)
+        self.assertEqual(self.status(), Question.Status.OPEN)
+        self.assertEqual(scheduler.run_pending(self.question.end_date), 0)
+        self.assertEqual(scheduler.run_pending(self.question.end_date + CLOSING_DELAY), 1)
+        self.assertEqual(self.status(), Question.Status.CLOSED)
+
+    def test_scheduled_question_is_hidden_until_it_opens(self):
+        """Pages use the stored status: a question shows once the scheduler opens it."""
+        detail_url = reverse('polls:detail', args=(self.question.id,))
+        self.assertContains(self.client.get(reverse('polls:index')), "No polls are available.")
+        self.assertEqual(self.client.get(detail_url).status_code, 302)
+        StatusScheduler().run_pending(self.question.pub_date)
+        self.assertContains(self.client.get(reverse('polls:index')), "(Open)")
+        self.assertContains(self.client.get(detail_url), "Soon.")
+
+    def test_command_once(self):
+        """run_status_scheduler --once stores the statuses that are due now."""
+        Question.objects.filter(pk=self.question.pk).update(
+            pub_date=self.now - datetime.timedelta(days=1))
+        out = StringIO()
+        call_command('run_status_scheduler', '--once', stdout=out)
+        self.assertIn("Updated the status of 1 questions.", out.getvalue())
+        self.assertEqual(self.status(), Question.Status.OPEN)
+
+
+class IndexPaginationTests(TestCase):
+    """Tests for the keyset pagination and search of the question list."""
+
+    def setUp(self):
+        """Create seven published questions, two of them published at the same time."""
+        cache.clear()
+        now = timezone.now()
+        self.questions = [
+            Question.objects.create(question_text=f"Question {n} about {topic}",
+                                    pub_date=now - datetime.timedelta(hours=n))
+            for n, topic in enumerate(['cats', 'dogs', 'Cats', 'fish', 'birds', 'cats'])
+        ]
+        self.questions.append(Question.objects.create(question_text="Question 6 tie",
+                                                      pub_date=self.questions[5].pub_date))
+        # Newest first, and the later id first among equal pub_dates.
+        self.newest_first = self.questions[:5] + [self.questions[6], self.questions[5]]
+
+    @override_settings(POLLS_INDEX_PAGE_SIZE=3)
+    def test_pages_follow_cursors(self):
+        """Following the next cursors lists every question once, newest first, and back."""
+        pages, after = [], None
+        while True:
+            page = polls_cache.get_index_page(after=after)
+            pages.append(page)
+            after = page.next_cursor
+            if after is None:
+                break
+        self.assertEqual([q for page in pages for q in page.questions], self.newest_first)
+        self.assertIsNone(pages[0].previous_cursor)
+        previous = polls_cache.get_index_page(before=pages[2].previous_cursor)
+        self.assertEqual(previous.questions, pages[1].questions)
+        self.assertEqual(polls_cache.get_index_page(before=previous.previous_cursor).questions,
+                         pages[0].questions)
+
+    def test_search(self):
+        """A search lists the questions whose text contains it, ignoring case."""
+        response = self.client.get(reverse('polls:index'), {'q': 'CATS'})
+        self.assertEqual(list(response.context['latest_question_list']),
+                         [self.questions[0], self.questions[2], self.questions[5]])
+        response = self.client.get(reverse('polls:index'), {'q': 'horses'})
+        self.assertContains(response, 'No polls match "horses".')
+
+    def test_invalid_cursor(self):
+        """A malformed cursor is a 404 on the index page and a 400 from the JSON list."""
+        response = self.client.get(reverse('polls:index'), {'after': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get(reverse('polls:questions_json'), {'after': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_questions_json(self):
+        """The JSON list returns a page of questions and the cursor of the next page."""
+        url = reverse('polls:questions_json')
+        data = self.client.get(url, {'limit': 4}).json()
+        self.assertEqual([q['id'] for q in data['questions']],
+                         [q.id for q in self.newest_first[:4]])
+        self.assertEqual(data['questions'][0]['status'], 'open')
+        self.assertIsNone(data['previous'])
+        data = self.client.get(url, {'limit': 4, 'after': data['next']}).json()
+        self.assertEqual([q['id'] for q in data['questions']],
+                         [q.id for q in self.newest_first[4:]])
+        self.assertIsNone(data['next'])
+        self.assertEqual(self.client.get(url, {'limit': 0}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'limit': 'x'}).status_code, 400)
+
+
+class DashboardTests(TestCase):
+    """Tests for the dashboard of many questions' tallies."""
+
+    def setUp(self):
+        """Create a user and open questions with two choices each, and start with an empty cache."""
+        cache.clear()
+        self.user = User.objects.create_user(username='voter', password='pass')
+        self.questions = [self.create_poll(f"Poll {n}.", days=-n - 1) for n in range(3)]
+        create_question(question_text="Future poll.", days=5)
+        polls_cache.refresh_statuses()
+
+    def create_poll(self, question_text, days):
+        """Create a question published `days` from now with two choices."""
+        question = create_question(question_text=question_text, days=days)
+        for n in range(2):
+            Choice.objects.create(question=question, choice_text=f"Choice {n}")
+        return question
+
+    def test_query_count_is_flat(self):
+        """Building a dashboard takes two queries and a cached one takes one, for any size."""
+        with self.assertNumQueries(2):
+            dashboard = get_dashboard()
+        self.assertEqual([q['id'] for q in dashboard.data()['questions']],
+                         [q.id for q in self.questions])
+        with self.assertNumQueries(1):
+            get_dashboard()
+        for n in range(3, 30):
+            self.create_poll(f"Poll {n}.", days=-n - 1)
+        polls_cache.refresh_statuses()
+        with self.assertNumQueries(2):
+            self.assertEqual(len(get_dashboard().data()['questions']), 30)
+        with self.assertNumQueries(1):
+            get_dashboard()
+
+    @override_settings(POLLS_DASHBOARD_SIZE=2)
+    def test_open_questions_are_capped(self):
+        """Without ids, only the newest POLLS_DASHBOARD_SIZE open questions are shown."""
+        self.assertEqual([q['id'] for q in get_dashboard().data()['questions']],
+                         [q.id for q in self.questions[:2]])
+
+    def test_question_ids(self):
+        """Listed questions are shown in the given order, without unpublished ones."""
+        future = Question.objects.get(question_text="Future poll.")
+        ids = [self.questions[2].id, future.id, self.questions[0].id]
+        data = get_dashboard(ids).data()
+        self.assertEqual([q['id'] for q in data['questions']], [ids[0], ids[2]])
+
+    def test_vote_updates_dashboard(self):
+        """A vote changes the dashboard's ETag and tallies."""
+        before = get_dashboard()
+        self.client.force_login(self.user)
+        choice = self.questions[1].choice_set.first()
+        self.client.post(reverse('polls:vote', args=(self.questions[1].id,)), {'choice': choice.id})
+        after = get_dashboard()
+        self.assertNotEqual(before.etag, after.etag)
+        self.assertEqual(after.data()['questions'][1]['total'], 1)
+
+    def test_json_endpoint(self):
+        """The JSON is sent gzipped to clients that accept it, and supports ETags."""
+        url = reverse('polls:dashboard_json')
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(len(json.loads(gzip.decompress(response.content))['questions']), 3)
+        response = self.client.get(url)
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(len(response.json()['questions']), 3)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(self.client.get(url, {'ids': '1,x'}).status_code, 400)
+
+    def test_dashboard_page(self):
+        """The dashboard page shows every open question with its tallies."""
+        response = self.client.get(reverse('polls:dashboard'))
+        for question in self.questions:
+            self.assertContains(response, question.question_text)
+        self.assertNotContains(response, "Future poll.")
+
+    def test_dashboard_page_without_questions(self):
+        """A dashboard of only unpublished questions says there is nothing to show."""
+        future = Question.objects.get(question_text="Future poll.")
+        response = self.client.get(reverse('polls:dashboard'), {'ids': future.id})
+        self.assertContains(response, "No polls to show.")
+
+
+class ResultsCacheTests(TestCase):
+    """Tests for the per-question cache of vote tallies."""
+
+    def setUp(self):
+        """Create a user, a question and two choices, and start with an empty cache."""
+        cache.clear()
+        polls_cache.stats.reset()
+        self.user = User.objects.create_user(username='test_user', password='password', is_staff=True)
+        self.question = create_question(question_text="Cached question.", days=-1)
+        self.choice1 = Choice.objects.create(choice_text='Choice 1', question=self.question)
+        self.choice2 = Choice.objects.create(choice_text='Choice 2', question=self.question)
+        self.results_url = reverse('polls:results', args=(self.question.id,))
+        self.client.login(username='test_user', password='password')
+
+    def vote(self, choice):
+        """Vote for `choice` as the test user."""
+        self.client.post(reverse('polls:vote', args=(self.question.id,)), {'choice': choice.id})
+
+    def test_cached_results_skip_vote_tables(self):
+        """A second results request reads the tallies from the cache."""
+        self.client.get(self.results_url)
+        with self.assertNumQueries(3):  # session, user and question
+            self.client.get(self.results_url)
+
+    def test_vote_invalidates_results(self):
+        """A vote starts a new results version, so the next request shows it."""
+        self.client.get(self.results_url)
+        self.vote(self.choice2)
+        results = polls_cache.get_results(self.question.id)
+        self.assertEqual([c['votes'] for c in results['choices']], [0, 1])
+        self.assertEqual(results['total'], 1)
+        response = self.client.get(self.results_url)
+        self.assertContains(response, '<td class="vote_count">1</td>', html=True)
+
+    def test_changing_a_choice_invalidates_results(self):
+        """Renaming a choice shows up on the next results request."""
+        self.client.get(self.results_url)
+        self.choice1.choice_text = 'Renamed choice'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.choice1.save()
+        self.assertContains(self.client.get(self.results_url), 'Renamed choice')
+
+    def test_results_version_changes_on_commit(self):
+        """A changed choice starts a new results version only once it is committed."""
+        version = polls_cache.get_results_version(self.question.id)
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.choice1.save()
+            self.assertEqual(polls_cache.get_results_version(self.question.id), version)
+        for callback in callbacks:
+            callback()
+        self.assertNotEqual(polls_cache.get_results_version(self.question.id), version)
+
+    @override_settings(POLLS_RESULTS_STALENESS=60)
+    def test_staleness_window_serves_recent_results(self):
+        """Within the staleness window, results computed before a vote are still shown."""
+        self.assertEqual(polls_cache.get_results(self.question.id)['total'], 0)
+        self.vote(self.choice1)
+        self.assertEqual(polls_cache.get_results(self.question.id)['total'], 0)
+
+    def test_hit_and_miss_counters(self):
+        """The cache statistics count results hits and misses."""
+        polls_cache.get_results(self.question.id)
+        polls_cache.get_results(self.question.id)
+        self.assertEqual(polls_cache.stats.snapshot()['results'],
+                         {'hits': 1, 'misses': 1, 'hit_ratio': 0.5})
+
+    def test_cache_stats_view(self):
+        """Staff users can read the cache statistics as JSON."""
+        polls_cache.get_results(self.question.id)
+        response = self.client.get(reverse('polls:cache_stats'))
+        self.assertEqual(response.json()['results']['misses'], 1)
+
+    def test_cache_stats_view_requires_staff(self):
+        """Non-staff users are redirected to the admin login page."""
+        self.user.is_staff = False
+        self.user.save()
+        response = self.client.get(reverse('polls:cache_stats'))
+        self.assertEqual(response.status_code, 302)
+
+
+class ResultsJsonTests(TestCase):
+    """Tests for the JSON results endpoints and their conditional GET support."""
+
+    def setUp(self):
+        """Create a user, two questions with choices, and start with an empty cache."""
+        cache.clear()
+        self.user = User.objects.create_user(username='test_user', password='password')
+        self.question = create_question(question_text="First question.", days=-1)
+        self.choice1 = Choice.objects.create(choice_text='Choice 1', question=self.question)
+        self.choice2 = Choice.objects.create(choice_text='Choice 2', question=self.question)
+        self.other = create_question(question_text="Second question.", days=-1)
+        Choice.objects.create(choice_text='Other choice', question=self.other)
+        self.url = reverse('polls:results_json', args=(self.question.id,))
+
+    def test_results_json(self):
+        """The endpoint returns per-choice counts and the total."""
+        Vote.objects.record(self.user, self.choice2)
+        bump_results_version(self.question.id)
+        response = self.client.get(self.url)
+        self.assertEqual(response.json(), {
+            'id': self.question.id,
+            'question_text': "First question.",
+            'choices': [
+                {'id': self.choice1.id, 'choice_text': 'Choice 1', 'votes': 0},
+                {'id': self.choice2.id, 'choice_text': 'Choice 2', 'votes': 1},
+            ],
+            'total': 1,
+        })
+        self.assertTrue(response.has_header('ETag'))
+
+    def test_unpublished_question(self):
+        """Unpublished and unknown questions are not found, and nothing is cached for them."""
+        future = create_question(question_text="Future question.", days=5)
+        cache.clear()
+        for pk in (future.id, future.id + 100):
+            response = self.client.get(reverse('polls:results_json', args=(pk,)))
+            self.assertEqual(response.status_code, 404)
+            self.assertIsNone(cache.get(polls_cache.RESULTS_VERSION_KEY.format(question_id=pk)))
+
+    def test_if_none_match_returns_not_modified(self):
+        """A request with the current ETag gets a 304 after only looking up the question."""
+        etag = self.client.get(self.url)['ETag']
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, headers={'if-none-match': etag})
+        self.assertEqual(response.status_code, 304)
+
+    def test_vote_changes_etag(self):
+        """A vote makes the previous ETag stale."""
+        etag = self.client.get(self.url)['ETag']
+        self.client.login(username='test_user', password='password')
+        self.client.post(reverse('polls:vote', args=(self.question.id,)), {'choice': self.choice1.id})
+        response = self.client.get(self.url, headers={'if-none-match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()['total'], 1)
+
+    def test_bulk_results_json(self):
+        """The bulk endpoint returns several questions in the requested order."""
+        future = create_question(question_text="Future question.", days=5)
+        cache.clear()
+        url = reverse('polls:bulk_results_json')
+        response = self.client.get(url, {'ids': f'{self.other.id},{future.id},{self.question.id}'})
+        self.assertEqual([q['id'] for q in response.json()['questions']],
+                         [self.other.id, self.question.id])
+        with self.assertNumQueries(1):
+            response = self.client.get(url, {'ids': f'{self.other.id},{future.id},{self.question.id}'},
+                                       headers={'if-none-match': response['ETag']})
+        self.assertEqual(response.status_code, 304)
+        self.assertIsNone(cache.get(polls_cache.RESULTS_VERSION_KEY.format(question_id=future.id)))
+
+    def test_bulk_results_json_rejects_bad_ids(self):
+        """Missing or malformed ids give a 400 response."""
+        url = reverse('polls:bulk_results_json')
+        self.assertEqual(self.client.get(url).status_code, 400)
+        self.assertEqual(self.client.get(url, {'ids': '1,x'}).status_code, 400)
+
+
+class ResultsStreamTests(TestCase):
+    """Tests for the Server-Sent Events results stream and its broadcaster."""
+
+    def setUp(self):
+        """Create a question with two choices and start with an empty cache."""
+        cache.clear()
+        self.question = create_question(question_text="Live question.", days=-1)
+        self.choice1 = Choice.objects.create(choice_text='Choice 1', question=self.question)
+        self.choice2 = Choice.objects.create(choice_text='Choice 2', question=self.question)
+        self.factory = AsyncRequestFactory()
+
+    async def open_stream(self):
+        """Open a results stream of the question and return the response."""
+        request = self.factory.get(reverse('polls:results_stream', args=(self.question.id,)))
+        response = await views.results_stream(request, self.question.id)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        response.events = aiter(response)
+        return response
+
+    async def next_event(self, response):
+        """Return the type and data of the next event of a stream."""
+        message = (await asyncio.wait_for(anext(response.events), 5)).decode()
+        event, data = message.strip().split('\n')
+        return event.removeprefix('event: '), json.loads(data.removeprefix('data: '))
+
+    async def test_many_streams_receive_delta(self):
+        """Hundreds of open streams each get the full results, then the same delta."""
+        streams = [await self.open_stream() for _ in range(200)]
+        self.assertEqual(broadcaster.subscriber_count(self.question.id), 200)
+        for stream in streams:
+            event, data = await self.next_event(stream)
+            self.assertEqual((event, data['total']), ('results', 0))
+
+        version = await sync_to_async(bump_results_version)(self.question.id)
+        broadcaster.publish(self.question.id, version, {self.choice1.id: 1})
+        for stream in streams:
+            event, data = await self.next_event(stream)
+            self.assertEqual(event, 'delta')
+            self.assertEqual(data['choices'], {str(self.choice1.id): 1})
+            self.assertEqual(data['total'], 1)
+
+        for stream in streams:
+            stream.close()
+        self.assertEqual(broadcaster.subscriber_count(self.question.id), 0)
+
+    async def test_slow_client_gets_coalesced_delta(self):
+        """Changes published while a client is not reading arrive as one merged delta."""
+        stream = await self.open_stream()
+        await self.next_event(stream)
+        for _ in range(100):
+            version = await sync_to_async(bump_results_version)(self.question.id)
+            broadcaster.publish(self.question.id, version,
+                                {self.choice1.id: 1, self.choice2.id: -1})
+            broadcaster.publish(self.question.id, version, {self.choice2.id: 2})
+        event, data = await self.next_event(stream)
+        self.assertEqual(event, 'delta')
+        self.assertEqual(data['choices'], {str(self.choice1.id): 100, str(self.choice2.id): 100})
+        self.assertEqual(data['version'], version)
+        stream.close()
+
+    async def test_changes_before_snapshot_are_skipped(self):
+        """Changes already included in the results sent on connect are not sent again."""
+        stream = await self.open_stream()
+        version = await sync_to_async(bump_results_version)(self.question.id)
+        broadcaster.publish(self.question.id, version, {self.choice1.id: 1})
+        event, data = await self.next_event(stream)
+        self.assertEqual(event, 'results')
+        broadcaster.publish(self.question.id, version + 1, {self.choice2.id: 1})
+        event, data = await self.next_event(stream)
+        self.assertEqual((event, data['choices']), ('delta', {str(self.choice2.id): 1}))
+        stream.close()
+
+    async def test_out_of_order_changes_resync(self):
+        """Changes after a gap in the versions, or at or below the last sent, resend the results."""
+        stream = await self.open_stream()
+        await self.next_event(stream)
+        first = await sync_to_async(bump_results_version)(self.question.id)
+        second = await sync_to_async(bump_results_version)(self.question.id)
+        broadcaster.publish(self.question.id, second, {self.choice2.id: 1})
+        event, _ = await self.next_event(stream)
+        self.assertEqual(event, 'results')
+        broadcaster.publish(self.question.id, first, {self.choice1.id: 1})
+        event, _ = await self.next_event(stream)
+        self.assertEqual(event, 'results')
+        third = await sync_to_async(bump_results_version)(self.question.id)
+        broadcaster.publish(self.question.id, third, {self.choice1.id: 1})
+        event, data = await self.next_event(stream)
+        self.assertEqual((event, data['version']), ('delta', third))
+        stream.close()
+
+    async def test_subscription_reports_gap_as_resync(self):
+        """Merged changes with a version missing in between ask for a resync."""
+        subscription = broadcaster.subscribe(self.question.id)
+        await subscription.wait(1)
+        subscription.push(5, {self.choice1.id: 1})
+        subscription.push(7, {self.choice1.id: 1})
+        self.assertEqual(await subscription.wait(1), (True, {self.choice1.id: 2}, 5, 7))
+        subscription.push(8, {self.choice1.id: 1})
+        subscription.push(9, {self.choice2.id: 1})
+        self.assertEqual(await subscription.wait(1),
+                         (False, {self.choice1.id: 1, self.choice2.id: 1}, 8, 9))
+        broadcaster.unsubscribe(self.question.id, subscription)
+
+    @override_settings(POLLS_STREAM_HEARTBEAT=0.01)
+    async def test_idle_stream_sends_keep_alive(self):
+        """An idle stream sends keep-alive comments."""
+        stream = await self.open_stream()
+        await self.next_event(stream)
+        self.assertEqual(await anext(stream.events), b": keep-alive\n\n")
+        stream.close()
+
+    @override_settings(POLLS_STREAM_HEARTBEAT=0.01)
+    async def test_idle_stream_resyncs_changed_version(self):
+        """A version bumped without a publish, as by another process, resends the results."""
+        stream = await self.open_stream()
+        await self.next_event(stream)
+        await sync_to_async(bump_results_version)(self.question.id)
+        event, data = await self.next_event(stream)
+        self.assertEqual(event, 'results')
+        self.assertEqual(await anext(stream.events), b": keep-alive\n\n")
+        stream.close()
+
+    async def test_unpublished_question(self):
+        """Streams of unpublished questions are not found."""
+        future = await sync_to_async(create_question)(question_text="Future.", days=5)
+        request = self.factory.get('/')
+        with self.assertRaises(Http404):
+            await views.results_stream(request, future.id)
+
+    def test_wsgi_falls_back_to_polling(self):
+        """Under WSGI the stream sends the results once and asks the client to retry."""
+        response = self.client.get(reverse('polls:results_stream', args=(self.question.id,)))
+        content = response.content.decode()
+        self.assertTrue(content.startswith('retry: '))
+        self.assertIn('event: results', content)
+
+
+def reload_urlconf():
+    """Re-import the URLconfs so they pick up the current POLLS_ASYNC_VIEWS setting."""
+    importlib.reload(polls_urls)
+    importlib.reload(mysite_urls)
+    clear_url_caches()
+
+
+class AsyncViewTests(TestCase):
+    """Tests for the asynchronous index, detail, results and vote views."""
+
+    @classmethod
+    def setUpClass(cls):
+        """Route the page URLs to the asynchronous views for the tests of this class."""
+        super().setUpClass()
+        # Cleanups run last-in first-out, so this one runs after the override ends.
+        cls.addClassCleanup(reload_urlconf)
+        cls.enterClassContext(override_settings(POLLS_ASYNC_VIEWS=True))
+        reload_urlconf()
+
+    def setUp(self):
+        """Create a user, a question with two choices, and start with an empty cache."""
+        cache.clear()
+        self.user = User.objects.create_user(username='test_user', password='password')
+        self.question = create_question(question_text="Async question.", days=-1)
+        self.choice1 = Choice.objects.create(choice_text='Choice 1', question=self.question)
+        self.choice2 = Choice.objects.create(choice_text='Choice 2', question=self.question)
+
+    def test_urls_use_async_views(self):
+        """The page URL names resolve to the asynchronous views."""
+        match = resolve(reverse('polls:index'))
+        self.assertIs(match.func.view_class, async_views.IndexView)
+
+    async def test_index(self):
+        """The index lists published questions with their status."""
+        await sync_to_async(create_question)(question_text="Future question.", days=5)
+        response = await self.async_client.get(reverse('polls:index'))
+        self.assertEqual([q.question_text for q in response.context['latest_question_list']],
+                         ["Async question."])
+        self.assertContains(response, "(Open)")
+
+    async def test_detail_shows_last_vote(self):
+        """The detail page of a logged-in voter checks their last choice."""
+        await sync_to_async(Vote.objects.record)(self.user, self.choice2)
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(reverse('polls:detail', args=(self.question.id,)))
+        self.assertEqual(response.context['last_vote'], self.choice2.id)
+        self.assertContains(response, "Log Out")
+
+    async def test_detail_of_future_question_redirects(self):
+        """The detail page of an unpublished question redirects to the index."""
+        future = await sync_to_async(create_question)(question_text="Future question.", days=5)
+        response = await self.async_client.get(reverse('polls:detail', args=(future.id,)))
+        self.assertRedirects(response, reverse('polls:index'), fetch_redirect_response=False)
+
+    async def test_vote_and_results(self):
+        """Votes are recorded, can be changed, and show up on the results page."""
+        await self.async_client.aforce_login(self.user)
+        vote_url = reverse('polls:vote', args=(self.question.id,))
+        response = await self.async_client.post(vote_url, {'choice': self.choice1.id})
+        self.assertRedirects(response, reverse('polls:results', args=(self.question.id,)),
+                             fetch_redirect_response=False)
+        await self.async_client.post(vote_url, {'choice': self.choice2.id})
+        self.assertEqual(await Vote.objects.filter(user=self.user).acount(), 1)
+        response = await self.async_client.get(reverse('polls:results', args=(self.question.id,)))
+        self.assertEqual([c['votes'] for c in response.context['results']['choices']], [0, 1])
+
+    async def test_vote_without_choice(self):
+        """Voting without a choice shows the detail page with an error."""
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.post(reverse('polls:vote', args=(self.question.id,)))
+        self.assertContains(response, "Choice 2")
+        self.assertEqual(response.context['error_message'], "You didn't select a choice.")
+
+    async def test_anonymous_user_cannot_vote(self):
+        """Anonymous users are redirected to the login page."""
+        vote_url = reverse('polls:vote', args=(self.question.id,))
+        response = await self.async_client.post(vote_url, {'choice': self.choice1.id})
+        self.assertRedirects(response, f"{reverse('login')}?next={vote_url}",
+                             fetch_redirect_response=False)
+
+
+@override_settings(POLLS_READ_REPLICAS=['replica_1'], POLLS_READ_YOUR_WRITES_SECONDS=5)
+class ReplicaRoutingTests(TestCase):
+    """Tests for routing poll reads to read replicas."""
+
+    def setUp(self):
+        """Create a router and a middleware that records where its request reads from."""
+        self.router = ReplicaRouter()
+        self.factory = RequestFactory()
+        self.seen = []
+
+        def view(request):
+            self.seen.append(current_replica.get())
+            return HttpResponse()
+
+        self.middleware = ReadReplicaMiddleware(view)
+
+    def test_router(self):
+        """Polls reads go to the current replica; writes and other apps go to the primary."""
+        self.assertEqual(self.router.db_for_read(Question), 'default')
+        token = current_replica.set('replica_1')
+        try:
+            self.assertEqual(self.router.db_for_read(Question), 'replica_1')
+            self.assertEqual(self.router.db_for_read(User), 'default')
+            self.assertEqual(self.router.db_for_write(Question), 'default')
+            with primary_reads():
+                self.assertEqual(self.router.db_for_read(Question), 'default')
+            self.assertEqual(self.router.db_for_read(Question), 'replica_1')
+        finally:
+            current_replica.reset(token)
+        self.assertFalse(self.router.allow_migrate('replica_1', 'polls'))
+        self.assertTrue(self.router.allow_migrate('default', 'polls'))
+
+    def test_get_reads_from_replica(self):
+        """A GET request reads from a replica, and the choice ends with the request."""
+        response = self.middleware(self.factory.get('/polls/'))
+        self.assertEqual(self.seen, ['replica_1'])
+        self.assertIsNone(current_replica.get())
+        self.assertNotIn(PRIMARY_COOKIE, response.cookies)
+
+    def test_post_pins_browser_to_primary(self):
+        """A POST reads from the primary and keeps the browser there for a while."""
+        response = self.middleware(self.factory.post('/polls/1/vote/'))
+        self.assertEqual(self.seen, [None])
+        cookie = response.cookies[PRIMARY_COOKIE]
+        self.assertEqual(cookie['max-age'], 5)
+        request = self.factory.get('/polls/1/')
+        request.COOKIES[PRIMARY_COOKIE] = cookie.value
+        self.middleware(request)
+        request.COOKIES[PRIMARY_COOKIE] = str(time.time() - 1)
+        self.middleware(request)
+        self.assertEqual(self.seen, [None, None, 'replica_1'])
+
+    @override_settings(POLLS_READ_REPLICAS=[])
+    def test_without_replicas(self):
+        """Without replicas every request reads from the primary and nothing is pinned."""
+        response = self.middleware(self.factory.post('/polls/1/vote/'))
+        self.middleware(self.factory.get('/polls/'))
+        self.assertEqual(self.seen, [None, None])
+        self.assertNotIn(PRIMARY_COOKIE, response.cookies)
+
+
+class StaticDeliveryTests(TestCase):
+    """Tests for serving hashed, precompressed static files and compressed pages."""
+
+    def test_collected_files_are_served_compressed_and_cached(self):
+        """Hashed static files are sent gzipped when accepted and cached for a year."""
+        with TemporaryDirectory() as root, override_settings(STATIC_ROOT=root):
+            call_command('collectstatic', '--noinput', verbosity=0)
+            url = staticfiles_storage.url('polls/style.css')
+            self.assertRegex(url, r'^/static/polls/style\.[0-9a-f]{12}\.css$')
+            self.assertContains(self.client.get(reverse('polls:index')), url)
+            css = Path(root, url.removeprefix('/static/')).read_bytes()
+
+            response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip, deflate')
+            self.assertEqual(response['Content-Encoding'], 'gzip')
+            self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+            self.assertEqual(response['Vary'], 'Accept-Encoding')
+            self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), css)
+
+            response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip',
+                                       HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(response.status_code, 304)
+
+            response = self.client.get(url)
+            self.assertFalse(response.has_header('Content-Encoding'))
+            self.assertEqual(b''.join(response.streaming_content), css)
+
+            response = self.client.get('/static/polls/style.css')
+            self.assertEqual(response['Cache-Control'], 'public, max-age=60')
+            b''.join(response.streaming_content)
+
+    def test_pages_are_compressed_and_conditional(self):
+        """Pages are gzipped for clients that accept it and answer 304 to a matching ETag."""
+        Question.objects.create(question_text='Test Question')
+        response = self.client.get(reverse('polls:index'), HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        response = self.client.get(reverse('polls:index'), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+
+class HealthCheckTests(TestCase):
+    """Tests for the health check endpoint."""
+
+    def test_healthy(self):
+        """With the database and cache reachable, the health check returns 200."""
+        response = self.client.get(reverse('health'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'status': 'ok', 'database': 'ok', 'cache': 'ok'})
+        self.assertIn('no-cache', response['Cache-Control'])
+
+    def test_database_unavailable(self):
+        """A failing database query makes the health check return 503."""
+        with mock.patch('polls.views.connection') as broken_connection:
+            broken_connection.cursor.side_effect = OperationalError('connection refused')
+            with self.assertLogs('polls', level='ERROR'):
+                response = self.client.get(reverse('health'))
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json()['database'], 'unavailable')
+
+    def test_cache_unavailable(self):
+        """A cache that does not store values makes the health check return 503."""
+        with mock.patch('polls.views.cache') as broken_cache:
+            broken_cache.get.return_value = None
+            with self.assertLogs('polls', level='ERROR'):
+                response = self.client.get(reverse('health'))
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json(), {'status': 'unavailable', 'database': 'ok',
+                                           'cache': 'unavailable'})
+
+
+def fixture_record(model, pk, **fields):
+    """Return a fixture-style record for the import_polls command."""
+    return {'model': model, 'pk': pk, 'fields': fields}
+
+
+class ImportPollsTests(TestCase):
+    """Tests for the import_polls management command."""
+
+    def setUp(self):
+        """Create a temporary directory for the files to import."""
+        directory = TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+
+    def write_lines(self, name, records):
+        """Write `records` as a JSON Lines file and return its path."""
+        path = self.directory / name
+        path.write_text(''.join(json.dumps(record) + '\n' for record in records))
+        return str(path)
+
+    def test_iter_json_array_reads_in_pieces(self):
+        """Arrays are parsed correctly even when elements span several reads."""
+        with mock.patch('polls.importer.READ_SIZE', 3), open('data/polls-v4.json') as file:
+            records = list(iter_json_array(file))
+        with open('data/polls-v4.json') as file:
+            self.assertEqual(records, json.load(file))
+
+    def test_import_data_fixtures(self):
+        """The fixtures in data/ import like loaddata, with the vote counters rebuilt."""
+        call_command('import_polls', 'data/polls-v4.json', 'data/users.json',
+                     'data/votes-v4.json', batch_size=5, stdout=StringIO())
+        self.assertEqual(Question.objects.count(), 4)
+        self.assertEqual(User.objects.count(), 6)
+        self.assertEqual(Vote.objects.count(), 8)
+        self.assertEqual(find_vote_count_mismatches(), ([], []))
+        self.assertEqual(Question.objects.get(pk=4).vote_count, 3)
+        # The primary key sequences continue after the imported rows.
+        self.assertGreater(Question.objects.create(question_text="New question.").pk, 5)
+
+    def test_vote_question_filled_in_from_choice(self):
+        """Votes without a question get the question of their choice."""
+        path = self.write_lines('votes.jsonl', [
+            fixture_record('auth.user', 50, username='importer', password='!'),
+            fixture_record('polls.question', 60, question_text="Imported?",
+                           pub_date='2024-08-23T14:57:40Z'),
+            fixture_record('polls.choice', 70, question=60, choice_text="Yes"),
+            fixture_record('polls.vote', 80, user=50, choice=70),
+        ])
+        call_command('import_polls', path, stdout=StringIO())
+        vote = Vote.objects.get(pk=80)
+        self.assertEqual(vote.question_id, 60)
+        self.assertEqual(Choice.objects.get(pk=70).votes, 1)
+
+    def test_importing_twice_skips_existing_rows(self):
+        """Records whose rows already exist are skipped."""
+        call_command('import_polls', 'data/polls-v4.json', stdout=StringIO())
+        call_command('import_polls', 'data/polls-v4.json', stdout=StringIO())
+        self.assertEqual(Question.objects.count(), 4)
+
+    def test_invalid_reference_and_resume(self):
+        """A bad reference stops the import, which resumes after the file is fixed."""
+        records = [
+            fixture_record('auth.user', 1, username='voter', password='!'),
+            fixture_record('polls.question', 2, question_text="Resumable?",
+                           pub_date='2024-08-23T14:57:40Z'),
+            fixture_record('polls.choice', 3, question=2, choice_text="Yes"),
+            fixture_record('polls.vote', 4, user=1, choice=99),
+        ]
+        path = self.write_lines('polls.jsonl', records)
+        checkpoint = self.directory / 'checkpoint.json'
+        with self.assertRaisesMessage(CommandError, 'record 4: Vote 4 refers to unknown choice 99'):
+            call_command('import_polls', path, checkpoint=checkpoint, stdout=StringIO())
+        self.assertTrue(Choice.objects.filter(pk=3).exists())
+        self.assertEqual(json.loads(checkpoint.read_text()), {str(Path(path).resolve()): 3})
+
+        records[3]['fields']['choice'] = 3
+        self.write_lines('polls.jsonl', records)
+        out = StringIO()
+        call_command('import_polls', path, checkpoint=checkpoint, stdout=out)
+        self.assertIn("Read 1 records", out.getvalue())
+        self.assertEqual(Choice.objects.get(pk=3).votes, 1)
+        self.assertFalse(checkpoint.exists())
+
+    def test_unknown_field(self):
+        """Records with fields the model does not have are rejected."""
+        path = self.write_lines('bad.jsonl', [fixture_record('polls.question', 1, title="?")])
+        with self.assertRaisesMessage(CommandError, "polls.question has no field 'title'"):
+            call_command('import_polls', path, stdout=StringIO())
+
+
+class ExportTests(TestCase):
+    """Tests for the export_polls command and the question admin export actions."""
+
+    def setUp(self):
+        """Create an open and a closed question with a vote each."""
+        self.user = User.objects.create_user(username='exporter', password='password')
+        self.open_question = create_question(question_text="Open question.", days=-1)
+        self.closed_question = create_question(question_text="Closed question.", days=-10)
+        self.closed_question.end_date = timezone.now() - datetime.timedelta(days=5)
+        self.closed_question.save()
+        self.open_choice = Choice.objects.create(question=self.open_question,
+                                                 choice_text='Yes, "really"')
+        self.closed_choice = Choice.objects.create(question=self.closed_question,
+                                                   choice_text='No')
+        Vote.objects.record(self.user, self.open_choice)
+        Vote.objects.record(self.user, self.closed_choice)
+
+    def export(self, *args, **options):
+        """Run export_polls and return its output."""
+        out = StringIO()
+        call_command('export_polls', *args, stdout=out, **options)
+        return out.getvalue()
+
+    def test_votes_csv(self):
+        """The vote log is exported as CSV with a header line."""
+        lines = self.export('votes').splitlines()
+        self.assertEqual(lines[0], 'vote_id,user_id,username,question_id,choice_id,choice_text')
+        self.assertEqual(len(lines), 3)
+        self.assertIn('"Yes, ""really"""', lines[1])
+
+    def test_results_jsonl_filtered_by_status(self):
+        """Results of closed questions are exported as JSON Lines."""
+        rows = [json.loads(line) for line in
+                self.export('results', format='jsonl', status='closed').splitlines()]
+        self.assertEqual(rows, [{
+            'question_id': self.closed_question.id, 'question_text': "Closed question.",
+            'pub_date': rows[0]['pub_date'], 'end_date': rows[0]['end_date'],
+            'choice_id': self.closed_choice.id, 'choice_text': 'No', 'votes': 1,
+        }])
+
+    def test_filter_by_question_and_date(self):
+        """Exports can be limited to questions and to a publication date range."""
+        rows = self.export('votes', format='jsonl', question_ids=[self.open_question.id])
+        self.assertEqual([json.loads(line)['question_id'] for line in rows.splitlines()],
+                         [self.open_question.id])
+        since = (timezone.localdate() - datetime.timedelta(days=2)).isoformat()
+        rows = self.export('votes', format='jsonl', since=since)
+        self.assertEqual([json.loads(line)['question_id'] for line in rows.splitlines()],
+                         [self.open_question.id])
+        with self.assertRaises(CommandError):
+            self.export('votes', since='yesterday')
+
+    def test_admin_export_action(self):
+        """The question admin streams the export of the selected questions."""
+        User.objects.create_superuser(username='admin', password='password')
+        self.client.login(username='admin', password='password')
+        response = self.client.post(reverse('admin:polls_question_changelist'), {
+            'action': 'export_results_csv',
+            '_selected_action': [self.open_question.id],
+        })
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertIn('attachment;', response['Content-Disposition'])
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[1].startswith(f'{self.open_question.id},Open question.,'))
+
+    async def test_admin_export_action_under_asgi(self):
+        """Under ASGI the admin export is streamed from an asynchronous iterator."""
+        request = AsyncRequestFactory().post('/')
+        action = make_export_action('votes', 'jsonl')
+        response = action(QuestionAdmin(Question, admin.site), request,
+                          Question.objects.order_by('pk'))
+        self.assertTrue(response.is_async)
+        content = b''.join([chunk async for chunk in response])
+        self.assertEqual([json.loads(line)['question_id'] for line in content.splitlines()],
+                         [self.open_question.id, self.closed_question.id])
+
+    def test_admin_status_filter(self):
+        """The question admin can list only the closed questions."""
+        User.objects.create_superuser(username='admin', password='password')
+        self.client.login(username='admin', password='password')
+        response = self.client.get(reverse('admin:polls_question_changelist'), {'status': 'closed'})
+        self.assertEqual(list(response.context['cl'].queryset), [self.closed_question])
+
+
+class RequestMetricsTests(TestCase):
+    """Tests for the request metrics middleware and the metrics endpoint."""
+
+    def setUp(self):
+        """Start with empty metrics and caches, and a published question."""
+        metrics_registry.reset()
+        polls_cache.stats.reset()
+        cache.clear()
+        self.question = create_question(question_text="Measured question.", days=-1)
+
+    def test_histogram_buckets_are_cumulative(self):
+        """Histogram snapshots count each observation in its bucket and all larger ones."""
+        histogram = Histogram([1, 5])
+        for value in (0, 1, 3, 10):
+            histogram.observe(value)
+        self.assertEqual(histogram.snapshot(), ([2, 3, 4], 4, 14.0))
+
+    def test_request_is_logged_with_fields(self):
+        """Each request's queries and cache lookups are logged at DEBUG level."""
+        self.client.get(reverse('polls:index'))
+        with self.assertLogs('polls.metrics', level='DEBUG') as logs:
+            self.client.get(reverse('polls:index'))
+        record = logs.records[0]
+        self.assertEqual(record.view, 'polls:index')
+        self.assertEqual(record.status, 200)
+        self.assertEqual(record.cache_hits, 1)
+        self.assertEqual(record.db_queries, 0)
+        self.assertIn('view=polls:index', record.getMessage())
+
+    async def test_queries_of_async_views_are_counted(self):
+        """Queries that async views run in sync_to_async threads count towards the request."""
+        async def view(request):
+            await Question.objects.acount()
+            return HttpResponse()
+
+        middleware = RequestMetricsMiddleware(view)
+        with self.assertLogs('polls.metrics', level='DEBUG') as logs:
+            await middleware(AsyncRequestFactory().get('/'))
+        self.assertEqual(logs.records[0].db_queries, 1)
+
+    @override_settings(POLLS_SLOW_QUERY_MS=0.000001, POLLS_SLOW_QUERY_SAMPLE_RATE=1.0)
+    def test_slow_queries_are_logged(self):
+        """Queries slower than POLLS_SLOW_QUERY_MS are logged with their view."""
+        with self.assertLogs('polls.metrics', level='WARNING') as logs:
+            self.client.get(reverse('polls:detail', args=(self.question.id,)))
+        self.assertIn('Slow query in polls:detail', logs.output[0])
+
+    def test_metrics_require_staff_or_token(self):
+        """Anonymous requests for the metrics are refused."""
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 403)
+        with override_settings(POLLS_METRICS_TOKEN='secret'):
+            response = self.client.get(reverse('metrics'), headers={'Authorization': 'Bearer wrong'})
+            self.assertEqual(response.status_code, 403)
+            response = self.client.get(reverse('metrics'), headers={'Authorization': 'Bearer secret'})
+            self.assertEqual(response.status_code, 200)
+
+    def test_metrics_endpoint(self):
+        """The metrics are rendered in the Prometheus text format."""
+        self.client.get(reverse('polls:index'))
+        self.client.get(reverse('polls:index'))
+        User.objects.create_user(username='staff', password='password', is_staff=True)
+        self.client.login(username='staff', password='password')
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        body = response.content.decode()
+        self.assertIn('# TYPE polls_request_duration_seconds histogram', body)
+        self.assertIn('polls_request_duration_seconds_bucket{view="polls:index",le="+Inf"} 2', body)
+        self.assertIn('polls_request_db_queries_count{view="polls:index"} 2', body)
+        self.assertIn('polls_requests_total{view="polls:index",method="GET",status="200"} 2', body)
+        self.assertIn('polls_cache_hits_total{cache="index"} 1', body)
+
+
+class StructuredLoggingTests(TestCase):
+    """Tests for the structured vote and login logs and the logging helpers."""
+
+    def setUp(self):
+        """Create a user and a question with a choice."""
+        self.user = User.objects.create_user(username='logger', password='password')
+        self.question = create_question(question_text="Logged question.", days=-1)
+        self.choice = Choice.objects.create(question=self.question, choice_text='Yes')
+
+    def test_vote_record_fields(self):
+        """Vote log records carry the user, question, choice and IP as fields."""
+        self.client.force_login(self.user)
+        with self.assertLogs('polls', level='INFO') as logs:
+            self.client.post(reverse('polls:vote', args=(self.question.id,)),
+                             {'choice': self.choice.id}, REMOTE_ADDR='10.0.0.7')
+        record = [r for r in logs.records if getattr(r, 'event', None) == 'vote'][0]
+        self.assertEqual((record.user_id, record.question_id, record.choice_id, record.ip),
+                         (self.user.id, self.question.id, self.choice.id, '10.0.0.7'))
+        self.assertEqual(record.args[0], 'logger')
+        self.assertEqual(record.getMessage(),
+                         f"logger voted for Choice {self.choice.id} in Question "
+                         f"{self.question.id} from 10.0.0.7")
+
+    def test_failed_login_record(self):
+        """Failed logins are logged with the login_failed event."""
+        with self.assertLogs('polls', level='WARNING') as logs:
+            self.client.post(reverse('login'), {'username': 'logger', 'password': 'wrong'})
+        self.assertEqual(logs.records[0].event, 'login_failed')
+
+    def test_rate_limit_filter(self):
+        """Only the listed events are limited, and suppressed records are counted."""
+        log_filter = RateLimitFilter(events=['login_failed'], rate=0.001, burst=2)
+        limited = [logging.makeLogRecord({'event': 'login_failed'}) for _ in range(5)]
+        self.assertEqual([log_filter.filter(record) for record in limited],
+                         [True, True, False, False, False])
+        self.assertTrue(log_filter.filter(logging.makeLogRecord({'event': 'vote'})))
+        log_filter.rate = 1000
+        record = logging.makeLogRecord({'event': 'login_failed'})
+        with mock.patch('polls.logs.time.monotonic', return_value=time.monotonic() + 1):
+            self.assertTrue(log_filter.filter(record))
+        self.assertEqual(record.suppressed, 3)
+
+    def test_queued_handler_writes_json_lines(self):
+        """The queued handler leaves formatting to its listener, which writes JSON lines."""
+        stream = StringIO()
+        handler = QueuedStreamHandler(stream)
+        handler.setFormatter(JsonFormatter())
+        self.addCleanup(handler.close)
+        record = logging.makeLogRecord({'name': 'polls', 'levelname': 'INFO', 'msg': '%s voted',
+                                        'args': ('logger',), 'user_id': 3})
+        self.assertIs(handler.prepare(record), record)
+        handler.handle(record)
+        handler.flush()
+        line = json.loads(stream.getvalue())
+        self.assertEqual((line['message'], line['user_id'], line['logger']),
+                         ('logger voted', 3, 'polls'))
+
+    def test_queued_handler_drops_records_when_full(self):
+        """Records that do not fit on the queue are dropped instead of blocking."""
+        handler = QueuedStreamHandler(StringIO(), maxsize=1)
+        self.addCleanup(handler.close)
+        handler.listener.stop()
+        for _ in range(3):
+            handler.handle(logging.makeLogRecord({'msg': 'noise'}))
+        self.assertEqual(handler.dropped, 2)
@@ -1,10 +1,21 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import async_views, views
+
+# The index, detail, results and vote pages have asynchronous versions for ASGI servers.
+page_views = async_views if settings.POLLS_ASYNC_VIEWS else views
 
 app_name = 'polls'
 urlpatterns = [
-    path('', views.IndexView.as_view(), name='index'),
-    path('<int:pk>/', views.DetailView.as_view(), name='detail'),
-    path('<int:pk>/results/', views.ResultsView.as_view(), name='results'),
-    path('<int:question_id>/vote/', views.vote, name='vote'),
+    path('', page_views.IndexView.as_view(), name='index'),
+    path('<int:pk>/', page_views.DetailView.as_view(), name='detail'),
+    path('<int:pk>/results/', page_views.ResultsView.as_view(), name='results'),
+    path('<int:pk>/results.json', views.results_json, name='results_json'),
+    path('<int:pk>/results/stream/', views.results_stream, name='results_stream'),
+    path('results.json', views.bulk_results_json, name='bulk_results_json'),
+    path('questions.json', views.questions_json, name='questions_json'),
+    path('dashboard/', views.dashboard, name='dashboard'),
+    path('dashboard.json', views.dashboard_json, name='dashboard_json'),
+    path('<int:question_id>/vote/', page_views.vote, name='vote'),
+    path('cache-stats/', views.cache_stats, name='cache_stats'),
 ]
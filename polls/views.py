@@ -1,35 +1,74 @@
 """Views for handling polling functionality in KU Polls."""
+import hashlib
+import json
+import re
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.contrib import messages
-from django.http import HttpResponseRedirect, Http404
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.cache import cache
+from django.core.handlers.asgi import ASGIRequest
+from django.db import DatabaseError, connection
+from django.http import (HttpResponse, HttpResponseBadRequest, HttpResponseRedirect, Http404,
+                         JsonResponse, StreamingHttpResponse)
 from django.shortcuts import get_object_or_404, render
 from django.urls import reverse
+from django.utils.cache import patch_vary_headers
+from django.utils.crypto import constant_time_compare
+from django.utils.functional import SimpleLazyObject
 from django.views import generic
+from django.views.decorators.cache import never_cache
+from django.views.decorators.http import condition, require_GET
 from django.contrib.auth.decorators import login_required
+from . import cache as polls_cache
+from .cache import (bump_results_version, get_index_page, get_many_results,
+                    get_results, get_results_version, refresh_statuses_if_due,
+                    results_fragment_key, results_fragment_timeout)
+from .dashboard import get_dashboard
+from .ingest import get_vote_buffer
+from .listing import InvalidCursor, get_page, search_questions
+from .live import broadcaster
+from .metrics import registry as metrics_registry
 from .models import Choice, Question, Vote
+from .ratelimit import get_client_ip
 from django.contrib.auth.signals import user_logged_in, user_logged_out, user_login_failed
 from django.dispatch import receiver
 import logging
 
 
+# Longest text searched for in question texts; longer searches are cut to it.
+MAX_SEARCH_LENGTH = 200
+
+
+def index_arguments(request):
+    """Return the page cursors and search text of a question list request as a dict."""
+    return {
+        'after': request.GET.get('after') or None,
+        'before': request.GET.get('before') or None,
+        'query': request.GET.get('q', '').strip()[:MAX_SEARCH_LENGTH],
+    }
+
+
 class IndexView(generic.ListView):
-    """Displays a list of the latest published questions."""
+    """Displays a page of the latest published questions, optionally searched."""
 
     template_name = 'polls/index.html'
     context_object_name = 'latest_question_list'
 
     def get_queryset(self):
-        """Return published questions, excluding future ones."""
-        published_question_list = [q.pk for q in Question.objects.all()
-                                   if q.is_published()]
-        published_questions = (Question.objects.filter
-                               (pk__in=published_question_list))
-        return published_questions.order_by('-pub_date')
+        """Return one page of the published questions, each with its status."""
+        self.arguments = index_arguments(self.request)
+        try:
+            self.page = get_index_page(**self.arguments)
+        except InvalidCursor:
+            raise Http404("Invalid page.")
+        return self.page.questions
 
     def get_context_data(self, **kwargs):
-        """Add question status to the context."""
+        """Add the page, for its links to the pages before and after it, and the search text."""
         context = super().get_context_data(**kwargs)
-        for question in context['latest_question_list']:
-            question.status = 'Open' if question.can_vote() else 'Closed'
+        context['page'] = self.page
+        context['query'] = self.arguments['query']
         return context
 
 
@@ -40,10 +79,8 @@ class DetailView(generic.DetailView):
     template_name = 'polls/detail.html'
 
     def get_queryset(self):
-        """Exclude unpublished questions."""
-        published_question_list = [q.pk for q in Question.objects.all()
-                                   if q.is_published()]
-        return Question.objects.filter(pk__in=published_question_list)
+        """Exclude scheduled questions and prefetch their choices."""
+        return Question.objects.visible().with_choices()
 
     def get(self, request, *args, **kwargs):
         """
@@ -52,13 +89,14 @@ class DetailView(generic.DetailView):
         Redirect to index if voting is not allowed.
         Show last vote if authenticated.
         """
+        refresh_statuses_if_due()
         try:
             question = self.get_object()
         except Http404:
             messages.error(request, "This question is not available.")
             return HttpResponseRedirect(reverse('polls:index'))
 
-        if not question.can_vote():
+        if question.status != Question.Status.OPEN:
             messages.error(request, "Voting is not allowed for this question.")
             return HttpResponseRedirect(reverse('polls:index'))
 
@@ -66,8 +104,8 @@ class DetailView(generic.DetailView):
         last_vote = None
         if this_user.is_authenticated:
             try:
-                last_vote = (Vote.objects.get
-                             (user=this_user, choice__question=question).choice.id)
+                last_vote = (Vote.objects.values_list('choice_id', flat=True)
+                             .get(user=this_user, question=question))
             except Vote.DoesNotExist:
                 last_vote = None
         return render(request, self.template_name,
@@ -81,60 +119,411 @@ class ResultsView(generic.DetailView):
     template_name = 'polls/results.html'
 
     def get_queryset(self):
-        """Exclude unpublished questions."""
-        published_question_list = [q.pk for q in Question.objects.all()
-                                   if q.is_published()]
-        return Question.objects.filter(pk__in=published_question_list)
+        """Exclude scheduled questions, after bringing the stored statuses up to date."""
+        refresh_statuses_if_due()
+        return Question.objects.visible()
+
+    def get_context_data(self, **kwargs):
+        """Add the cached vote tallies, computed only if the cached fragment is missing."""
+        context = super().get_context_data(**kwargs)
+        question_id = self.object.id
+        context['results'] = SimpleLazyObject(lambda: get_results(question_id))
+        context['results_fragment_key'] = results_fragment_key(question_id)
+        context['results_fragment_timeout'] = results_fragment_timeout()
+        return context
+
 
+def results_payload(question, results):
+    """Return the JSON-serializable results of a question."""
+    return {
+        'id': question.id,
+        'question_text': question.question_text,
+        'choices': results['choices'],
+        'total': results['total'],
+    }
 
-def get_client_ip(request):
-    """Get the visitor’s IP address using request headers."""
-    x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
-    if x_forwarded_for:
-        ip = x_forwarded_for.split(',')[0]
+
+MAX_PAGE_SIZE = 100
+
+
+def question_payload(question):
+    """Return the JSON-serializable listing of a question."""
+    return {
+        'id': question.id,
+        'question_text': question.question_text,
+        'pub_date': question.pub_date,
+        'end_date': question.end_date,
+        'status': question.status,
+    }
+
+
+@require_GET
+def questions_json(request):
+    """
+    Return a page of the published questions, newest first, as JSON.
+
+    ?q= searches the question texts, ?limit= sets the page size, and the
+    `next` and `previous` cursors of the response are passed back as
+    ?after= and ?before= to get the neighbouring pages.
+    """
+    try:
+        size = int(request.GET.get('limit', settings.POLLS_INDEX_PAGE_SIZE))
+    except ValueError:
+        size = 0
+    if not 0 < size <= MAX_PAGE_SIZE:
+        return JsonResponse({'error': f"Give a limit of 1 to {MAX_PAGE_SIZE}."}, status=400)
+    arguments = index_arguments(request)
+    try:
+        if size == settings.POLLS_INDEX_PAGE_SIZE:
+            page = get_index_page(**arguments)
+        else:
+            refresh_statuses_if_due()
+            questions = search_questions(Question.objects.visible(), arguments['query'])
+            page = get_page(questions, arguments['after'], arguments['before'], size)
+    except InvalidCursor as error:
+        return JsonResponse({'error': str(error)}, status=400)
+    return JsonResponse({
+        'questions': [question_payload(question) for question in page.questions],
+        'next': page.next_cursor,
+        'previous': page.previous_cursor,
+    })
+
+
+def load_published_questions(request, question_ids):
+    """
+    Return {pk: Question} of the published questions among `question_ids`.
+
+    The questions are kept on the request, so that the ETag check and the
+    view share one query.
+    """
+    if not hasattr(request, 'published_questions'):
+        request.published_questions = Question.objects.published().in_bulk(question_ids)
+    return request.published_questions
+
+
+def results_etag(request, pk):
+    """
+    Return the ETag of a question's JSON results, derived from its results version.
+
+    Return None for unknown and unpublished questions, so their 404 leaves
+    the cache alone.
+    """
+    if pk not in load_published_questions(request, [pk]):
+        return None
+    return f"results-{pk}-{get_results(pk)['version']}"
+
+
+@require_GET
+@condition(etag_func=results_etag)
+def results_json(request, pk):
+    """Return the vote tallies of a published question as JSON."""
+    question = load_published_questions(request, [pk]).get(pk)
+    if question is None:
+        raise Http404("No question found.")
+    return JsonResponse(results_payload(question, get_results(pk)))
+
+
+MAX_BULK_RESULTS = 100
+
+
+def parse_question_ids(request):
+    """
+    Return the question ids listed in the `ids` query parameter, e.g. ?ids=1,2,3.
+
+    Return None if the parameter is missing, malformed or lists more than
+    MAX_BULK_RESULTS ids.
+    """
+    try:
+        question_ids = [int(pk) for pk in request.GET['ids'].split(',')]
+    except (KeyError, ValueError):
+        return None
+    if not 0 < len(question_ids) <= MAX_BULK_RESULTS:
+        return None
+    return list(dict.fromkeys(question_ids))
+
+
+def bulk_results_etag(request):
+    """Return the ETag of a bulk results response, derived from every listed results version."""
+    question_ids = parse_question_ids(request)
+    if question_ids is None:
+        return None
+    questions = load_published_questions(request, question_ids)
+    results = get_many_results(questions.keys())
+    versions = ','.join(f"{pk}:{results[pk]['version']}" for pk in question_ids
+                        if pk in questions)
+    return 'results-' + hashlib.sha1(versions.encode()).hexdigest()
+
+
+@require_GET
+@condition(etag_func=bulk_results_etag)
+def bulk_results_json(request):
+    """Return the vote tallies of several published questions, e.g. ?ids=1,2,3, as JSON."""
+    question_ids = parse_question_ids(request)
+    if question_ids is None:
+        return JsonResponse({'error': f"Give 1 to {MAX_BULK_RESULTS} question ids "
+                                      f"as ?ids=1,2,3."}, status=400)
+    questions = load_published_questions(request, question_ids)
+    results = get_many_results(questions.keys())
+    return JsonResponse({'questions': [results_payload(questions[pk], results[pk])
+                                       for pk in question_ids if pk in questions]})
+
+
+# Matches an Accept-Encoding header that accepts gzip.
+ACCEPTS_GZIP = re.compile(r'\bgzip\b')
+
+
+def load_dashboard(request):
+    """
+    Return the Dashboard a request asks for, or None if its ?ids= is malformed.
+
+    ?ids=1,2,3 shows those questions, and no ?ids= or ?ids=open shows all
+    open questions. The dashboard is kept on the request, so that the ETag
+    check and the view share it.
+    """
+    if not hasattr(request, 'dashboard'):
+        if request.GET.get('ids', 'open') == 'open':
+            request.dashboard = get_dashboard()
+        else:
+            question_ids = parse_question_ids(request)
+            request.dashboard = get_dashboard(question_ids) if question_ids else None
+    return request.dashboard
+
+
+def dashboard_etag(request):
+    """Return the weak ETag of a dashboard, weak as the body may be sent gzipped or not."""
+    dashboard = load_dashboard(request)
+    return f'W/"{dashboard.etag}"' if dashboard is not None else None
+
+
+@require_GET
+@condition(etag_func=dashboard_etag)
+def dashboard_json(request):
+    """
+    Return the vote tallies of several questions, or of all open ones, as JSON.
+
+    Clients that accept gzip get the cached compressed body as it is.
+    """
+    dashboard = load_dashboard(request)
+    if dashboard is None:
+        return JsonResponse({'error': f"Give 1 to {MAX_BULK_RESULTS} question ids "
+                                      f"as ?ids=1,2,3, or ?ids=open."}, status=400)
+    if ACCEPTS_GZIP.search(request.META.get('HTTP_ACCEPT_ENCODING', '')):
+        response = HttpResponse(dashboard.body, content_type='application/json')
+        response['Content-Encoding'] = 'gzip'
     else:
-        ip = request.META.get('REMOTE_ADDR')
-    return ip
+        response = HttpResponse(dashboard.json(), content_type='application/json')
+    patch_vary_headers(response, ['Accept-Encoding'])
+    return response
+
+
+@require_GET
+def dashboard(request):
+    """Show the vote tallies of several questions, or of all open ones, on one page."""
+    board = load_dashboard(request)
+    if board is None:
+        return HttpResponseBadRequest(f"Give 1 to {MAX_BULK_RESULTS} question ids "
+                                      f"as ?ids=1,2,3, or ?ids=open.")
+    return render(request, 'polls/dashboard.html', {'questions': board.data()['questions']})
+
+
+def sse_event(event, data):
+    """Return a Server-Sent Events message of type `event` carrying `data` as JSON."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def results_stream(request, pk):
+    """
+    Stream the tallies of a published question as Server-Sent Events.
+
+    The stream starts with a `results` event holding the full results, followed
+    by `delta` events with the vote count changes of each choice. Changes that
+    arrive while the client is slow are merged into a single `delta` event.
+
+    Holding streams open needs an ASGI server. Under WSGI the response carries
+    only the `results` event and asks the client to reconnect after
+    POLLS_STREAM_HEARTBEAT seconds, so the stream degrades to polling.
+    """
+    try:
+        question = await Question.objects.published().aget(pk=pk)
+    except Question.DoesNotExist:
+        raise Http404("No question found.")
+    if not isinstance(request, ASGIRequest):
+        results = await sync_to_async(get_results)(question.id)
+        retry = int(settings.POLLS_STREAM_HEARTBEAT * 1000)
+        return HttpResponse(f"retry: {retry}\n" + sse_event('results', results_payload(question, results)),
+                            content_type='text/event-stream')
+    response = StreamingHttpResponse(ResultsEventStream(question),
+                                     content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+class ResultsEventStream:
+    """The Server-Sent Events of one client's results stream."""
+
+    def __init__(self, question):
+        """Subscribe to the tally changes of `question`."""
+        self.question = question
+        self.subscription = broadcaster.subscribe(question.id)
+
+    def close(self):
+        """Unsubscribe; called by the response once the client has disconnected."""
+        broadcaster.unsubscribe(self.question.id, self.subscription)
+
+    async def __aiter__(self):
+        """Yield the stream's events until the client disconnects."""
+        snapshot_version = None
+        try:
+            while True:
+                update = await self.subscription.wait(settings.POLLS_STREAM_HEARTBEAT)
+                if update is None:
+                    # Votes written by other server processes are not published
+                    # here; they show as a newer results version.
+                    if (snapshot_version is None or snapshot_version == await sync_to_async(
+                            get_results_version)(self.question.id)):
+                        yield ": keep-alive\n\n"
+                        continue
+                    update = (True, None, None, None)
+                resync, deltas, min_version, max_version = update
+                # The deltas apply only if they start right after the results
+                # sent last. Older versions may already be part of them, and a
+                # gap means votes, e.g. of another process, were not published
+                # here; either way, the full results are sent again.
+                if snapshot_version is None or min_version != snapshot_version + 1:
+                    resync = True
+                if resync:
+                    results = await sync_to_async(get_results)(self.question.id)
+                    snapshot_version = results['version']
+                    yield sse_event('results', results_payload(self.question, results))
+                    continue
+                snapshot_version = max_version
+                if deltas:
+                    yield sse_event('delta', {
+                        'id': self.question.id,
+                        'version': max_version,
+                        'choices': {str(pk): change for pk, change in deltas.items()},
+                        'total': sum(deltas.values()),
+                    })
+        finally:
+            self.close()
+
+
+@staff_member_required
+def cache_stats(request):
+    """Return the hit and miss counters of this process's polls caches as JSON."""
+    return JsonResponse(polls_cache.stats.snapshot())
+
+
+@never_cache
+@require_GET
+def metrics(request):
+    """
+    Return the request and cache metrics of this process in the Prometheus text format.
+
+    A scraper authenticates with an `Authorization: Bearer` header carrying
+    POLLS_METRICS_TOKEN; otherwise only staff members may read the metrics.
+    """
+    token = settings.POLLS_METRICS_TOKEN
+    authorization = request.headers.get('Authorization', '')
+    if not (token and constant_time_compare(authorization, f'Bearer {token}')
+            or request.user.is_active and request.user.is_staff):
+        return HttpResponse("Not authorized to read the metrics.\n", status=403,
+                            content_type='text/plain')
+    return HttpResponse(metrics_registry.render(polls_cache.stats.snapshot()),
+                        content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+HEALTH_CHECK_CACHE_KEY = 'polls:health-check'
+
+
+@never_cache
+@require_GET
+def health_check(request):
+    """
+    Report whether this server can reach its database and cache.
+
+    Return 200 with a JSON status of each when both work, else 503, so load
+    balancers and container health checks stop routing requests here.
+    """
+    checks = {'database': 'ok', 'cache': 'ok'}
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+    except DatabaseError as error:
+        logger.error(f"Health check: database unavailable: {error}")
+        checks['database'] = 'unavailable'
+    try:
+        cache.set(HEALTH_CHECK_CACHE_KEY, 1, timeout=10)
+        if cache.get(HEALTH_CHECK_CACHE_KEY) != 1:
+            raise ValueError('value was not stored')
+    except Exception as error:
+        logger.error(f"Health check: cache unavailable: {error}")
+        checks['cache'] = 'unavailable'
+    healthy = all(status == 'ok' for status in checks.values())
+    return JsonResponse({'status': 'ok' if healthy else 'unavailable', **checks},
+                        status=200 if healthy else 503)
 
 
 logger = logging.getLogger('polls')
 
 
+def log_fields(event, user, ip_address, **fields):
+    """Return the structured `extra` fields of a log record about `user`."""
+    return {'event': event, 'user_id': getattr(user, 'pk', None), 'ip': ip_address, **fields}
+
+
 @login_required
 def vote(request, question_id):
     """Handle voting for a specific question."""
-    question = get_object_or_404(Question, pk=question_id)
     this_user = request.user
     ip_address = get_client_ip(request)
 
     try:
-        selected_choice = question.choice_set.get(pk=request.POST['choice'])
-    except (KeyError, Choice.DoesNotExist):
-        logger.warning(f"{this_user} failed to vote in {question} "
-                       f"from {ip_address}")
+        # The choice and its question are read with one query.
+        selected_choice = Choice.objects.select_related('question').get(
+            pk=request.POST['choice'], question_id=question_id)
+        question = selected_choice.question
+    except (KeyError, ValueError, Choice.DoesNotExist):
+        question = get_object_or_404(Question, pk=question_id)
+        logger.warning("%s failed to vote in %s from %s",
+                       this_user.username, question.question_text, ip_address,
+                       extra=log_fields('vote_failed', this_user, ip_address,
+                                        question_id=question.id))
         return render(request, 'polls/detail.html', {
             'question': question,
             'error_message': "You didn't select a choice.",
         })
 
-    # Get the user's vote
-    try:
-        user_vote = Vote.objects.get(user=this_user, choice__question=question)
-        # user has a vote for this question! Update his choice.
-        user_vote.choice = selected_choice
-        user_vote.save()
-        logger.info(f'{this_user} voted for Choice {selected_choice.id} '
-                    f'in Question {question.id} from {ip_address}')
-        messages.success(request, f"Your vote was updated to "
-                                  f"'{selected_choice.choice_text}'")
-    except Vote.DoesNotExist:
-        # does not have a vote yet
-        Vote.objects.create(user=this_user, choice=selected_choice)
-        # automatically saved
-        logger.info(f'{this_user} voted for Choice {selected_choice.id} '
-                    f'in Question {question.id} from {ip_address}')
+    if settings.POLLS_VOTE_BUFFER_ENABLED:
+        get_vote_buffer().submit(this_user.id, question.id, selected_choice.id)
+        logger.info("%s voted for Choice %s in Question %s from %s (buffered)",
+                    this_user.username, selected_choice.id, question.id, ip_address,
+                    extra=log_fields('vote', this_user, ip_address, question_id=question.id,
+                                     choice_id=selected_choice.id, buffered=True))
+        messages.success(request, f"Your vote for "
+                                  f"'{selected_choice.choice_text}' was received")
+        return HttpResponseRedirect(reverse('polls:results', args=(question_id,)))
+
+    previous_choice_id = Vote.objects.record(this_user, selected_choice)
+    version = bump_results_version(question.id)
+    if previous_choice_id != selected_choice.id:
+        deltas = {selected_choice.id: 1}
+        if previous_choice_id is not None:
+            deltas[previous_choice_id] = -1
+        broadcaster.publish(question.id, version, deltas)
+
+    logger.info("%s voted for Choice %s in Question %s from %s",
+                this_user.username, selected_choice.id, question.id, ip_address,
+                extra=log_fields('vote', this_user, ip_address, question_id=question.id,
+                                 choice_id=selected_choice.id,
+                                 previous_choice_id=previous_choice_id))
+    if previous_choice_id is None:
         messages.success(request, f"You voted for "
                                   f"'{selected_choice.choice_text}'")
+    else:
+        messages.success(request, f"Your vote was updated to "
+                                  f"'{selected_choice.choice_text}'")
 
     return HttpResponseRedirect(reverse('polls:results', args=(question_id,)))
 
@@ -143,18 +532,21 @@ def vote(request, question_id):
 def log_user_login(request, user, **kwargs):
     """Log a message when a user successfully logs in."""
     ip_address = get_client_ip(request)
-    logger.info(f'{user} logged in from {ip_address}')
+    logger.info("%s logged in from %s", user.username, ip_address,
+                extra=log_fields('login', user, ip_address))
 
 
 @receiver(user_logged_out)
 def log_user_logout(request, user, **kwargs):
     """Log a message when a user successfully logs out."""
     ip_address = get_client_ip(request)
-    logger.info(f'{user} logged out from {ip_address}')
+    logger.info("%s logged out from %s", getattr(user, 'username', None), ip_address,
+                extra=log_fields('logout', user, ip_address))
 
 
 @receiver(user_login_failed)
 def log_user_login_failed(request, **kwargs):
-    """Log a message when a user login attempt fails."""
-    ip_address = get_client_ip(request)
-    logger.warning(f'User failed to log in from {ip_address}')
+    """Log a message when a user login attempt fails; floods are rate limited in LOGGING."""
+    ip_address = get_client_ip(request) if request is not None else None
+    logger.warning("User failed to log in from %s", ip_address,
+                   extra=log_fields('login_failed', None, ip_address))